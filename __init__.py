@@ -17,11 +17,35 @@
 #             https://github.com/cloudflare/sqlalchemy-clickhouse
 
 
-from . import common
-from . import dialect
-from . import connection
-from . import cursor
-from . import model
+import importlib
 
 
-__version__ = '.'.join('%d' % v for v in common.VERSION[0:3])
\ No newline at end of file
+# Submodules and names are imported on first access (PEP 562), so importing the package doesn't
+# load SQLAlchemy, requests or infi.clickhouse_orm until they are needed.
+
+_submodules = ('common', 'dialect', 'connection', 'cursor', 'model')
+
+# name -> submodule defining it
+_exports = {
+    'tinybird_pipe': 'pipe',
+    'read_frame': 'frames',
+}
+
+__all__ = list(_submodules) + list(_exports) + ['__version__']
+
+
+def __getattr__(name):
+    if name in _submodules:
+        value = importlib.import_module('.' + name, __package__)
+    elif name in _exports:
+        value = getattr(importlib.import_module('.' + _exports[name], __package__), name)
+    elif name == '__version__':
+        value = '.'.join('%d' % v for v in importlib.import_module('.common', __package__).VERSION[0:3])
+    else:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
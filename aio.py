@@ -0,0 +1,500 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
+#             https://github.com/cloudflare/sqlalchemy-clickhouse
+#             https://github.com/sqlalchemy/sqlalchemy (aiosqlite dialect)
+
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+import uuid
+
+from sqlalchemy.engine.interfaces import AdaptedConnection
+from sqlalchemy.util.concurrency import await_fallback, await_only
+
+from budget import ReadBudget, estimated_rows
+from cache import ResultCache, cache_key, get_cache, settings_key
+from converters import convert_rows, row_converter
+import error
+from instrument import QueryReport, QueryTimings, notify
+from param_escaper import ParamEscaper
+from result import RowBuffer
+import transport
+
+
+_escaper = ParamEscaper()
+
+
+class AsyncConnection(object):
+    """
+        Non-blocking counterpart of :class:`connection.Connection`, built on aiohttp.
+    """
+    # Bytes read from the socket at a time when streaming results
+    stream_chunk_size: int = 64 * 1024
+
+    def __init__(self, db_url: str = 'https://api.tinybird.co/', token: str = None, timeout: float = 60,
+                 pool_connections: Optional[int] = None, pool_maxsize: Optional[int] = None, pool_block: bool = False,
+                 keep_alive: bool = True, idle_timeout: Optional[float] = None, query_method: str = 'get',
+                 compression: Optional[str] = None, compress_threshold: int = transport.DEFAULT_COMPRESS_THRESHOLD,
+                 cache: Union[str, ResultCache, None] = None, cache_ttl: float = 0, cache_max_bytes: Optional[int] = None,
+                 cache_dir: Optional[str] = None, max_retries: int = transport.DEFAULT_MAX_RETRIES,
+                 rate_limit: Optional[float] = None, settings: Optional[Dict[str, Any]] = None,
+                 max_rows_read: Optional[int] = None, max_bytes_read: Optional[int] = None,
+                 max_execution_time: Optional[float] = None, budget_preflight: Optional[bool] = None,
+                 budget_mode: Optional[str] = None, ingest_max_rows: Optional[int] = None,
+                 ingest_max_bytes: Optional[int] = None, ingest_flush_interval: Optional[float] = None):
+        if (ingest_max_rows, ingest_max_bytes, ingest_flush_interval) != (None, None, None):
+            raise error.NotSupportedError("The async driver doesn't ingest events, so it takes no ingest_max_rows, "
+                                          "ingest_max_bytes or ingest_flush_interval")
+        self.token = token
+        self.api_url = db_url.rstrip('/')
+        self.db_url = f"{self.api_url}/v0/sql"
+        self.timeout = timeout
+        self.query_method = query_method.lower()
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        if isinstance(cache, str):
+            cache = get_cache(cache, max_bytes=cache_max_bytes, directory=cache_dir)
+        self.result_cache: Optional[ResultCache] = cache
+        self.cache_ttl = cache_ttl
+        self.settings = dict(transport.DEFAULT_SETTINGS, **(settings or {}))
+        self.read_budget: Optional[ReadBudget] = None
+        if (max_rows_read, max_bytes_read, max_execution_time) != (None, None, None):
+            self.read_budget = ReadBudget(max_rows_read, max_bytes_read, max_execution_time,
+                                          preflight=budget_preflight, mode=budget_mode)
+        self.max_retries = max_retries
+        # Shared with the threaded connections using the same token
+        self.rate_limiter = transport.get_bucket(db_url, token, rate_limit)
+        self._session = None
+        # aiohttp sessions are bound to a loop, so pool options apply per connection
+        self._connector_args = {
+            'limit': pool_maxsize or transport.DEFAULT_POOL_MAXSIZE,
+            'force_close': not keep_alive,
+        }
+        if keep_alive and idle_timeout is not None:
+            self._connector_args['keepalive_timeout'] = idle_timeout
+
+    def _get_session(self):
+        # The session binds to the running loop, so it can only be created from a coroutine
+        if self._session is None:
+            import aiohttp
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+            connector = aiohttp.TCPConnector(**self._connector_args)
+            self._session = aiohttp.ClientSession(timeout=timeout, connector=connector)
+        return self._session
+
+    async def _query(self, query: str, fmt: str, settings: Optional[Dict[str, Any]] = None,
+                     report: Optional[QueryReport] = None):
+        # A trailing semicolon would end the statement before its FORMAT clause
+        query = f"{query.rstrip().rstrip(';')} FORMAT {fmt}"
+        req_params = transport.settings_params(dict(self.settings, **settings) if settings else self.settings)
+        req_headers = {}
+        body = None
+        if self.query_method == 'post':
+            body, encoding = transport.encode_body(query.encode('utf-8'), self.compression, self.compress_threshold)
+            req_headers['Content-Type'] = 'text/plain; charset=utf-8'
+            if encoding:
+                req_headers['Content-Encoding'] = encoding
+        else:
+            req_params['q'] = query
+        return await self._send(self.db_url, req_params, req_headers, body, report)
+
+    async def _send(self, url: str, params: Dict[str, str], headers: Dict[str, str], body: Optional[bytes],
+                    report: Optional[QueryReport]):
+        """ Sends a GET request, or a POST one with ``body``, and returns its successful response.
+
+        Same policy as :func:`transport.send`, without blocking the loop. The time until the
+        response headers arrive, including opening the connection, is added to the ``ttfb``
+        phase of ``report``.
+        """
+        # aiohttp negotiates and decodes gzip/deflate responses on its own
+        headers = dict(headers, Authorization=f'Bearer {self.token}')
+        session = self._get_session()
+        import aiohttp
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            delay = self.rate_limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                if body is not None:
+                    r = await session.post(url, params=params, data=body, headers=headers)
+                else:
+                    r = await session.get(url, params=params, headers=headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise error.OperationalError(str(e)) from e
+                delay = None
+            else:
+                transport.update_bucket(self.rate_limiter, r.headers)
+                if r.status < 400:
+                    if report is not None:
+                        report.timings.ttfb += time.perf_counter() - start
+                        report.update_from_headers(r.headers)
+                    return r
+                delay = transport.retry_after(r.headers)
+                if r.status == 429:
+                    self.rate_limiter.block(delay if delay is not None else transport.backoff(attempt))
+                if attempt >= self.max_retries or not transport.retryable(r.status, True):
+                    text = await r.text()
+                    r.release()
+                    raise transport.error_for(r.status, text, r.headers)
+                r.release()
+            await asyncio.sleep(max(delay or 0.0, transport.backoff(attempt)))
+            attempt += 1
+
+    async def select_rows(self, query: str, settings: Optional[Dict[str, Any]] = None, stream: bool = False,
+                          cache_ttl: Optional[float] = None,
+                          report: Optional[QueryReport] = None) -> Tuple[List[Tuple[str, str]], Union[RowBuffer, 'AsyncRowStream']]:
+        """ Runs ``query`` and returns its ``(name, type)`` columns and its rows as plain tuples.
+
+        With ``stream=True`` rows are returned as an :class:`AsyncRowStream` that parses them as
+        they arrive. Otherwise results are cached as in :meth:`connection.Connection.select_rows`.
+        The statistics and timings of the query are kept in ``report``, if given, and sent to
+        the listeners of :mod:`instrument`.
+        """
+        if report is None:
+            report = QueryReport(query=query)
+        if stream:
+            r = await self._query(query, 'JSONCompactEachRowWithNamesAndTypes', settings, report)
+            try:
+                lines = self._iter_lines(r)
+                names = json.loads(await lines.__anext__())
+                types = json.loads(await lines.__anext__())
+            except:
+                r.close()
+                raise
+            columns = list(zip(names, types))
+            return columns, AsyncRowStream(r, lines, row_converter(columns), report)
+
+        if cache_ttl is None:
+            cache_ttl = self.cache_ttl
+        key = None
+        if self.result_cache is not None and cache_ttl > 0:
+            key = cache_key(query, self.token, self.db_url, settings_key(dict(self.settings, **(settings or {}))))
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached[0], self._cached_rows(cached, report)
+
+        result = await self._read_json(await self._query(query, 'JSONCompact', settings, report), report)
+        columns = [(f['name'], f['type']) for f in result['meta']]
+        if key is not None:
+            self.result_cache.set(key, (columns, result['data']), cache_ttl)
+        with report.timings.measure('materialize'):
+            rows = RowBuffer(convert_rows(columns, result['data']))
+        notify(report)
+        return columns, rows
+
+    async def select_pipe(self, name: str, params: Optional[Dict[str, Any]] = None, cache_ttl: Optional[float] = None,
+                          report: Optional[QueryReport] = None) -> Tuple[List[Tuple[str, str]], RowBuffer]:
+        """ Reads the endpoint of the published Pipe ``name`` with ``params``, as
+        :meth:`connection.Connection.select_pipe` does.
+        """
+        if cache_ttl is None:
+            cache_ttl = self.cache_ttl
+        from pipe import encode_params
+        params = encode_params(params or {})
+        if report is None:
+            report = QueryReport(query=f'pipe {name}')
+        key = None
+        if self.result_cache is not None and cache_ttl > 0:
+            key = cache_key(f'pipe {name}', self.token, self.api_url, settings_key(dict(self.settings, **params)))
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached[0], self._cached_rows(cached, report)
+
+        r = await self._send(f'{self.api_url}/v0/pipes/{name}.json', params, {}, None, report)
+        result = await self._read_json(r, report)
+        columns = [(f['name'], f['type']) for f in result['meta']]
+        with report.timings.measure('materialize'):
+            names = [c[0] for c in columns]
+            rows = [[row[n] for n in names] for row in result['data']]
+            if key is not None:
+                self.result_cache.set(key, (columns, rows), cache_ttl)
+            buffer = RowBuffer(convert_rows(columns, rows))
+        notify(report)
+        return columns, buffer
+
+    async def _read_json(self, r, report: QueryReport) -> Dict[str, Any]:
+        """ Reads and decodes a ``JSON*`` response, keeping its statistics in ``report`` """
+        with report.timings.measure('download'):
+            content = await r.read()
+        with report.timings.measure('decode'):
+            result = json.loads(content)
+        report.update(result)
+        return result
+
+    def _cached_rows(self, cached: Tuple[List[Tuple[str, str]], List[Any]], report: QueryReport) -> RowBuffer:
+        report.cached = True
+        report.rows = len(cached[1])
+        with report.timings.measure('materialize'):
+            rows = RowBuffer(convert_rows(*cached))
+        notify(report)
+        return rows
+
+    async def _iter_lines(self, r) -> AsyncIterator[bytes]:
+        """ Yields the non-empty lines of a streamed response """
+        pending = b''
+        async for chunk in r.content.iter_chunked(self.stream_chunk_size):
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                if line:
+                    yield line
+        if pending:
+            yield pending
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncRowStream(object):
+    """ Rows of a streamed response, parsed as they are fetched.
+
+    Like those of streamed sync results, the phases of the query are known once the rows are
+    exhausted or closed, when its report is sent to the listeners of :mod:`instrument`.
+    """
+
+    def __init__(self, response, lines: AsyncIterator[bytes],
+                 convert: Optional[Callable[[List[Any]], Tuple[Any, ...]]] = None,
+                 report: Optional[QueryReport] = None):
+        self._response = response
+        self._lines = lines
+        self._convert = convert or tuple
+        self._report = report
+        self._rows = 0
+
+    async def _next(self) -> Optional[Tuple[Any, ...]]:
+        start = time.perf_counter()
+        try:
+            async for line in self._lines:
+                self._rows += 1
+                return self._convert(json.loads(line))
+        finally:
+            if self._report is not None:
+                self._report.timings.download += time.perf_counter() - start
+        self.close()
+        return None
+
+    async def fetchone(self) -> Optional[Tuple[Any, ...]]:
+        return await self._next()
+
+    async def fetchmany(self, size: int) -> List[Tuple[Any, ...]]:
+        rows = []
+        while len(rows) < size:
+            row = await self._next()
+            if row is None:
+                break
+            rows.append(row)
+        return rows
+
+    async def fetchall(self) -> List[Tuple[Any, ...]]:
+        start = time.perf_counter()
+        rows = [self._convert(json.loads(line)) async for line in self._lines]
+        self._rows += len(rows)
+        if self._report is not None:
+            self._report.timings.download += time.perf_counter() - start
+        self.close()
+        return rows
+
+    def close(self):
+        self._response.close()
+        report, self._report = self._report, None
+        if report is not None:
+            report.rows = self._rows
+            notify(report)
+
+
+class AsyncAdapt_tinybird_cursor(object):
+    """ DB-API cursor facade used by SQLAlchemy on top of :class:`AsyncConnection` """
+    server_side = False
+
+    def __init__(self, adapt_connection: 'AsyncAdapt_tinybird_connection'):
+        self._adapt_connection = adapt_connection
+        self._connection: AsyncConnection = adapt_connection._connection
+        self.await_ = adapt_connection.await_
+        self.arraysize = 1
+        self.rowcount = -1
+        self.lastrowid = None
+        self.description = None
+        self.cache_ttl: Optional[float] = None
+        self.settings: Optional[Dict[str, Any]] = None
+        # Pipe whose endpoint answers the next execute, instead of the SQL API
+        self.pipe: Optional[str] = None
+        # Read budget of the queries run by this cursor, on top of the connection's
+        self.read_budget: Optional[ReadBudget] = None
+        # Set by tinybird_columnar, which needs the threaded driver
+        self.columnar = False
+        # Statistics and timings of the last statement
+        self.report: Optional[QueryReport] = None
+        self._rows = None
+
+    @property
+    def statistics(self) -> Dict[str, Any]:
+        """ Statistics of the last query reported by the server, see :attr:`cursor.Cursor.statistics` """
+        return self.report.statistics if self.report is not None else {}
+
+    @property
+    def timings(self) -> Optional[QueryTimings]:
+        """ Client-side time spent in each phase of the last query, see :class:`instrument.QueryTimings` """
+        return self.report.timings if self.report is not None else None
+
+    def execute(self, operation, parameters=None):
+        if self.columnar:
+            raise error.NotSupportedError("Columnar results need the threaded driver")
+        if self.pipe is not None:
+            pipe, self.pipe = self.pipe, None
+            return self.execute_pipe(pipe)
+        # SQLAlchemy passes parameters (maybe empty) whenever it doubled the % of the statement
+        if parameters is not None:
+            operation = operation % _escaper.escape_args(parameters)
+        self.close()
+        query_id = str(uuid.uuid1())
+        settings = dict(self.settings or (), query_id=query_id)
+        self.report = report = QueryReport(query_id, operation)
+        budget = self._budget()
+        if budget is not None:
+            if budget.preflight:
+                estimate = self.await_(self._connection.select_rows(
+                    'EXPLAIN ESTIMATE ' + operation, settings=self.settings, cache_ttl=0))
+                budget.check_estimate(estimated_rows(*estimate), query_id)
+            settings.update(budget.settings())
+        try:
+            columns, self._rows = self.await_(self._connection.select_rows(
+                operation, settings=settings, stream=self.server_side, cache_ttl=self.cache_ttl, report=report))
+        except error.DatabaseError as e:
+            exceeded = budget.exceeded_error(e) if budget is not None else None
+            if exceeded is None:
+                raise
+            raise exceeded from e
+        if budget is not None:
+            budget.check_statistics(report.statistics, query_id)
+        self._set_result(columns, report)
+
+    def execute_pipe(self, name: str, params: Optional[Dict[str, Any]] = None):
+        """ Reads the endpoint of the published Pipe ``name``, as :meth:`cursor.Cursor.execute_pipe` does """
+        self.close()
+        self.report = report = QueryReport(query='pipe {}'.format(name))
+        columns, self._rows = self.await_(self._connection.select_pipe(
+            name, dict(self.settings or (), **(params or {})), cache_ttl=self.cache_ttl, report=report))
+        self._set_result(columns, report)
+
+    def _set_result(self, columns: List[Tuple[str, str]], report: QueryReport):
+        self.rowcount = report.rows if report.rows is not None else -1
+        self.description = [
+            # name, type_code, display_size, internal_size, precision, scale, null_ok
+            (name, type_code, None, None, None, None, True) for name, type_code in columns
+        ]
+
+    def _budget(self) -> Optional[ReadBudget]:
+        """ The read budget of the next query: the cursor's on top of the connection's """
+        budget = self._connection.read_budget
+        if budget is None:
+            return self.read_budget
+        return budget.merge(self.read_budget)
+
+    def executemany(self, operation, seq_of_parameters):
+        raise error.NotSupportedError("executemany is not supported by the async driver")
+
+    def setinputsizes(self, *inputsizes):
+        pass
+
+    def close(self):
+        if self._rows is not None:
+            self._rows.close()
+            self._rows = None
+
+    def _result(self):
+        if self._rows is None:
+            raise error.ProgrammingError("No result to fetch from: no query yet, or the cursor was closed")
+        return self._rows
+
+    def _fetched(self, rows):
+        return rows
+
+    def fetchone(self):
+        return self._fetched(self._result().fetchone())
+
+    def fetchmany(self, size=None):
+        return self._fetched(self._result().fetchmany(self.arraysize if size is None else size))
+
+    def fetchall(self):
+        return self._fetched(self._result().fetchall())
+
+    def __iter__(self):
+        row = self.fetchone()
+        while row is not None:
+            yield row
+            row = self.fetchone()
+
+
+class AsyncAdapt_tinybird_ss_cursor(AsyncAdapt_tinybird_cursor):
+    """ Cursor that awaits rows from an :class:`AsyncRowStream` as they are fetched """
+    server_side = True
+
+    def _fetched(self, rows):
+        # Pipe endpoints are read whole, even on server-side cursors
+        return self.await_(rows) if asyncio.iscoroutine(rows) else rows
+
+
+class AsyncAdapt_tinybird_connection(AdaptedConnection):
+    await_ = staticmethod(await_only)
+    __slots__ = ('dbapi',)
+
+    def __init__(self, dbapi, connection: AsyncConnection):
+        self.dbapi = dbapi
+        self._connection = connection
+
+    def cursor(self, stream: bool = False):
+        if stream:
+            return AsyncAdapt_tinybird_ss_cursor(self)
+        return AsyncAdapt_tinybird_cursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.await_(self._connection.close())
+
+
+class AsyncAdaptFallback_tinybird_connection(AsyncAdapt_tinybird_connection):
+    __slots__ = ()
+    await_ = staticmethod(await_fallback)
+
+
+class AsyncAdapt_tinybird_dbapi(object):
+    """ Module-like object exposing :class:`AsyncConnection` through the DB-API """
+    apilevel = '2.0'
+    threadsafety = 1
+    paramstyle = 'pyformat'
+
+    Error = error.Error
+    DatabaseError = error.DatabaseError
+    OperationalError = error.OperationalError
+    ProgrammingError = error.ProgrammingError
+    NotSupportedError = error.NotSupportedError
+
+    def connect(self, *args, **kwargs):
+        async_fallback = kwargs.pop('async_fallback', False)
+        if async_fallback in (True, 'true', 'True', '1'):
+            return AsyncAdaptFallback_tinybird_connection(self, AsyncConnection(*args, **kwargs))
+        return AsyncAdapt_tinybird_connection(self, AsyncConnection(*args, **kwargs))
@@ -0,0 +1,93 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Time SQLAlchemy spends compiling a statement per execution with TinybirdDialect,
+without the statement cache ("cold", as before the dialect declared
+``supports_statement_cache``) and with it ("warm"). Every execution uses new
+IN values, which are expanded at execution time and so share the cached
+statement. Statements are built before timing; no HTTP is involved.
+
+    $ python benchmarks/bench_compile.py --executions 2000
+
+Reference run (2000 executions, 50 IN values, SQLAlchemy 1.4.42, CPython 3.11):
+
+    cold     523.5 us/execution
+    warm     230.8 us/execution
+
+Most of the warm time is SQLAlchemy generating the cache key of the statement.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import sqlalchemy as sa
+from sqlalchemy.util import LRUCache
+
+from dialect import TinybirdDialect
+
+
+metadata = sa.MetaData()
+events = sa.Table(
+    'events', metadata,
+    sa.Column('id', sa.Integer), sa.Column('user_id', sa.Integer), sa.Column('browser', sa.String),
+    sa.Column('ts', sa.DateTime), sa.Column('duration', sa.Float))
+users = sa.Table(
+    'users', metadata,
+    sa.Column('id', sa.Integer), sa.Column('country', sa.String), sa.Column('plan', sa.String))
+
+
+def statement(ids, country):
+    return (
+        sa.select(events.c.browser, sa.func.count().label('hits'), sa.func.avg(events.c.duration).label('avg'))
+        .select_from(events.join(users, events.c.user_id == users.c.id))
+        .where(events.c.user_id.in_(ids), users.c.country == country, users.c.plan.notin_(['free', 'trial']))
+        .group_by(events.c.browser)
+        .order_by(sa.desc('hits'))
+        .limit(10)
+    )
+
+
+def run(dialect, executions, values, compiled_cache):
+    statements = [statement(list(range(i, i + values)), 'country%d' % (i % 10)) for i in range(executions)]
+    start = time.perf_counter()
+    for stmt in statements:
+        # What Connection.execute does before sending the statement
+        compiled, extracted, _ = stmt._compile_w_cache(
+            dialect=dialect, compiled_cache=compiled_cache, column_keys=[],
+            for_executemany=False, schema_translate_map=None)
+        params = compiled.construct_params(extracted_parameters=extracted)
+        compiled._process_parameters_for_postcompile(params)
+    return (time.perf_counter() - start) / executions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--executions', type=int, default=2000)
+    parser.add_argument('--values', type=int, default=50, help="values of the IN list")
+    args = parser.parse_args()
+
+    dialect = TinybirdDialect()
+    cold = run(dialect, args.executions, args.values, None)
+    warm = run(dialect, args.executions, args.values, LRUCache(100))
+    print('cold  %8.1f us/execution' % (cold * 1e6))
+    print('warm  %8.1f us/execution' % (warm * 1e6))
+
+
+if __name__ == '__main__':
+    main()
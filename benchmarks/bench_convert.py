@@ -0,0 +1,94 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Time needed to convert a wide, DateTime-heavy result from decoded JSON to
+Python values: with infi model instances, as results with a ``model_class``
+are ("models"), row by row as streamed results are ("rows"), and column by
+column with ``converters.convert_rows`` ("columns"). No HTTP is involved.
+
+    $ python benchmarks/bench_convert.py --rows 100000
+
+Reference run (100k rows of 12 columns, best of 5, CPython 3.11):
+
+    models   6.69 s    rows   0.53 s    columns   0.27 s
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from converters import convert_rows, row_converter
+from model import ad_hoc_model
+
+
+COLUMNS = [
+    ('id', 'UInt64'), ('user_id', 'UInt64'), ('ts', 'DateTime'), ('created', 'DateTime'),
+    ('updated', 'DateTime64(3)'), ('seen', 'Nullable(DateTime)'), ('day', 'Date'), ('amount', 'Decimal(18, 2)'),
+    ('browser', 'LowCardinality(String)'), ('country', 'Nullable(String)'), ('duration', 'Float64'), ('hits', 'UInt32'),
+]
+
+
+def make_rows(n):
+    return [
+        [str(i), str(i * 7), '2022-01-01 00:%02d:%02d' % (i // 60 % 60, i % 60), '2021-12-31 23:59:59',
+         '2022-01-01 00:00:00.%03d' % (i % 1000), None if i % 3 else '2022-01-02 10:00:00', '2022-01-01',
+         i / 4, 'browser%d' % (i % 7), None if i % 5 else 'ES', i / 10, i]
+        for i in range(n)
+    ]
+
+
+def models(rows):
+    model_class = ad_hoc_model(tuple(COLUMNS))
+    names = [name for name, _ in COLUMNS]
+    return [model_class(**dict(zip(names, row))) for row in rows]
+
+
+def by_row(rows):
+    convert = row_converter(COLUMNS)
+    return [convert(row) for row in rows]
+
+
+def by_column(rows):
+    return convert_rows(COLUMNS, rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3, help="runs of each variant; the best one is reported")
+    parser.add_argument('--skip-models', action='store_true', help="skip the infi model run")
+    args = parser.parse_args()
+
+    timings = []
+    for label, run in (('models', models), ('rows', by_row), ('columns', by_column)):
+        if label == 'models' and args.skip_models:
+            timings.append((label, float('nan')))
+            continue
+        best = float('inf')
+        for _ in range(args.repeat):
+            # Fresh rows every time, as columns are converted in place
+            rows = make_rows(args.rows)
+            start = time.perf_counter()
+            run(rows)
+            best = min(best, time.perf_counter() - start)
+        timings.append((label, best))
+    print('    '.join('%s %6.2f s' % timing for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
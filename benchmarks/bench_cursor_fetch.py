@@ -0,0 +1,99 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Time needed to drain a fully fetched result through ``Cursor.fetchone`` and
+``Cursor.fetchmany``, comparing the previous list-popping buffer ("before")
+with ``result.RowBuffer`` ("after"). No HTTP is involved: rows are handed to
+the cursor as already decoded JSON arrays.
+
+    $ python benchmarks/bench_cursor_fetch.py --rows 1000000
+
+Reference run (1M rows, 3 columns, CPython 3.11):
+
+    fetchone         before   256.80 s    after   0.64 s
+    fetchmany(1000)  before    18.63 s    after   0.19 s
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cursor import Cursor
+from result import ResultBuffer, RowBuffer
+
+
+class ListPopBuffer(ResultBuffer):
+    """ The buffer cursors used before RowBuffer: O(n) per fetchone, copies on fetchmany """
+
+    def __init__(self, rows):
+        self._data = rows
+
+    def fetchone(self):
+        return self._data.pop(0) if self._data else None
+
+    def fetchmany(self, size):
+        result, self._data = self._data[:size], self._data[size:]
+        return result
+
+    def fetchall(self):
+        result, self._data = self._data, []
+        return result
+
+
+class FakeConnection(object):
+    read_budget = None
+
+    def __init__(self, rows, buffer_class):
+        self.rows = rows
+        self.buffer_class = buffer_class
+
+    def select_rows(self, query, settings=None, stream=False, cache_ttl=None, report=None):
+        columns = [('id', 'UInt64'), ('name', 'String'), ('ts', 'DateTime')]
+        return columns, self.buffer_class(list(self.rows))
+
+
+def drain(cursor, size):
+    fetch = cursor.fetchone if size is None else lambda: cursor.fetchmany(size)
+    start = time.perf_counter()
+    while fetch():
+        pass
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--skip-before', action='store_true', help="skip the quadratic list.pop(0) run")
+    args = parser.parse_args()
+
+    rows = [[str(i), 'name%d' % i, '2022-01-01 00:00:00'] for i in range(args.rows)]
+    for label, size in (('fetchone', None), ('fetchmany(%d)' % args.batch, args.batch)):
+        timings = []
+        for buffer_class in (ListPopBuffer, RowBuffer):
+            if buffer_class is ListPopBuffer and args.skip_before:
+                timings.append(float('nan'))
+                continue
+            cursor = Cursor(FakeConnection(rows, buffer_class))
+            cursor.execute('SELECT id, name, ts FROM t')
+            timings.append(drain(cursor, size))
+        print('%-16s before %8.2f s    after %6.2f s' % (label, timings[0], timings[1]))
+
+
+if __name__ == '__main__':
+    main()
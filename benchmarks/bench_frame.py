@@ -0,0 +1,114 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Time needed to turn a query response into a DataFrame: from a JSONCompact
+response through rows, as pandas.read_sql builds frames ("records"), and
+from an ArrowStream response through the column buffers, as read_frame
+does for pandas ("arrow") and Polars ("polars"). Both responses are built
+before timing, with the types ClickHouse sends; no HTTP is involved.
+
+    $ python benchmarks/bench_frame.py --rows 1000000
+
+Reference run (1M rows of 6 columns, best of 3, pandas 3.0, polars 2.0,
+pyarrow 26, CPython 3.11):
+
+    records   5.15 s    arrow   0.02 s    polars   0.02 s
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pyarrow as pa
+import pyarrow.ipc
+
+from columnar import arrow_caster
+from converters import convert_rows
+from frames import _arrow_frame, import_pandas
+
+
+COLUMNS = [
+    ('id', 'UInt64'), ('ts', 'DateTime'), ('day', 'Date'), ('browser', 'LowCardinality(String)'),
+    ('duration', 'Float64'), ('hits', 'UInt32'),
+]
+
+
+def make_responses(n):
+    """ Returns the JSONCompact and ArrowStream bodies of the same result """
+    ids = list(range(n))
+    seconds = [1640995200 + i % 86400 for i in ids]
+    days = [18993 + i % 365 for i in ids]
+    browsers = ['browser%d' % (i % 7) for i in ids]
+    durations = [i / 10 for i in ids]
+
+    rows = [
+        [str(i), time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(s)), time.strftime('%Y-%m-%d', time.gmtime(d * 86400)),
+         b, f, i % 1000]
+        for i, s, d, b, f in zip(ids, seconds, days, browsers, durations)
+    ]
+    body = json.dumps({'meta': [{'name': n, 'type': t} for n, t in COLUMNS], 'data': rows, 'rows': n}).encode()
+
+    # ClickHouse sends DateTime as uint32 and Date as uint16
+    table = pa.table({
+        'id': pa.array(ids, pa.uint64()), 'ts': pa.array(seconds, pa.uint32()), 'day': pa.array(days, pa.uint16()),
+        'browser': pa.array(browsers, pa.string()), 'duration': pa.array(durations, pa.float64()),
+        'hits': pa.array([i % 1000 for i in ids], pa.uint32()),
+    })
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=65536)
+    return body, sink.getvalue()
+
+
+def records(body, _):
+    result = json.loads(body)
+    rows = convert_rows([(f['name'], f['type']) for f in result['meta']], result['data'])
+    return import_pandas().DataFrame.from_records(rows, columns=[name for name, _ in COLUMNS])
+
+
+def arrow(_, stream, backend='pandas'):
+    table = pa.ipc.open_stream(stream).read_all()
+    return _arrow_frame(arrow_caster(table.schema, COLUMNS)(table), backend)
+
+
+def polars(body, stream):
+    return arrow(body, stream, 'polars')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3, help="runs of each variant; the best one is reported")
+    args = parser.parse_args()
+
+    body, stream = make_responses(args.rows)
+    timings = []
+    for label, run in (('records', records), ('arrow', arrow), ('polars', polars)):
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            run(body, stream)
+            best = min(best, time.perf_counter() - start)
+        timings.append((label, best))
+    print('    '.join('%s %6.2f s' % timing for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Cold-start cost of the connector: time to import the package, the DB-API
+Connection and Cursor, and to create an engine, each in a fresh interpreter,
+checked against a budget.
+
+    $ python benchmarks/bench_import.py
+    $ python benchmarks/bench_import.py --scale 2    # on a slower machine
+
+A case fails when its best time is over its budget times ``--scale``, or
+when it loads modules it must not (the package and the DB-API path must not
+load SQLAlchemy or infi.clickhouse_orm); the run then exits with status 1.
+
+Reference run (best of 9, SQLAlchemy 1.4, requests 2.28, CPython 3.11):
+
+    package      0.9 ms    dbapi    137 ms    engine    299 ms
+
+and before imports were lazy, when the package loaded the dialect, SQLAlchemy
+and infi.clickhouse_orm (and with it pkg_resources):
+
+    package      519 ms    dbapi    485 ms    engine    462 ms
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# The package is loaded from the source tree under its installed name
+_package = """
+import importlib.util, sys
+spec = importlib.util.spec_from_file_location(
+    'sqlalchemy_tinybird', {init!r}, submodule_search_locations=[{root!r}])
+module = importlib.util.module_from_spec(spec)
+sys.modules['sqlalchemy_tinybird'] = module
+spec.loader.exec_module(module)
+"""
+
+_engine = """
+import sqlalchemy as sa
+from sqlalchemy.dialects import registry
+registry.register('tinybird', 'dialect', 'TinybirdDialect')
+sa.create_engine('tinybird://token@localhost:8001/?protocol=http')
+"""
+
+# name -> (code timed, budget in ms, modules that must not be loaded)
+CASES = {
+    'package': (_package.format(init=os.path.join(ROOT, '__init__.py'), root=ROOT), 10,
+                ('sqlalchemy', 'requests', 'infi.clickhouse_orm')),
+    'dbapi': ('import connection, cursor\nconnection.connect("http://localhost:8001", token="token").cursor()', 250,
+              ('sqlalchemy', 'infi.clickhouse_orm')),
+    'engine': (_engine, 600, ('infi.clickhouse_orm',)),
+}
+
+# Runs in the child interpreter: times the case and reports the modules it loaded
+_runner = """
+import json, sys, time
+start = time.perf_counter()
+exec(compile({code!r}, 'case', 'exec'))
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'modules': [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+
+def run_case(code, forbidden):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    out = subprocess.run([sys.executable, '-c', _runner.format(code=code, forbidden=forbidden)],
+                         env=env, cwd=ROOT, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=9, help="runs of each case; the best one is reported")
+    parser.add_argument('--scale', type=float, default=1.0, help="factor applied to the budgets")
+    parser.add_argument('-k', dest='filter', default='', help="only run cases whose name contains this")
+    args = parser.parse_args()
+
+    failures = 0
+    for name, (code, budget, forbidden) in CASES.items():
+        if args.filter not in name:
+            continue
+        results = [run_case(code, forbidden) for _ in range(args.repeat)]
+        best = min(r['elapsed'] for r in results) * 1e3
+        budget *= args.scale
+        flags = []
+        if best > budget:
+            flags.append('OVER BUDGET')
+        loaded = sorted(set(m for r in results for m in r['modules']))
+        if loaded:
+            flags.append('loaded ' + ', '.join(loaded))
+        failures += bool(flags)
+        print('%-8s %8.1f ms  budget %6.0f ms  %s' % (name, best, budget, '  '.join(flags)))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Time and size of the SQL sent for a query with a large IN list, expanding the
+list value by value ("before", ``in_list_threshold=None``) and rendering it as
+one array ("after"). Timings cover what happens between executing the cached
+statement and sending it: expanding the list, escaping the values and
+formatting the statement. No HTTP is involved.
+
+    $ python benchmarks/bench_in_list.py --sizes 1000 100000 1000000
+
+IDs are either sorted runs of consecutive integers ("dense") or random ones
+("sparse"). Reference run (SQLAlchemy 1.4.42, CPython 3.11):
+
+    dense     1000 IDs  before     2.6 ms        4.8 KB   after    0.4 ms       0.1 KB
+    sparse    1000 IDs  before     2.1 ms        5.8 KB   after    0.6 ms       4.8 KB
+    dense   100000 IDs  before   304.6 ms      707.9 KB   after   30.8 ms       2.2 KB
+    sparse  100000 IDs  before   400.3 ms      770.5 KB   after  105.2 ms     672.8 KB
+    dense  1000000 IDs  before  2317.0 ms     8064.4 KB   after  198.4 ms      23.0 KB
+    sparse 1000000 IDs  before  2417.5 ms     8680.9 KB   after  924.5 ms    7704.3 KB
+
+Besides the client time, the server parses one array literal instead of an
+expression per value.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import sqlalchemy as sa
+
+from dialect import TinybirdDialect
+from param_escaper import ParamEscaper
+
+
+_escaper = ParamEscaper()
+
+events = sa.table('events', sa.column('user_id', sa.Integer), sa.column('browser', sa.String))
+
+
+def ids_of(kind, size):
+    if kind == 'dense':
+        # A few long runs, as IDs selected by ranges of a sequence
+        return [i + (i // 1000) * 500 for i in range(size)]
+    return random.sample(range(size * 10), size)
+
+
+def run(threshold, ids):
+    dialect = TinybirdDialect()
+    dialect.in_list_threshold = threshold
+    compiled = sa.select(events.c.browser).where(events.c.user_id.in_(sa.bindparam('ids', expanding=True))).compile(
+        dialect=dialect)
+    start = time.perf_counter()
+    # What the execution context and Cursor.execute do with the statement
+    params = compiled.construct_params({'ids': ids})
+    expanded = compiled._process_parameters_for_postcompile(params)
+    sql = expanded.statement % _escaper.escape_args(expanded.additional_parameters)
+    return time.perf_counter() - start, len(sql.encode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    args = parser.parse_args()
+
+    random.seed(0)
+    for size in args.sizes:
+        for kind in ('dense', 'sparse'):
+            ids = ids_of(kind, size)
+            before, before_size = run(None, ids)
+            after, after_size = run(1000, ids)
+            print('%-6s %7d IDs  before %7.1f ms %10.1f KB   after %6.1f ms %9.1f KB' % (
+                kind, size, before * 1e3, before_size / 1024, after * 1e3, after_size / 1024))
+
+
+if __name__ == '__main__':
+    main()
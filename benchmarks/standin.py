@@ -0,0 +1,426 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+A local stand-in for the Tinybird SQL API, so the connector can be run and
+benchmarked without a token or a network.
+
+It answers ``/v0/sql`` (GET with ``q`` or POST with the SQL in the body) and
+``/v0/pipes/<name>.json`` with generated rows of an ``events`` table, in the
+format named by the query's ``FORMAT`` clause: JSON, JSONCompact,
+JSONEachRow, JSONCompactEachRowWithNamesAndTypes, JSONColumnsWithMetadata
+and, when pyarrow is installed, ArrowStream. A trailing ``LIMIT n`` sets the
+number of rows, otherwise ``--rows`` are returned. ``system.columns``,
+``DESCRIBE TABLE`` and ``EXISTS TABLE`` queries describe ``--tables`` tables
+like ``events``, for reflection. Events posted to ``/v0/events`` are kept
+by data source name, and so are the files posted to ``/v0/datasources``.
+Queries calling ``sleep(s)`` are answered ``s`` seconds late, and those
+calling ``throwIf(...)`` fail as in ClickHouse. With ``--compression``,
+results are sent gzip- or zstd-compressed to clients that accept it.
+
+    $ python benchmarks/standin.py --port 8123 --rows 10000 --latency 0.05
+
+    >>> sa.create_engine('tinybird://token@127.0.0.1:8123/?protocol=http')
+
+Response bodies are generated once per format and size, so the stand-in
+costs little next to the client being measured.
+
+Tests read the requests received in ``StandIn.log`` and make the next answers
+fail with ``StandIn.fail()``.
+"""
+
+import argparse
+import decimal
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import re
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+COLUMNS = [
+    ('id', 'UInt64'), ('user_id', 'UInt32'), ('browser', 'LowCardinality(String)'), ('country', 'Nullable(String)'),
+    ('ts', 'DateTime'), ('day', 'Date'), ('duration', 'Float64'), ('amount', 'Decimal(18, 2)'),
+]
+
+BROWSERS = ['Chrome', 'Firefox', 'Safari', 'Edge', 'Opera', 'Brave', 'Vivaldi']
+COUNTRIES = ['ES', 'US', 'FR', 'DE', None]
+
+# Seconds and days since the epoch of 2022-01-01
+EPOCH_SECONDS = 1640995200
+EPOCH_DAYS = 18993
+
+CENTS = decimal.Decimal('0.01')
+
+RE_FORMAT = re.compile(r'\s+FORMAT\s+(\w+)\s*;?\s*$', re.IGNORECASE)
+RE_LIMIT = re.compile(r'\bLIMIT\s+(\d+)\s*\)?\s*$', re.IGNORECASE)
+RE_SLEEP = re.compile(r'\bsleep\(\s*([\d.]+)\s*\)', re.IGNORECASE)
+RE_TABLE = re.compile(r'^\s*(?:DESCRIBE|EXISTS)\s+TABLE\s+([\w.`"]+)', re.IGNORECASE)
+
+
+def make_columns(n: int) -> List[List[Any]]:
+    """ Returns the values of ``n`` rows of ``events``, column by column, as decoded from JSON """
+    ids = range(n)
+    seconds = [EPOCH_SECONDS + i * 7 % 86400 for i in ids]
+    return [
+        [str(i) for i in ids],
+        [i * 31 % 100000 for i in ids],
+        [BROWSERS[i % 7] for i in ids],
+        [COUNTRIES[i % 5] for i in ids],
+        [time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(s)) for s in seconds],
+        [time.strftime('%Y-%m-%d', time.gmtime((EPOCH_DAYS + i % 365) * 86400)) for i in ids],
+        [i % 1000 / 8 for i in ids],
+        [(decimal.Decimal(i % 10000) / 4).quantize(CENTS) for i in ids],
+    ]
+
+
+def _dumps(value: Any, quote_decimals: bool) -> bytes:
+    """ JSON of ``value`` as ClickHouse writes it: ``Decimal`` values are strings with
+    ``quote_decimals``, and numbers with all their digits otherwise.
+    """
+    text = json.dumps(value, default=lambda d: '\0%s\0' % format(d, 'f'))
+    if quote_decimals:
+        return text.replace('\\u0000', '').encode()
+    return re.sub(r'"\\u0000(.*?)\\u0000"', r'\1', text).encode()
+
+
+def _arrow_body(n: int, string_as_string: bool) -> bytes:
+    """ An ArrowStream body typed as ClickHouse sends it: DateTime as uint32, Date as uint16 and
+    strings as binary unless ``output_format_arrow_string_as_string`` is set.
+    """
+    import pyarrow as pa
+    import pyarrow.ipc
+
+    ids = range(n)
+    string = pa.string() if string_as_string else pa.binary()
+    encode = (lambda v: v) if string_as_string else (lambda v: None if v is None else v.encode())
+    table = pa.table({
+        'id': pa.array(ids, pa.uint64()),
+        'user_id': pa.array([i * 31 % 100000 for i in ids], pa.uint32()),
+        'browser': pa.array([encode(BROWSERS[i % 7]) for i in ids], string),
+        'country': pa.array([encode(COUNTRIES[i % 5]) for i in ids], string),
+        'ts': pa.array([EPOCH_SECONDS + i * 7 % 86400 for i in ids], pa.uint32()),
+        'day': pa.array([EPOCH_DAYS + i % 365 for i in ids], pa.uint16()),
+        'duration': pa.array([i % 1000 / 8 for i in ids], pa.float64()),
+        'amount': pa.array([decimal.Decimal(i % 10000) / 4 for i in ids], pa.decimal128(18, 2)),
+    })
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=65536)
+    return sink.getvalue()
+
+
+def render(fmt: str, meta: List[Tuple[str, str]], columns: List[List[Any]], string_as_string: bool = False,
+           quote_decimals: bool = False) -> Optional[bytes]:
+    """ Returns the body of a result in format ``fmt``, or ``None`` if the format isn't supported """
+    n = len(columns[0]) if columns else 0
+    meta_json = [{'name': name, 'type': type_} for name, type_ in meta]
+    names = [name for name, _ in meta]
+    statistics = {'elapsed': 0.001, 'rows_read': n, 'bytes_read': n * 64}
+    if fmt == 'JSON':
+        data = [dict(zip(names, row)) for row in zip(*columns)]
+        return _dumps({'meta': meta_json, 'data': data, 'rows': n, 'statistics': statistics}, quote_decimals)
+    if fmt == 'JSONCompact':
+        data = [list(row) for row in zip(*columns)]
+        return _dumps({'meta': meta_json, 'data': data, 'rows': n, 'statistics': statistics}, quote_decimals)
+    if fmt == 'JSONEachRow':
+        return b''.join(_dumps(dict(zip(names, row)), quote_decimals) + b'\n' for row in zip(*columns))
+    if fmt == 'JSONCompactEachRowWithNamesAndTypes':
+        lines = [names, [type_ for _, type_ in meta]] + [list(row) for row in zip(*columns)]
+        return b''.join(_dumps(line, quote_decimals) + b'\n' for line in lines)
+    if fmt == 'JSONColumnsWithMetadata':
+        data = dict(zip(names, columns))
+        return _dumps({'meta': meta_json, 'data': data, 'rows': n, 'statistics': statistics}, quote_decimals)
+    if fmt == 'ArrowStream' and meta == COLUMNS:
+        try:
+            return _arrow_body(n, string_as_string)
+        except ImportError:
+            return None
+    return None
+
+
+class Request(NamedTuple):
+    """ A request received by the stand-in, with the first value of each URL parameter """
+    method: str
+    path: str
+    params: Dict[str, str]
+    headers: Dict[str, str]
+    body: bytes
+    query: str
+
+
+def _multipart_file(body: bytes, content_type: str) -> bytes:
+    """ Returns the contents of the file of a ``multipart/form-data`` body, gunzipped if need be """
+    boundary = content_type.split('boundary=', 1)[-1].encode()
+    part = body.split(b'--' + boundary)[1]
+    head, data = part.split(b'\r\n\r\n', 1)
+    data = data[:-2]
+    if b'.gz"' in head:
+        data = gzip.decompress(data)
+    return data
+
+
+class StandIn(object):
+    """ Serves the stand-in API from a background thread until :meth:`stop` is called """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, rows: int = 1000, latency: float = 0.0,
+                 tables: int = 10, compression: Optional[str] = None):
+        self.rows = rows
+        # Seconds to wait before answering each request
+        self.latency = latency
+        self.tables = tables
+        # Content-Encoding of results, 'gzip' or 'zstd', for clients whose Accept-Encoding has it
+        self.compression = compression
+        # Number of requests answered
+        self.requests = 0
+        # Requests received, oldest first
+        self.log: List[Request] = []
+        # Tables added with add_table, by name: their (name, type) columns and values column by column
+        self.results: Dict[str, Tuple[List[Tuple[str, str]], List[List[Any]]]] = {}
+        # Events received through the Events API, by data source name
+        self.events: Dict[str, List[Dict[str, Any]]] = {}
+        # Files received through the Data Sources API, by data source name: their parameters
+        # (mode, format) and contents, decompressed
+        self.uploads: Dict[str, List[Tuple[Dict[str, str], bytes]]] = {}
+        # (status, body, headers) answered to the next requests, instead of their results, and the
+        # text their SQL must contain, if any
+        self._failures: List[Tuple[Tuple[int, bytes, Dict[str, str]], Optional[str]]] = []
+        self._bodies: Dict[Tuple[Any, ...], bytes] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self) -> 'StandIn':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'StandIn':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def fail(self, status: int, message: str = '', headers: Optional[Dict[str, str]] = None, times: int = 1,
+             match: Optional[str] = None):
+        """ Answers the next ``times`` requests, or queries whose SQL contains ``match``, with
+        ``status`` and ``message``
+        """
+        with self._lock:
+            self._failures.extend([((status, message.encode(), headers or {}), match)] * times)
+
+    def add_table(self, name: str, meta: List[Tuple[str, str]], rows: List[Tuple[Any, ...]]):
+        """ Serves ``rows`` of ``(name, type)`` columns ``meta`` as the result of queries reading
+        table ``name``. Values are given as decoded from JSON, with ``Decimal`` for decimals.
+        """
+        with self._lock:
+            self.results[name] = (meta, [list(c) for c in zip(*rows)] if rows else [[] for _ in meta])
+            self._bodies.clear()
+
+    def queries(self) -> List[str]:
+        """ The SQL of the queries received, oldest first """
+        return [request.query for request in self.log if request.path == '/v0/sql']
+
+    def body(self, query: str, fmt: str, string_as_string: bool = False, quote_decimals: bool = False,
+             encoding: Optional[str] = None) -> Optional[bytes]:
+        """ Returns the response body of ``query`` in ``fmt``, compressed with ``encoding`` if
+        given, or ``None`` for unsupported formats
+        """
+        meta, rows, kind = COLUMNS, self.rows, 'events'
+        table = next((name for name in self.results if re.search(r'\bFROM\s+%s\b' % name, query)), None)
+        if table is not None:
+            kind = 'table ' + table
+        elif 'system.columns' in query:
+            kind, rows = 'columns', self.tables
+            meta = [('table', 'String'), ('name', 'String'), ('type', 'String'),
+                    ('is_in_sorting_key', 'UInt8'), ('is_in_partition_key', 'UInt8')]
+        elif RE_TABLE.match(query):
+            kind = query.split()[0].upper()
+        elif 'currentDatabase()' in query:
+            kind = 'database'
+        else:
+            m = RE_LIMIT.search(query)
+            if m:
+                rows = int(m.group(1))
+
+        key = (kind, fmt, rows, string_as_string, quote_decimals, encoding)
+        with self._lock:
+            body = self._bodies.get(key)
+        if body is not None:
+            return body
+
+        if table is not None:
+            meta, columns = self.results[table]
+        elif kind == 'columns':
+            data = [[('t%d' % i) if i else 'events', name, type_, int(name == 'id'), int(name == 'day')]
+                    for i in range(rows) for name, type_ in COLUMNS]
+            columns = [list(c) for c in zip(*data)]
+        elif kind == 'DESCRIBE':
+            meta = [('name', 'String'), ('type', 'String')]
+            columns = [[name for name, _ in COLUMNS], [type_ for _, type_ in COLUMNS]]
+        elif kind == 'EXISTS':
+            meta, columns = [('result', 'UInt8')], [[1]]
+        elif kind == 'database':
+            meta, columns = [('currentDatabase()', 'String')], [['default']]
+        else:
+            columns = make_columns(rows)
+        body = render(fmt, meta, columns, string_as_string, quote_decimals)
+        if body is not None and encoding == 'gzip':
+            body = gzip.compress(body)
+        elif body is not None and encoding == 'zstd':
+            import zstandard
+            body = zstandard.ZstdCompressor().compress(body)
+        if body is not None:
+            with self._lock:
+                self._bodies[key] = body
+        return body
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written apart; without this small responses wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle(b'')
+
+    def do_POST(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        encoding = self.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'zstd':
+            import zstandard
+            body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        self._handle(body)
+
+    def _handle(self, body: bytes):
+        standin: StandIn = self.server.standin
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        query = params.get('q', [''])[0] or (body.decode('utf-8') if url.path == '/v0/sql' else '')
+        request = Request(self.command, url.path, {name: values[0] for name, values in params.items()},
+                          dict(self.headers), body, query)
+        with standin._lock:
+            standin.requests += 1
+            standin.log.append(request)
+            failure = next((f for f in standin._failures if f[1] is None or f[1] in query), None)
+            if failure is not None:
+                standin._failures.remove(failure)
+                failure = failure[0]
+        if standin.latency:
+            time.sleep(standin.latency)
+        if failure is not None:
+            return self._send(*failure)
+
+        accepted = [e.strip() for e in self.headers.get('Accept-Encoding', '').split(',')]
+        encoding = standin.compression if standin.compression in accepted else None
+        headers = {'Content-Encoding': encoding} if encoding else None
+        if url.path.startswith('/v0/pipes/') and url.path.endswith('.json'):
+            return self._send(200, standin.body('SELECT * FROM events', 'JSON', quote_decimals=True, encoding=encoding),
+                              headers)
+        if url.path == '/v0/events':
+            rows = [json.loads(line) for line in body.splitlines() if line]
+            with standin._lock:
+                standin.events.setdefault(params.get('name', [''])[0], []).extend(rows)
+            answer = json.dumps({'successful_rows': len(rows), 'quarantined_rows': 0}).encode()
+            return self._send(200 if params.get('wait', [''])[0] == 'true' else 202, answer)
+        if url.path == '/v0/datasources' and self.command == 'POST':
+            name = params.get('name', [''])[0]
+            data = _multipart_file(body, self.headers.get('Content-Type', ''))
+            with standin._lock:
+                standin.uploads.setdefault(name, []).append((request.params, data))
+            answer = {'datasource': {'name': name}, 'import_id': str(len(standin.uploads[name])), 'error': False}
+            return self._send(200, json.dumps(answer).encode())
+        if url.path != '/v0/sql':
+            return self._send(404, b'{"error": "Not found"}')
+
+        m = RE_FORMAT.search(query)
+        if not m:
+            return self._send(400, b'Code: 62. DB::Exception: Syntax error: expected FORMAT. (SYNTAX_ERROR)')
+        sleep = RE_SLEEP.search(query)
+        if sleep:
+            time.sleep(float(sleep.group(1)))
+        if 'throwIf(' in query:
+            return self._send(400, b"Code: 395. DB::Exception: Value passed to 'throwIf' function is non-zero. "
+                                   b"(FUNCTION_THROW_IF_VALUE_IS_NON_ZERO)")
+        string_as_string = params.get('output_format_arrow_string_as_string', ['0'])[0] in ('1', 'true')
+        quote_decimals = params.get('output_format_json_quote_decimals', ['0'])[0] in ('1', 'true')
+        out = standin.body(query[:m.start()], m.group(1), string_as_string, quote_decimals, encoding)
+        if out is None:
+            message = 'Code: 73. DB::Exception: Unknown format {}. (UNKNOWN_FORMAT)'.format(m.group(1))
+            return self._send(400, message.encode())
+        self._send(200, out, headers)
+
+    def _send(self, status: int, body: bytes, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--rows', type=int, default=1000, help="rows of results without a LIMIT")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds to wait before each response")
+    parser.add_argument('--tables', type=int, default=10, help="tables listed in system.columns")
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], help="compression of results, when accepted")
+    args = parser.parse_args()
+
+    standin = StandIn(args.host, args.port, rows=args.rows, latency=args.latency, tables=args.tables,
+                      compression=args.compression)
+    print('Serving the Tinybird stand-in on %s' % standin.url)
+    try:
+        standin._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        standin._server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Benchmark suite of the connector's hot paths, run against the local stand-in
+of the SQL API (benchmarks/standin.py), and compared with the baseline kept
+in benchmarks/baseline.json.
+
+    $ python benchmarks/suite.py                  # compare with the baseline
+    $ python benchmarks/suite.py -k cursor        # only cases matching 'cursor'
+    $ python benchmarks/suite.py --save           # record a new baseline
+
+Cases cover decoding responses in ``Connection``, the ``Cursor`` fetch paths,
+``ParamEscaper``, statement compilation with ``TinybirdCompiler`` and
+reflection. The stand-in runs in a thread of the benchmark unless ``--url``
+points to one started separately, which keeps it off the interpreter lock of
+the client being measured. Each case reports the best of ``--repeat`` runs; cases slower than
+the baseline by more than ``--tolerance`` are flagged and make the run exit
+with status 1. Baselines are only comparable on the same machine and with the
+same ``--rows``, so record one before changing the code being measured; on
+shared machines, where timings swing widely, raise the tolerance.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, '..'), HERE]
+
+import sqlalchemy as sa
+from sqlalchemy.util import LRUCache
+
+from columnar import import_pyarrow
+from connection import Connection
+from cursor import Cursor
+from dialect import TinybirdDialect
+from param_escaper import ParamEscaper
+from standin import StandIn
+
+from sqlalchemy.dialects import registry
+registry.register('tinybird', 'dialect', 'TinybirdDialect')
+
+
+BASELINE = os.path.join(HERE, 'baseline.json')
+
+# name -> function taking the run context and returning the callable to time
+CASES: Dict[str, Callable[['Context'], Callable[[], object]]] = {}
+
+
+def case(name: str):
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+class Context(object):
+    def __init__(self, url: str, rows: int):
+        self.rows = rows
+        self.query = 'SELECT * FROM events LIMIT %d' % rows
+        self.connection = Connection(url, token='token')
+        host, port = url.rsplit('/', 1)[1].split(':')
+        self.engine = sa.create_engine('tinybird://token@%s:%s/?protocol=http' % (host, port))
+
+
+# Connection: response decoding
+
+@case('select.models')
+def select_models(ctx):
+    # infi model instances, as results with a model class are built
+    query = 'SELECT * FROM events LIMIT %d' % max(1, ctx.rows // 10)
+    return lambda: list(ctx.connection.select(query))
+
+
+@case('select.rows')
+def select_rows(ctx):
+    return lambda: ctx.connection.select_rows(ctx.query)[1].fetchall()
+
+
+@case('select.rows_stream')
+def select_rows_stream(ctx):
+    return lambda: ctx.connection.select_rows(ctx.query, stream=True)[1].fetchall()
+
+
+@case('select.columnar')
+def select_columnar(ctx):
+    if import_pyarrow() is None:
+        return None
+    return lambda: ctx.connection.select_columnar(ctx.query).read_all()
+
+
+# Cursor fetch paths
+
+def _drain(ctx, fetch: Callable[[Cursor], object], **options):
+    def run():
+        cursor = Cursor(ctx.connection, **options)
+        cursor.execute(ctx.query)
+        while fetch(cursor):
+            pass
+    return run
+
+
+@case('cursor.fetchall')
+def cursor_fetchall(ctx):
+    return _drain(ctx, lambda cursor: cursor.fetchall())
+
+
+@case('cursor.fetchmany')
+def cursor_fetchmany(ctx):
+    return _drain(ctx, lambda cursor: cursor.fetchmany(1000))
+
+
+@case('cursor.fetchone')
+def cursor_fetchone(ctx):
+    return _drain(ctx, lambda cursor: cursor.fetchone())
+
+
+@case('cursor.stream')
+def cursor_stream(ctx):
+    return _drain(ctx, lambda cursor: cursor.fetchmany(1000), stream=True)
+
+
+@case('cursor.sqlalchemy')
+def cursor_sqlalchemy(ctx):
+    def run():
+        with ctx.engine.connect() as conn:
+            conn.exec_driver_sql(ctx.query).fetchall()
+    return run
+
+
+# ParamEscaper
+
+def _parameter_sets(n: int) -> List[Dict[str, object]]:
+    import datetime
+    import decimal
+    return [
+        {'id': i, 'name': "o'name%d" % (i % 100), 'ts': datetime.datetime(2022, 1, 1, i % 24, i % 60),
+         'amount': decimal.Decimal(i) / 4, 'ratio': i / 3, 'tags': ['a', 'b']}
+        for i in range(n)
+    ]
+
+
+@case('escape.args')
+def escape_args(ctx):
+    escaper = ParamEscaper()
+    parameter_sets = _parameter_sets(ctx.rows // 10)
+    return lambda: [escaper.escape_args(parameters) for parameters in parameter_sets]
+
+
+@case('escape.render_many')
+def escape_render_many(ctx):
+    template = ParamEscaper().template(
+        'SELECT * FROM t WHERE id = %(id)s AND name = %(name)s AND ts > %(ts)s AND amount < %(amount)s')
+    parameter_sets = _parameter_sets(ctx.rows // 10)
+    return lambda: template.render_many(parameter_sets)
+
+
+# TinybirdCompiler
+
+metadata = sa.MetaData()
+events = sa.Table(
+    'events', metadata,
+    sa.Column('id', sa.Integer), sa.Column('user_id', sa.Integer), sa.Column('browser', sa.String),
+    sa.Column('ts', sa.DateTime), sa.Column('duration', sa.Float))
+
+
+def _statements(n: int) -> List[sa.sql.Select]:
+    return [
+        sa.select(events.c.browser, sa.func.count().label('hits'))
+        .where(events.c.user_id.in_(list(range(i, i + 50))), events.c.browser != 'bot%d' % i)
+        .group_by(events.c.browser).order_by(sa.desc('hits')).limit(10)
+        for i in range(n)
+    ]
+
+
+def _compile(dialect, statements, compiled_cache):
+    for stmt in statements:
+        compiled, extracted, _ = stmt._compile_w_cache(
+            dialect=dialect, compiled_cache=compiled_cache, column_keys=[],
+            for_executemany=False, schema_translate_map=None)
+        params = compiled.construct_params(extracted_parameters=extracted)
+        compiled._process_parameters_for_postcompile(params)
+
+
+@case('compile.cold')
+def compile_cold(ctx):
+    dialect, statements = TinybirdDialect(), _statements(200)
+    return lambda: _compile(dialect, statements, None)
+
+
+@case('compile.warm')
+def compile_warm(ctx):
+    dialect, statements = TinybirdDialect(), _statements(200)
+    return lambda: _compile(dialect, statements, LRUCache(100))
+
+
+# Reflection
+
+@case('reflect.metadata')
+def reflect_metadata(ctx):
+    def run():
+        sa.MetaData().reflect(bind=ctx.engine)
+    return run
+
+
+@case('reflect.inspector')
+def reflect_inspector(ctx):
+    def run():
+        inspector = sa.inspect(ctx.engine)
+        for table in inspector.get_table_names():
+            inspector.get_columns(table)
+            inspector.get_indexes(table)
+    return run
+
+
+def run_cases(ctx: Context, names: List[str], repeat: int) -> Dict[str, float]:
+    results = {}
+    for name in names:
+        run = CASES[name](ctx)
+        if run is None:
+            # Optional dependency missing
+            continue
+        run()  # warm up connections and the stand-in's response cache
+        best = float('inf')
+        for _ in range(repeat):
+            # As timeit does, keep collections out of the timings
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                run()
+                best = min(best, time.perf_counter() - start)
+            finally:
+                gc.enable()
+        results[name] = best
+    return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[Tuple[str, float]]:
+    """ Prints results next to the baseline and returns the regressions as ``(name, ratio)`` """
+    regressions = []
+    for name, seconds in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print('%-22s %10.2f ms    (not in baseline)' % (name, seconds * 1e3))
+            continue
+        ratio = seconds / before
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  REGRESSION'
+            regressions.append((name, ratio))
+        print('%-22s %10.2f ms  baseline %10.2f ms  %5.2fx%s' % (name, seconds * 1e3, before * 1e3, ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=20000, help="rows of the query results")
+    parser.add_argument('--tables', type=int, default=50, help="tables to reflect")
+    parser.add_argument('--repeat', type=int, default=7, help="runs of each case; the best one is reported")
+    parser.add_argument('--url', help="stand-in already running, e.g. in another process, instead of one in this process")
+    parser.add_argument('-k', dest='filter', default='', help="only run cases whose name contains this")
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help="write the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="slowdown over the baseline flagged as a regression (0.5 = 50%%)")
+    args = parser.parse_args()
+
+    names = [name for name in CASES if args.filter in name]
+    if args.url:
+        results = run_cases(Context(args.url, args.rows), names, args.repeat)
+    else:
+        with StandIn(rows=args.rows, tables=args.tables) as standin:
+            results = run_cases(Context(standin.url, args.rows), names, args.repeat)
+
+    if args.save:
+        baseline = {
+            'environment': {
+                'python': platform.python_version(), 'sqlalchemy': sa.__version__, 'machine': platform.machine(),
+                'rows': args.rows, 'tables': args.tables, 'repeat': args.repeat,
+            },
+            'results': {name: round(seconds, 6) for name, seconds in results.items()},
+        }
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        for name, seconds in results.items():
+            print('%-22s %10.2f ms' % (name, seconds * 1e3))
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            recorded = json.load(f)
+        environment = recorded.get('environment', {})
+        if (environment.get('rows'), environment.get('tables')) != (args.rows, args.tables):
+            print('Baseline recorded with --rows %s --tables %s' % (environment.get('rows'), environment.get('tables')))
+        baseline = recorded.get('results', {})
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print('%d regression(s) over %d%%' % (len(regressions), args.tolerance * 100))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+from typing import Any, Dict, Mapping, Optional, Union
+
+from error import DatabaseError, NotSupportedError, ReadBudgetExceeded, RetryableError
+
+
+logger = logging.getLogger('sqlalchemy_tinybird')
+
+HARD = 'hard'
+SOFT = 'soft'
+
+# Budget limits and the ClickHouse settings enforcing them on the server
+_limit_settings = {
+    'max_rows_read': 'max_rows_to_read',
+    'max_bytes_read': 'max_bytes_to_read',
+    'max_execution_time': 'max_execution_time',
+}
+
+# Budget limits and the keys of the response statistics they are checked against
+_limit_statistics = {
+    'max_rows_read': 'rows_read',
+    'max_bytes_read': 'bytes_read',
+    'max_execution_time': 'elapsed',
+}
+
+# ClickHouse errors of queries stopped by limit settings, by code and name, and the limits
+# setting them
+_limit_errors = (
+    (('Code: 158.', 'TOO_MANY_ROWS'), 'max_rows_read'),
+    (('Code: 307.', 'TOO_MANY_BYTES'), 'max_bytes_read'),
+    (('Code: 159.', 'TIMEOUT_EXCEEDED'), 'max_execution_time'),
+)
+
+
+class ReadBudget(object):
+    """ Limits on what a query may read: rows, bytes and seconds of execution.
+
+    In ``hard`` mode the limits are sent as ClickHouse settings, so the server stops queries
+    going over them, which fail with :class:`error.ReadBudgetExceeded`. In ``soft`` mode queries
+    run unrestricted and going over budget only logs a warning on the ``sqlalchemy_tinybird``
+    logger.
+
+    With ``preflight``, the rows a query would read are estimated with ``EXPLAIN ESTIMATE``
+    before running it, and queries over ``max_rows_read`` are not sent at all.
+
+    ``preflight`` and ``mode`` left as ``None`` are taken from the budget merged under this one,
+    and are off and ``hard`` otherwise.
+    """
+
+    def __init__(self, max_rows_read: Optional[int] = None, max_bytes_read: Optional[int] = None,
+                 max_execution_time: Optional[float] = None, preflight: Optional[bool] = None,
+                 mode: Optional[str] = None):
+        if mode not in (None, HARD, SOFT):
+            raise NotSupportedError("Unknown read budget mode {}, use hard or soft".format(mode))
+        self.max_rows_read = max_rows_read
+        self.max_bytes_read = max_bytes_read
+        self.max_execution_time = max_execution_time
+        self.preflight = preflight
+        self.mode = mode
+
+    @classmethod
+    def of(cls, budget: Union['ReadBudget', Mapping[str, Any], None]) -> Optional['ReadBudget']:
+        """ Returns ``budget`` as a :class:`ReadBudget`, also when given as a dict of its arguments """
+        if budget is None or isinstance(budget, ReadBudget):
+            return budget
+        return cls(**budget)
+
+    @property
+    def soft(self) -> bool:
+        return self.mode == SOFT
+
+    def limits(self) -> Dict[str, Any]:
+        """ The limits set, by name """
+        return {name: getattr(self, name) for name in _limit_settings if getattr(self, name) is not None}
+
+    def merge(self, other: Optional['ReadBudget']) -> 'ReadBudget':
+        """ Returns this budget with the limits and options of ``other`` on top, e.g. those of a
+        statement over those of its engine.
+        """
+        if other is None:
+            return self
+        limits = dict(self.limits(), **other.limits())
+        preflight = self.preflight if other.preflight is None else other.preflight
+        return ReadBudget(preflight=preflight, mode=other.mode or self.mode, **limits)
+
+    def settings(self) -> Dict[str, Any]:
+        """ ClickHouse settings enforcing the budget on the server, none in soft mode """
+        if self.soft:
+            return {}
+        settings = {_limit_settings[name]: value for name, value in self.limits().items()}
+        if 'max_rows_to_read' in settings or 'max_bytes_to_read' in settings:
+            settings['read_overflow_mode'] = 'throw'
+        if 'max_execution_time' in settings:
+            settings['timeout_overflow_mode'] = 'throw'
+        return settings
+
+    def check_estimate(self, rows: int, query_id: Optional[str] = None):
+        """ Fails, or warns in soft mode, when the estimated rows are over budget """
+        if self.max_rows_read is not None and rows > self.max_rows_read:
+            self._exceeded('max_rows_read', rows, query_id, 'would read an estimated')
+
+    def check_statistics(self, statistics: Mapping[str, Any], query_id: Optional[str] = None):
+        """ Warns when the statistics of a query run in soft mode show it went over budget """
+        if not self.soft:
+            return
+        for name, limit in self.limits().items():
+            value = statistics.get(_limit_statistics[name])
+            if value is not None and value > limit:
+                self._exceeded(name, value, query_id, 'read')
+
+    def exceeded_error(self, error: DatabaseError) -> Optional[ReadBudgetExceeded]:
+        """ Returns the :class:`error.ReadBudgetExceeded` to raise instead of ``error`` when the
+        server stopped the query at one of the limits this budget sent, ``None`` otherwise.
+        Limits set through other settings are none of the budget's business.
+        """
+        if self.soft or (isinstance(error, RetryableError) and error.status != 500):
+            return None
+        message = str(error)
+        for (code, name), limit in _limit_errors:
+            if getattr(self, limit) is not None and (code in message or name in message):
+                return ReadBudgetExceeded(message, error.status, limit=limit, budget=getattr(self, limit))
+        return None
+
+    def _exceeded(self, name: str, value: Any, query_id: Optional[str], verb: str):
+        unit = {'max_rows_read': 'rows', 'max_bytes_read': 'bytes', 'max_execution_time': 'seconds'}[name]
+        if name == 'max_execution_time':
+            verb = 'ran for'
+        query = 'Query {}'.format(query_id) if query_id else 'Query'
+        message = "{} {} {} {}, over its budget of {} ({})".format(query, verb, value, unit, getattr(self, name), name)
+        if self.soft:
+            logger.warning(message)
+        else:
+            raise ReadBudgetExceeded(message, limit=name, value=value, budget=getattr(self, name))
+
+    def __repr__(self) -> str:
+        options = ['%s=%r' % item for item in self.limits().items()]
+        if self.preflight is not None:
+            options.append('preflight=%r' % self.preflight)
+        if self.mode is not None:
+            options.append('mode=%r' % self.mode)
+        return 'ReadBudget(%s)' % ', '.join(options)
+
+
+def estimate_rows(connection, query: str, settings: Optional[Dict[str, Any]] = None) -> int:
+    """ Returns the rows ``query`` would read according to ``EXPLAIN ESTIMATE``, summed over the
+    tables it reads.
+    """
+    return estimated_rows(*connection.select_rows('EXPLAIN ESTIMATE ' + query, settings=settings, cache_ttl=0))
+
+
+def estimated_rows(columns, rows) -> int:
+    """ Returns the rows summed over the result of an ``EXPLAIN ESTIMATE`` query """
+    names = [name for name, _ in columns]
+    if 'rows' not in names:
+        return 0
+    i = names.index('rows')
+    return sum(int(row[i]) for row in rows.fetchall())
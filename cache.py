@@ -0,0 +1,295 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
+#             https://github.com/cloudflare/sqlalchemy-clickhouse
+
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import re
+import stat
+import struct
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from error import NotSupportedError
+
+
+# Defaults for the cache backends
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Share of max_bytes a disk cache is brought down to when full, so it isn't scanned on every write
+_EVICT_TO = 0.9
+
+# String literals and quoted identifiers are kept verbatim when normalizing SQL
+_RE_SQL_TOKENS = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`(?:[^`\\]|\\.)*`)|\s+""", re.DOTALL)
+
+_EXPIRES = struct.Struct('<d')
+
+
+def normalize_sql(sql: str) -> str:
+    """ Collapses whitespace outside of quoted strings and drops a trailing semicolon """
+    sql = _RE_SQL_TOKENS.sub(lambda m: m.group(1) or ' ', sql).strip()
+    return sql[:-1].rstrip() if sql.endswith(';') else sql
+
+
+def cache_key(sql: str, token: Optional[str] = None, *extra: Any) -> str:
+    """ Returns the cache key of a query whose parameters have already been escaped into ``sql`` """
+    h = hashlib.sha256(normalize_sql(sql).encode('utf-8'))
+    h.update(b'\0' + (token or '').encode('utf-8'))
+    for value in extra:
+        h.update(b'\0' + repr(value).encode('utf-8'))
+    return h.hexdigest()
+
+
+def settings_key(settings: Optional[Dict[str, Any]]) -> Tuple[Tuple[str, Any], ...]:
+    """ Returns the query settings that can change a result, to be part of its cache key """
+    if not settings:
+        return ()
+    return tuple(sorted((k, v) for k, v in settings.items() if k != 'query_id'))
+
+
+class CacheStats(object):
+    """ Hit, miss and eviction counters of a cache """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class ResultCache(object):
+    """ Base class for result cache backends.
+
+    Values are the decoded ``(columns, rows)`` of a result and are stored pickled, so an entry
+    costs about as much as the response it replaces.
+    """
+
+    def __init__(self):
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """ Returns the value stored under ``key``, or ``None`` if missing or expired """
+        data = self._get(key)
+        # Caches are shared by the threads of select_many
+        with self._lock:
+            if data is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+        return None if data is None else pickle.loads(data)
+
+    def set(self, key: str, value: Any, ttl: float):
+        """ Stores ``value`` under ``key`` for ``ttl`` seconds """
+        self._set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), time.time() + ttl)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError()
+
+    def _set(self, key: str, data: bytes, expires: float):
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+
+class MemoryCache(ResultCache):
+    """ In-process LRU cache holding at most ``max_bytes`` of pickled results """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        super(MemoryCache, self).__init__()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: 'OrderedDict[str, Tuple[bytes, float]]' = OrderedDict()
+
+    def _get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _set(self, key: str, data: bytes, expires: float):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (data, expires)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.stats.evictions += 1
+
+    def _pop(self, key: str):
+        data, _ = self._entries.pop(key)
+        self.size -= len(data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskCache(ResultCache):
+    """ Cache storing one file per entry in ``directory``, which several processes can share.
+
+    Files are written to a temporary name and renamed into place, so readers never see a
+    partial entry. When the directory grows over ``max_bytes`` the least recently used files
+    are removed, down to 90% of it. The size of the directory is scanned once and then kept up to date with the
+    files this process writes, so processes sharing it only notice each other's entries when
+    they rescan it, on going over ``max_bytes``.
+
+    Entries are unpickled, so only files owned by the current user and not writable by
+    others are read.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        super(DiskCache, self).__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Bytes of entries in the directory, None until scanned
+        self.size: Optional[int] = None
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.tbcache')
+
+    def _get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                if not _trusted(os.fstat(f.fileno())):
+                    return None
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < _EXPIRES.size or _EXPIRES.unpack_from(data)[0] < time.time():
+            self._remove(path)
+            return None
+        # Refresh the access time used for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data[_EXPIRES.size:]
+
+    def _set(self, key: str, data: bytes, expires: float):
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_EXPIRES.pack(expires))
+                f.write(data)
+            os.replace(tmp, path)
+        except:
+            self._remove(tmp)
+            raise
+        with self._lock:
+            if self.size is not None:
+                self.size += _EXPIRES.size + len(data) - replaced
+            if self.size is not None and self.size <= self.max_bytes:
+                return
+            self._evict()
+
+    def _evict(self):
+        """ Scans the directory and, when it is over ``max_bytes``, removes the least recently
+        used files. Called with the lock held.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.tbcache'):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * _EVICT_TO:
+                    break
+                self._remove(path)
+                total -= size
+                self.stats.evictions += 1
+        self.size = total
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.tbcache'):
+                self._remove(entry.path)
+        with self._lock:
+            self.size = 0
+
+
+def _trusted(st: os.stat_result) -> bool:
+    """ Whether a cache file may be unpickled: owned by the current user and only writable by them """
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        return False
+    return not hasattr(os, 'getuid') or st.st_uid == os.getuid()
+
+
+_lock = threading.Lock()
+_caches: Dict[Tuple[Any, ...], ResultCache] = {}
+
+
+def get_cache(backend: str = 'memory', max_bytes: Optional[int] = None, directory: Optional[str] = None) -> ResultCache:
+    """ Returns the process-wide cache for a backend and its options.
+
+    - `backend`: ``'memory'`` or ``'disk'``.
+    - `max_bytes`: size limit of the cached (pickled) results.
+    - `directory`: directory of the ``'disk'`` backend.
+    """
+    max_bytes = max_bytes or DEFAULT_MAX_BYTES
+    key = (backend, max_bytes, directory)
+    with _lock:
+        cache = _caches.get(key)
+        if cache is None:
+            if backend == 'memory':
+                cache = MemoryCache(max_bytes)
+            elif backend == 'disk':
+                if not directory:
+                    raise NotSupportedError("The disk cache needs a cache_dir")
+                cache = DiskCache(directory, max_bytes)
+            else:
+                raise NotSupportedError("Unsupported cache backend: {}".format(backend))
+            _caches[key] = cache
+        return cache
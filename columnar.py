@@ -0,0 +1,340 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
+#             https://github.com/cloudflare/sqlalchemy-clickhouse
+
+from functools import lru_cache
+import re
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from converters import column_converter
+from error import NotSupportedError
+from instrument import QueryReport, notify
+import transport
+
+
+# Wire formats used for columnar results
+ARROW_FORMAT = 'ArrowStream'
+JSON_COLUMNS_FORMAT = 'JSONColumnsWithMetadata'
+
+# NumPy dtypes for the ClickHouse types that map to a contiguous buffer
+_numpy_dtypes = {
+    'Int64': 'int64',
+    'Int32': 'int32',
+    'Int16': 'int16',
+    'Int8': 'int8',
+    'UInt64': 'uint64',
+    'UInt32': 'uint32',
+    'UInt16': 'uint16',
+    'UInt8': 'uint8',
+    'Float64': 'float64',
+    'Float32': 'float32',
+    'Date': 'datetime64[D]',
+    'DateTime': 'datetime64[s]',
+    'Bool': 'bool',
+}
+
+_RE_DATETIME64 = re.compile(r'^DateTime64\((\d)')
+
+# Settings of ArrowStream requests: strings are sent as binary unless told otherwise
+ARROW_SETTINGS = {'output_format_arrow_string_as_string': 1}
+
+
+@lru_cache(maxsize=1)
+def import_pyarrow():
+    """ Returns the ``pyarrow`` module or ``None`` when it is not installed """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise NotSupportedError("numpy is required for NumPy fetches")
+    return numpy
+
+
+def numpy_dtype(db_type: str) -> Optional[str]:
+    """ Returns the NumPy dtype for a ClickHouse type, or ``None`` if values must be kept as objects """
+    if db_type.startswith('LowCardinality('):
+        db_type = db_type[15:-1]
+    m = _RE_DATETIME64.match(db_type)
+    if m:
+        return 'datetime64[%s]' % {0: 's', 3: 'ms', 6: 'us'}.get(int(m.group(1)), 'ns')
+    if db_type.startswith('DateTime('):
+        db_type = 'DateTime'
+    return _numpy_dtypes.get(db_type)
+
+
+def unwrap(db_type: str) -> str:
+    """ Returns the type inside ``Nullable`` and ``LowCardinality`` wrappers """
+    while db_type.startswith(('Nullable(', 'LowCardinality(')):
+        db_type = db_type[db_type.index('(') + 1:-1]
+    return db_type
+
+
+def is_temporal(db_type: str) -> bool:
+    """ Whether ``db_type`` is ``Date`` or ``DateTime``, which ClickHouse sends in ArrowStream as
+    ``uint16`` days and ``uint32`` seconds since the epoch
+    """
+    db_type = unwrap(db_type)
+    return db_type == 'Date' or db_type == 'DateTime' or db_type.startswith('DateTime(')
+
+
+def arrow_db_type(field: Any) -> str:
+    """ Returns the ClickHouse type an Arrow field stands for. ``uint16`` and ``uint32`` fields
+    are told as ``UInt16`` and ``UInt32``, though they may be ``Date`` and ``DateTime`` columns.
+    """
+    pa = import_pyarrow()
+    db_type = _arrow_db_type(pa, field.type)
+    if field.nullable and not db_type.startswith(('Array(', 'Map(', 'Tuple(')):
+        if db_type.startswith('LowCardinality('):
+            return 'LowCardinality(Nullable(%s))' % db_type[15:-1]
+        return 'Nullable(%s)' % db_type
+    return db_type
+
+
+def _arrow_db_type(pa: Any, arrow_type: Any) -> str:
+    types = pa.types
+    if types.is_integer(arrow_type):
+        return '%sInt%d' % ('' if types.is_signed_integer(arrow_type) else 'U', arrow_type.bit_width)
+    if types.is_floating(arrow_type):
+        return 'Float%d' % arrow_type.bit_width
+    if types.is_boolean(arrow_type):
+        return 'Bool'
+    if types.is_fixed_size_binary(arrow_type) and not types.is_decimal(arrow_type):
+        return 'FixedString(%d)' % arrow_type.byte_width
+    if types.is_string(arrow_type) or types.is_large_string(arrow_type) or types.is_binary(arrow_type) or \
+            types.is_large_binary(arrow_type):
+        return 'String'
+    if types.is_decimal(arrow_type):
+        return 'Decimal(%d, %d)' % (arrow_type.precision, arrow_type.scale)
+    if types.is_date(arrow_type):
+        return 'Date32'
+    if types.is_timestamp(arrow_type):
+        precision = {'s': 0, 'ms': 3, 'us': 6, 'ns': 9}[arrow_type.unit]
+        return "DateTime64(%d, '%s')" % (precision, arrow_type.tz) if arrow_type.tz else 'DateTime64(%d)' % precision
+    if types.is_dictionary(arrow_type):
+        return 'LowCardinality(%s)' % _arrow_db_type(pa, arrow_type.value_type)
+    if types.is_map(arrow_type):
+        return 'Map(%s, %s)' % (_arrow_db_type(pa, arrow_type.key_type), _arrow_db_type(pa, arrow_type.item_type))
+    if types.is_list(arrow_type) or types.is_large_list(arrow_type):
+        return 'Array(%s)' % arrow_db_type(arrow_type.value_field)
+    if types.is_struct(arrow_type):
+        return 'Tuple(%s)' % ', '.join(arrow_db_type(arrow_type.field(i)) for i in range(arrow_type.num_fields))
+    if types.is_null(arrow_type):
+        return 'Nothing'
+    return str(arrow_type)
+
+
+def arrow_caster(schema: Any, columns: List[Tuple[str, str]]) -> Callable[[Any], Any]:
+    """ Returns the function casting the ``Date`` and ``DateTime`` columns of Arrow tables or
+    record batches of ``schema``, given the ``(name, type)`` columns of the result, from integers
+    to dates and timestamps. Casts only touch the column buffers.
+    """
+    pa = import_pyarrow()
+    casts = {}
+    for i, (field, (_, db_type)) in enumerate(zip(schema, columns)):
+        db_type = unwrap(db_type)
+        if field.type == pa.uint16() and db_type == 'Date':
+            casts[i] = (pa.int32(), pa.date32())
+        elif field.type == pa.uint32() and is_temporal(db_type):
+            timezone = db_type[10:-2] if db_type.startswith('DateTime(') else None
+            casts[i] = (pa.int64(), pa.timestamp('s', tz=timezone))
+    if not casts:
+        return lambda data: data
+
+    def cast(data):
+        arrays = [data.column(i) for i in range(data.num_columns)]
+        for i, (wide, target) in casts.items():
+            arrays[i] = arrays[i].cast(wide).cast(target)
+        return type(data).from_arrays(arrays, names=data.schema.names)
+    return cast
+
+
+class ColumnarResult(object):
+    """ Base class for query results fetched in a columnar wire format """
+
+    @property
+    def columns(self) -> List[Tuple[str, str]]:
+        """ List of ``(name, type)`` tuples """
+        raise NotImplementedError()
+
+    def record_batches(self) -> Iterator[Any]:
+        """ Yields the (remaining) result as ``pyarrow.RecordBatch`` objects """
+        raise NotImplementedError()
+
+    def read_all(self) -> Any:
+        """ Returns the (remaining) result as a ``pyarrow.Table`` """
+        raise NotImplementedError()
+
+    def to_numpy(self) -> Dict[str, Any]:
+        """ Returns the (remaining) result as a dict of NumPy arrays keyed by column name """
+        raise NotImplementedError()
+
+    def rows(self) -> Iterator[Tuple[Any, ...]]:
+        """ Yields the (remaining) result one row at a time """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class ArrowResult(ColumnarResult):
+    """ Result read incrementally from an ``ArrowStream`` response.
+
+    Column types are told by the Arrow schema, except for ``uint16`` and ``uint32`` columns,
+    which are ``Date`` and ``DateTime`` columns as well as integers. Those are told apart by the
+    types ``declared`` by the statement, if known, or by the result meta given to
+    :meth:`set_meta`; the names of the columns still undecided are in ``unresolved``. ``Date``
+    and ``DateTime`` columns are read as ``date32`` and ``timestamp[s]``.
+    """
+
+    def __init__(self, response, report: Optional[QueryReport] = None, declared: Optional[Dict[str, str]] = None):
+        self._pa = import_pyarrow()
+        self._response = response
+        # Completed and reported when the result is closed
+        self._report = report
+        self._rows = 0
+        self._reader = self._pa.ipc.open_stream(transport.raw_reader(response))
+        self._columns: List[Tuple[str, str]] = []
+        self.unresolved: List[str] = []
+        for field in self._reader.schema:
+            db_type = arrow_db_type(field)
+            if field.type in (self._pa.uint16(), self._pa.uint32()):
+                declared_type = (declared or {}).get(field.name)
+                if declared_type is None:
+                    self.unresolved.append(field.name)
+                elif is_temporal(declared_type):
+                    db_type = declared_type
+            self._columns.append((field.name, db_type))
+        self._cast = arrow_caster(self._reader.schema, self._columns)
+
+    def set_meta(self, columns: List[Tuple[str, str]]):
+        """ Sets the ``(name, type)`` columns of the result, as the server describes them """
+        self._columns = list(columns)
+        self.unresolved = []
+        self._cast = arrow_caster(self._reader.schema, self._columns)
+
+    @property
+    def columns(self) -> List[Tuple[str, str]]:
+        return self._columns
+
+    @property
+    def schema(self) -> Any:
+        """ The ``pyarrow.Schema`` of the tables and batches read """
+        return self._cast(self._reader.schema.empty_table()).schema
+
+    def record_batches(self) -> Iterator[Any]:
+        clock = time.perf_counter
+        try:
+            while True:
+                start = clock()
+                try:
+                    batch = self._reader.read_next_batch()
+                except StopIteration:
+                    break
+                finally:
+                    self._spent(clock() - start)
+                self._rows += batch.num_rows
+                yield self._cast(batch)
+        finally:
+            self.close()
+
+    def read_all(self) -> Any:
+        start = time.perf_counter()
+        try:
+            table = self._reader.read_all()
+            self._rows += table.num_rows
+            return self._cast(table)
+        finally:
+            self._spent(time.perf_counter() - start)
+            self.close()
+
+    def _spent(self, seconds: float):
+        # Arrow buffers are used as read, so reading is all of the download, decode and materialize
+        if self._report is not None:
+            self._report.timings.download += seconds
+
+    def to_numpy(self) -> Dict[str, Any]:
+        table = self.read_all()
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+
+    def rows(self) -> Iterator[Tuple[Any, ...]]:
+        for batch in self.record_batches():
+            yield from zip(*(c.to_pylist() for c in batch.columns))
+
+    def close(self):
+        self._response.close()
+        if self._report is not None:
+            report, self._report = self._report, None
+            report.rows = self._rows
+            notify(report)
+
+
+class JSONColumnsResult(ColumnarResult):
+    """ Result decoded from a ``JSONColumnsWithMetadata`` response, used when pyarrow is not installed """
+
+    def __init__(self, result: Dict[str, Any]):
+        self._meta = result['meta']
+        self._data = result['data']
+
+    @property
+    def columns(self) -> List[Tuple[str, str]]:
+        return [(f['name'], f['type']) for f in self._meta]
+
+    def _take(self) -> Dict[str, List[Any]]:
+        data, self._data = self._data, {f['name']: [] for f in self._meta}
+        return data
+
+    def record_batches(self) -> Iterator[Any]:
+        yield from self.read_all().to_batches()
+
+    def read_all(self) -> Any:
+        pa = import_pyarrow()
+        if pa is None:
+            raise NotSupportedError("pyarrow is required for Arrow fetches")
+        return pa.table(self._take())
+
+    def to_numpy(self) -> Dict[str, Any]:
+        np = import_numpy()
+        data = self._take()
+        arrays = {}
+        for f in self._meta:
+            values = data[f['name']]
+            dtype = numpy_dtype(f['type'])
+            if dtype is None:
+                convert = column_converter(f['type'])
+                if convert is not None:
+                    values = convert(values)
+                # fromiter keeps arrays (lists) as elements instead of adding a dimension
+                arrays[f['name']] = np.fromiter(values, dtype=object, count=len(values))
+            else:
+                arrays[f['name']] = np.asarray(values, dtype=dtype)
+        return arrays
+
+    def rows(self) -> Iterator[Tuple[Any, ...]]:
+        data = self._take()
+        columns = []
+        for f in self._meta:
+            convert = column_converter(f['type'])
+            columns.append(data[f['name']] if convert is None else convert(data[f['name']]))
+        yield from zip(*columns)
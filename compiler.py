@@ -16,11 +16,148 @@
 #   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
 #             https://github.com/cloudflare/sqlalchemy-clickhouse
 
+import operator
+import re
+from typing import List, Optional, Sequence, Tuple
+
 import sqlalchemy.types as sqltypes
 from sqlalchemy.dialects.postgresql.base import PGCompiler
 
+from param_escaper import ParamEscaper
+from pipe import merge_params
+
+
+_escaper = ParamEscaper()
+
+_array_types = {int, float, str}
+
+# IN lists with this many values or more are rendered as a single array
+DEFAULT_IN_LIST_THRESHOLD = 1000
+# Runs of consecutive integers this long or longer are rendered as range()
+MIN_RANGE_LENGTH = 16
+
+
+# Types of {name:Type} placeholders, by SQLAlchemy type; the first match wins
+_server_types = [
+    (sqltypes.Boolean, 'Bool'),
+    (sqltypes.SmallInteger, 'Int16'),
+    (sqltypes.Integer, 'Int64'),
+    (sqltypes.Float, 'Float64'),
+    (sqltypes.DateTime, 'DateTime'),
+    (sqltypes.Date, 'Date'),
+    (sqltypes.String, 'String'),
+]
+
+RE_IDENTIFIER = re.compile(r'[A-Za-z_]\w*\Z')
+
+
+def server_param_type(type_: sqltypes.TypeEngine) -> Optional[str]:
+    """ Returns the ClickHouse type of a bound parameter of type ``type_``, or None when it can't be inferred """
+    if isinstance(type_, sqltypes.TypeDecorator):
+        type_ = type_.impl
+    if isinstance(type_, sqltypes.ARRAY):
+        item = server_param_type(type_.item_type)
+        return item and 'Array(%s)' % item
+    if isinstance(type_, sqltypes.Numeric) and not isinstance(type_, sqltypes.Float):
+        if type_.precision is None or type_.scale is None:
+            return None
+        return 'Decimal(%d, %d)' % (type_.precision, type_.scale)
+    for cls, name in _server_types:
+        if isinstance(type_, cls):
+            return name
+    return None
+
+
+def compact_ranges(ids: Sequence[int], min_length: int = MIN_RANGE_LENGTH) -> Tuple[List[int], List[Tuple[int, int]]]:
+    """ Splits sorted, distinct integers into the values outside long runs and the ``(first, last)`` runs """
+    # No run is that long unless some value is followed, min_length - 1 places later, by value + min_length - 1
+    span = min_length - 1
+    if span > 0 and span not in map(operator.sub, ids[span:], ids):
+        return list(ids), []
+    singles: List[int] = []
+    ranges: List[Tuple[int, int]] = []
+    start = 0
+    n = len(ids)
+    for i in range(1, n + 1):
+        if i < n and ids[i] == ids[i - 1] + 1:
+            continue
+        if i - start >= min_length:
+            ranges.append((ids[start], ids[i - 1]))
+        else:
+            singles.extend(ids[start:i])
+        start = i
+    return singles, ranges
+
+
+def render_in_array(values: Sequence) -> str:
+    """ Returns a subquery with the values of an IN list, as one array.
+
+    Integers are deduplicated and sorted, and long runs of consecutive ones, negative ones
+    included, are sent as ``range()`` calls, so ``x IN (SELECT arrayJoin([...]))`` costs the server a single set.
+    """
+    if set(map(type, values)) == {int}:
+        ids = sorted(set(values))
+        singles, ranges = compact_ranges(ids)
+        arrays = ['range(%d, %d)' % (first, last + 1) for first, last in ranges]
+        if singles or not arrays:
+            arrays.insert(0, '[' + ','.join(map(str, singles)) + ']')
+        array = arrays[0] if len(arrays) == 1 else 'arrayConcat(%s)' % ', '.join(arrays)
+    else:
+        # Statements are %-formatted by the cursor
+        array = '[' + ','.join(_escaper.escape_column(list(dict.fromkeys(values)))).replace('%', '%%') + ']'
+    return 'SELECT arrayJoin(%s)' % array
+
 
 class TinybirdCompiler(PGCompiler):
+    def __init__(self, *args, **kwargs):
+        # Parameters of the Pipes in the statement, sent with the query
+        self.tinybird_pipe_params = {}
+        # Name of the Pipe whose endpoint answers the statement, when executed on its own
+        self.tinybird_pipe = None
+        # ClickHouse types of the parameters sent apart from the SQL, by name
+        self.tinybird_server_params = {}
+        super(TinybirdCompiler, self).__init__(*args, **kwargs)
+
+    def _server_params(self, **kw) -> bool:
+        return (self.dialect.server_params and not self.for_executemany and not self.isinsert
+                and not kw.get('literal_binds') and not kw.get('literal_execute') and not kw.get('tinybird_client_bind'))
+
+    def visit_bindparam(self, bindparam, **kw):
+        if bindparam.expanding and not bindparam.literal_execute and self._server_params(**kw):
+            type_ = bindparam.type
+            if not type_._is_tuple_type and server_param_type(type_) is not None:
+                # The whole list is one Array parameter, so the SQL doesn't change with its length
+                array = bindparam._clone()
+                array.expanding = False
+                array.type = sqltypes.ARRAY(type_)
+                return '(SELECT arrayJoin(%s))' % super(TinybirdCompiler, self).visit_bindparam(array, **kw)
+        return super(TinybirdCompiler, self).visit_bindparam(bindparam, **kw)
+
+    def bindparam_string(self, name, post_compile=False, **kw):
+        if not post_compile and not self.positional and RE_IDENTIFIER.match(name) and self._server_params(**kw):
+            type_ = server_param_type(self.binds[name].type) if name in self.binds else None
+            if type_ is not None:
+                self.tinybird_server_params[name] = type_
+                return '{%s:%s}' % (name, type_)
+        return super(TinybirdCompiler, self).bindparam_string(name, post_compile=post_compile, **kw)
+
+    def visit_tinybird_pipe(self, pipe, asfrom=False, **kw):
+        merge_params(self.tinybird_pipe_params, pipe)
+        if not asfrom and not self.stack:
+            self.tinybird_pipe = pipe.name
+            return 'SELECT * FROM ' + self.preparer.quote(pipe.name)
+        return self.visit_table(pipe, asfrom=asfrom, **kw)
+
+    def _literal_execute_expanding_parameter(self, name, parameter, values):
+        threshold = self.dialect.in_list_threshold
+        if threshold is not None and len(values) >= threshold and not parameter.type._is_tuple_type:
+            processor = parameter.type._cached_bind_processor(self.dialect)
+            processed = values if processor is None else [processor(v) for v in values]
+            if set(map(type, processed)) <= _array_types:
+                # No bound parameter per value: the list is sent as one array
+                return [], render_in_array(processed)
+        return super(TinybirdCompiler, self)._literal_execute_expanding_parameter(name, parameter, values)
+
     def visit_count_func(self, fn, **kw):
         return 'count{0}'.format(self.process(fn.clause_expr, **kw))
 
@@ -57,20 +194,6 @@ class TinybirdCompiler(PGCompiler):
     def visit_concat_op_binary(self, binary, operator, **kw):
         return "concat(%s, %s)" % (self.process(binary.left), self.process(binary.right))
 
-    def visit_in_op_binary(self, binary, operator, **kw):
-        kw['literal_binds'] = True
-        return '%s IN %s' % (
-            self.process(binary.left, **kw),
-            self.process(binary.right, **kw)
-        )
-
-    def visit_notin_op_binary(self, binary, operator, **kw):
-        kw['literal_binds'] = True
-        return '%s NOT IN %s' % (
-            self.process(binary.left, **kw),
-            self.process(binary.right, **kw)
-        )
-
     def visit_column(self, column, add_to_result_map=None,
                      include_table=True, **kwargs):
         # Columns prefixed with table name are not supported
@@ -88,14 +211,9 @@ class TinybirdCompiler(PGCompiler):
     def limit_clause(self, select, **kw):
         text = ''
         if select._limit_clause is not None:
-            text += '\n LIMIT ' + self.process(select._limit_clause, **kw)
+            text += '\n LIMIT ' + self.process(select._limit_clause, tinybird_client_bind=True, **kw)
         if select._offset_clause is not None:
-            text = '\n LIMIT '
-            if select._limit_clause is None:
-                text += self.process(sql.literal(-1))
-            else:
-                text += '0'
-            text += ',' + self.process(select._offset_clause, **kw)
+            text += '\n OFFSET ' + self.process(select._offset_clause, tinybird_client_bind=True, **kw)
         return text
 
     def for_update_clause(self, select, **kw):
@@ -16,16 +16,33 @@
 #   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
 #             https://github.com/cloudflare/sqlalchemy-clickhouse
 
+from concurrent.futures import ThreadPoolExecutor, wait
 import json
-from typing import Any, Generator, List, Optional, Type, Dict
-from requests import Session
+import os
+import re
+import threading
+import time
+from typing import (TYPE_CHECKING, Any, BinaryIO, Callable, Generator, Iterable, Iterator, List, Optional, Tuple,
+                    Type, Dict, Union)
+from requests import Response, Session
 
-from infi.clickhouse_orm.database import Database
-from infi.clickhouse_orm.models import Model, ModelBase
+from budget import ReadBudget
+from cache import ResultCache, cache_key, get_cache, settings_key
+from converters import convert_rows, row_converter
+from columnar import (ARROW_FORMAT, ARROW_SETTINGS, JSON_COLUMNS_FORMAT, ArrowResult, ColumnarResult,
+                      JSONColumnsResult, import_pyarrow)
+from error import DatabaseError, Error, NotSupportedError, OperationalError, ProgrammingError
+from ingest import EventsIngestor
+from instrument import QueryReport, notify
+import ingest
+from upload import UploadProgress
+import upload
+from param_escaper import ParamEscaper
+from result import ResultBuffer, RowBuffer, StreamBuffer
+import transport
 
-from six import PY3, string_types
-
-from error import NotSupportedError
+if TYPE_CHECKING:
+    from infi.clickhouse_orm.models import Model
 
 
 # See http://www.python.org/dev/peps/pep-0249/
@@ -38,6 +55,11 @@ apilevel = '2.0'
 threadsafety = 2  # Threads may share the module and connections.
 paramstyle = 'pyformat'  # Python extended format codes, e.g. ...WHERE name=%(name)s
 
+_escaper = ParamEscaper()
+
+# Queries run at the same time by select_many and Cursor.execute_concurrent
+DEFAULT_MAX_CONCURRENCY = 8
+
 # Python 2/3 compatibility
 try:
     isinstance('', basestring)
@@ -45,66 +67,505 @@ except NameError:
     basestring = str
 
 
-class Connection(Database):
+class Connection(object):
     """
         These objects are small stateless factories for cursors, which do all the real work.
     """
-    def __init__(self, db_url: str = 'https://api.tinybird.co/', token: str = None):
-        db_url = f"{db_url.lstrip('/')}/v0/sql"
+    # Bytes read from the socket at a time when streaming results
+    stream_chunk_size: int = 64 * 1024
+
+    def __init__(self, db_url: str = 'https://api.tinybird.co/', token: str = None, timeout: float = 60,
+                 pool_connections: Optional[int] = None, pool_maxsize: Optional[int] = None, pool_block: bool = False,
+                 keep_alive: bool = True, idle_timeout: Optional[float] = None, query_method: str = 'get',
+                 compression: Optional[str] = None, compress_threshold: int = transport.DEFAULT_COMPRESS_THRESHOLD,
+                 cache: Union[str, ResultCache, None] = None, cache_ttl: float = 0, cache_max_bytes: Optional[int] = None,
+                 cache_dir: Optional[str] = None, ingest_max_rows: int = ingest.DEFAULT_MAX_ROWS,
+                 ingest_max_bytes: int = ingest.DEFAULT_MAX_BYTES,
+                 ingest_flush_interval: float = ingest.DEFAULT_FLUSH_INTERVAL,
+                 max_retries: int = transport.DEFAULT_MAX_RETRIES, rate_limit: Optional[float] = None,
+                 settings: Optional[Dict[str, Any]] = None, max_rows_read: Optional[int] = None,
+                 max_bytes_read: Optional[int] = None, max_execution_time: Optional[float] = None,
+                 budget_preflight: bool = False, budget_mode: str = 'hard'):
+        """
+            - `timeout`: seconds to wait for the server to answer, or send more of a response.
+            - `query_method`: ``'get'`` sends the SQL in the ``q`` URL parameter, ``'post'`` in the request body.
+            - `compression`: ``'gzip'`` or ``'zstd'`` to compress POST bodies of ``compress_threshold`` bytes or more.
+            - `cache`: ``'memory'``, ``'disk'`` (in ``cache_dir``) or a :class:`cache.ResultCache` to cache results
+              in. Results are only cached for a positive TTL, ``cache_ttl`` by default.
+            - `ingest_max_rows`, `ingest_max_bytes`, `ingest_flush_interval`: batch limits of :meth:`ingest`.
+            - `max_retries`: times a rate-limited or failed read is sent again.
+            - `rate_limit`: requests per second sent with this token until the rate limit headers
+              of the API tell the actual limit.
+            - `settings`: ClickHouse settings sent with every query, e.g. ``{'max_execution_time': 10}``,
+              on top of :data:`transport.DEFAULT_SETTINGS`.
+            - `max_rows_read`, `max_bytes_read`, `max_execution_time`, `budget_preflight`, `budget_mode`:
+              the :class:`budget.ReadBudget` of queries run by cursors of this connection.
+        """
+        self.api_url = db_url.rstrip('/')
+        db_url = f"{self.api_url}/v0/sql"
 
         self.token = token
         self.db_url = db_url
+        self.timeout = timeout
         self.readonly = True
+        self.query_method = query_method.lower()
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        if isinstance(cache, str):
+            cache = get_cache(cache, max_bytes=cache_max_bytes, directory=cache_dir)
+        self.result_cache: Optional[ResultCache] = cache
+        self.cache_ttl = cache_ttl
+        self.ingest_options = {
+            'max_rows': ingest_max_rows,
+            'max_bytes': ingest_max_bytes,
+            'flush_interval': ingest_flush_interval,
+        }
+        self._ingestors: Dict[str, EventsIngestor] = {}
+        self._ingestors_lock = threading.Lock()
+        # Result columns of the queries fetched in ArrowStream, by query and settings
+        self._result_columns: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+        self.max_retries = max_retries
+        self.rate_limiter = transport.get_bucket(db_url, token, rate_limit)
+        self.read_budget: Optional[ReadBudget] = None
+        if (max_rows_read, max_bytes_read, max_execution_time) != (None, None, None):
+            self.read_budget = ReadBudget(max_rows_read, max_bytes_read, max_execution_time,
+                                          preflight=budget_preflight, mode=budget_mode)
+
+        self.settings = dict(transport.DEFAULT_SETTINGS, **(settings or {}))
+
+        # Share HTTP connections with every other Connection to the same host
+        self.request_session = transport.get_session(
+            db_url, pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block,
+            keep_alive=keep_alive, idle_timeout=idle_timeout)
+
+    def select(self, query: str, model_class: Optional[Type['Model']] = None, settings: Optional[Dict[str, Any]] = None,
+               stream: bool = False, report: Optional[QueryReport] = None) -> Iterator['Model']:
+        """ Runs ``query`` and returns an iterator of model instances.
+
+        With ``stream=True`` rows are requested in a row-delimited format and parsed as they arrive,
+        so the full result is never held in memory.
+
+        The statistics and timings of the query are kept in ``report``, if given, and sent to the
+        listeners of :mod:`instrument` (the same goes for every other ``select*`` method).
+        """
+        report = self._report(query, settings, report)
+        if stream:
+            return self._select_stream(query, model_class, settings, report)
+
+        result = self._read_json(self._query(query, 'JSON', settings, report), report)
+        with report.timings.measure('materialize'):
+            if not model_class:
+                model_class = _ad_hoc_model(tuple((f['name'], f['type']) for f in result['meta']))
+            models = [model_class(**values) for values in result['data']]
+        notify(report)
+        return iter(models)
+
+    def select_rows(self, query: str, settings: Optional[Dict[str, Any]] = None, stream: bool = False,
+                    cache_ttl: Optional[float] = None,
+                    report: Optional[QueryReport] = None) -> Tuple[List[Tuple[str, str]], ResultBuffer]:
+        """ Runs ``query`` and returns its ``(name, type)`` columns and a buffer of plain tuples.
+
+        Rows are the decoded JSON arrays of the response, so no model instance is built or
+        validated per row.
+
+        Unless streaming, results are kept in the result cache for ``cache_ttl`` seconds
+        (the connection's ``cache_ttl`` if not given).
+        """
+        report = self._report(query, settings, report)
+        if stream:
+            r = self._query(query, 'JSONCompactEachRowWithNamesAndTypes', settings, report)
+            try:
+                lines = self._iter_lines(r)
+                names = json.loads(next(lines, b'[]'))
+                types = json.loads(next(lines, b'[]'))
+            except:
+                r.close()
+                raise
+            columns = list(zip(names, types))
+            return columns, StreamBuffer(self._stream_rows(r, lines, row_converter(columns), report), r.close)
+
+        if cache_ttl is None:
+            cache_ttl = self.cache_ttl
+        key = None
+        if self.result_cache is not None and cache_ttl > 0:
+            # Keyed by every setting sent, as connections with other settings share the cache
+            key = cache_key(query, self.token, self.db_url, settings_key(dict(self.settings, **(settings or {}))))
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached[0], self._cached_rows(cached, report)
+
+        result = self._read_json(self._query(query, 'JSONCompact', settings, report), report)
+        columns = [(f['name'], f['type']) for f in result['meta']]
+        # Results are cached as decoded, and converted on every read
+        if key is not None:
+            self.result_cache.set(key, (columns, result['data']), cache_ttl)
+        with report.timings.measure('materialize'):
+            rows = RowBuffer(convert_rows(columns, result['data']))
+        notify(report)
+        return columns, rows
+
+    def _report(self, query: str, settings: Optional[Dict[str, Any]],
+                report: Optional[QueryReport]) -> QueryReport:
+        if report is None:
+            report = QueryReport(query=query)
+        if report.query_id is None and settings:
+            report.query_id = settings.get('query_id')
+        return report
+
+    def raw(self, query: str, settings: Optional[Dict[str, Any]] = None) -> str:
+        """ Runs ``query`` and returns the text of its response, in ``TabSeparated`` format """
+        r = self._query(query, 'TabSeparated', settings)
+        try:
+            return transport.read_content(r).decode('utf-8')
+        finally:
+            r.close()
+
+    def _read_json(self, r: Response, report: QueryReport) -> Dict[str, Any]:
+        """ Reads and decodes a ``JSON*`` response, keeping its statistics in ``report`` """
+        with report.timings.measure('download'):
+            content = transport.read_content(r)
+        with report.timings.measure('decode'):
+            result = json.loads(content)
+        report.update(result)
+        return result
+
+    def _cached_rows(self, cached: Tuple[List[Tuple[str, str]], List[Any]], report: QueryReport) -> RowBuffer:
+        report.cached = True
+        report.rows = len(cached[1])
+        with report.timings.measure('materialize'):
+            rows = RowBuffer(convert_rows(*cached))
+        notify(report)
+        return rows
+
+    def select_many(self, queries: Iterable[Union[str, Tuple[str, Any]]], max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                    timeout: Optional[float] = None, cache_ttl: Optional[float] = None,
+                    return_exceptions: bool = True) -> List[Union[Tuple[List[Tuple[str, str]], ResultBuffer], Exception]]:
+        """ Runs independent queries at the same time and returns their results in input order.
+
+        Queries are SQL strings or ``(sql, parameters)`` pairs, escaped as in
+        :meth:`cursor.Cursor.execute`. Each result is what :meth:`select_rows` returns for the
+        query or, with ``return_exceptions``, the exception it raised. Otherwise the first error
+        is raised once every query has finished.
+
+            - `max_concurrency`: number of queries in flight at a time.
+            - `timeout`: seconds for the whole batch. Queries not finished by then fail with
+              :class:`error.OperationalError`, and their requests are aborted, which stops them on
+              the server and frees their pooled connections.
+        """
+        def run(query):
+            if not isinstance(query, str):
+                query, parameters = query
+                if parameters:
+                    query = query % _escaper.escape_args(parameters)
+            return self.select_rows(query, cache_ttl=cache_ttl)
+
+        return self._run_concurrent(run, queries, max_concurrency, timeout, return_exceptions,
+                                    close=lambda result: result[1].close())
+
+    def _run_concurrent(self, fn: Callable[[Any], Any], items: Iterable[Any], max_concurrency: int,
+                        timeout: Optional[float], return_exceptions: bool, close: Callable[[Any], None]) -> List[Any]:
+        """ Calls ``fn`` on every item from a pool of ``max_concurrency`` threads sharing the HTTP
+        session, and returns the results (or exceptions) in order. ``close`` releases a result.
+        """
+        items = list(items)
+        if not items:
+            return []
+
+        def call(inflight, item):
+            with inflight:
+                return fn(item)
+
+        inflights = [transport.InFlight() for _ in items]
+        executor = ThreadPoolExecutor(max_workers=min(max_concurrency, len(items)), thread_name_prefix='tinybird-query')
+        try:
+            futures = [executor.submit(call, inflight, item) for inflight, item in zip(inflights, items)]
+            _, not_done = wait(futures, timeout)
+        finally:
+            executor.shutdown(wait=False)
+
+        def close_late(future):
+            if not future.cancelled() and future.exception() is None:
+                close(future.result())
 
-        super(Connection, self).__init__(db_name='', db_url=db_url, readonly=True, autocreate=False)
+        results = []
+        for future, inflight in zip(futures, inflights):
+            if future in not_done:
+                # Queries still running are aborted, and results that arrive after all are
+                # released as soon as they do
+                future.cancel()
+                inflight.cancel()
+                future.add_done_callback(close_late)
+                results.append(OperationalError("Query did not finish within {} seconds".format(timeout)))
+            elif future.exception() is not None:
+                results.append(future.exception())
+            else:
+                results.append(future.result())
 
-    def select(self, query: str, model_class: Optional[Type[Model]] = None, settings: Optional[Dict[str, Any]] = None) -> Generator[Model, None, None]:
-        query = f'{query} FORMAT JSON'        
-        if PY3 and isinstance(query, string_types):
+        if not return_exceptions:
+            error = next((r for r in results if isinstance(r, Exception)), None)
+            if error is not None:
+                for result in results:
+                    if not isinstance(result, Exception):
+                        close(result)
+                raise error
+        return results
+
+    def select_pipe(self, name: str, params: Optional[Dict[str, Any]] = None, cache_ttl: Optional[float] = None,
+                    report: Optional[QueryReport] = None) -> Tuple[List[Tuple[str, str]], ResultBuffer]:
+        """ Reads the endpoint of the published Pipe ``name`` with ``params`` and returns its
+        ``(name, type)`` columns and rows, cached like those of :meth:`select_rows`.
+        """
+        if cache_ttl is None:
+            cache_ttl = self.cache_ttl
+        # Kept out of the module imports, as pipe pulls in SQLAlchemy
+        from pipe import encode_params
+        params = encode_params(params or {})
+        report = self._report(f'pipe {name}', params, report)
+        key = None
+        if self.result_cache is not None and cache_ttl > 0:
+            key = cache_key(f'pipe {name}', self.token, self.api_url, settings_key(dict(self.settings, **params)))
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached[0], self._cached_rows(cached, report)
+
+        req_headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Accept-Encoding': transport.accept_encoding(),
+        }
+        r = transport.send(self.request_session, 'GET', f'{self.api_url}/v0/pipes/{name}.json', self.rate_limiter,
+                           self.max_retries, timings=report.timings, params=params, headers=req_headers,
+                           stream=True, timeout=self.timeout)
+        report.update_from_headers(r.headers)
+        result = self._read_json(r, report)
+        columns = [(f['name'], f['type']) for f in result['meta']]
+        with report.timings.measure('materialize'):
+            names = [c[0] for c in columns]
+            rows = [[row[n] for n in names] for row in result['data']]
+            # Cached as decoded, before rows are converted in place
+            if key is not None:
+                self.result_cache.set(key, (columns, rows), cache_ttl)
+            buffer = RowBuffer(convert_rows(columns, rows))
+        notify(report)
+        return columns, buffer
+
+    def _stream_rows(self, r: Response, lines: Iterator[bytes],
+                     convert: Optional[Callable[[List[Any]], Tuple[Any, ...]]] = None,
+                     report: Optional[QueryReport] = None) -> Generator[Tuple[Any, ...], None, None]:
+        convert = convert or tuple
+        clock = time.perf_counter
+        spent = 0.0
+        n = 0
+        try:
+            # Only the time spent reading rows counts, not the time the consumer spends between them
+            start = clock()
+            for line in lines:
+                row = convert(json.loads(line))
+                spent += clock() - start
+                n += 1
+                yield row
+                start = clock()
+            spent += clock() - start
+        finally:
+            r.close()
+            if report is not None:
+                report.timings.download += spent
+                report.rows = n
+                notify(report)
+
+    def select_columnar(self, query: str, settings: Optional[Dict[str, Any]] = None,
+                        report: Optional[QueryReport] = None,
+                        types: Optional[Dict[str, str]] = None) -> ColumnarResult:
+        """ Runs ``query`` requesting a columnar wire format, so no Python object is built per row.
+
+        ``ArrowStream`` is read incrementally when pyarrow is installed. Otherwise the result is
+        decoded from ``JSONColumnsWithMetadata``. Either way columns are reported with their
+        ClickHouse types, and ``Date`` and ``DateTime`` values are read as dates and datetimes.
+
+        ArrowStream sends ``Date`` and ``DateTime`` columns as plain integers: ``types``, the
+        ClickHouse types of the result columns by name, if known, tell them apart. For columns
+        still in doubt the result columns are asked with a ``LIMIT 0`` query, once per query.
+        """
+        report = self._report(query, settings, report)
+        if import_pyarrow() is not None:
+            result = ArrowResult(self._query(query, ARROW_FORMAT, dict(ARROW_SETTINGS, **(settings or {})), report),
+                                 report, types)
+            if result.unresolved:
+                try:
+                    result.set_meta(self._columns_of(query, settings))
+                except:
+                    result.close()
+                    raise
+            return result
+
+        result = JSONColumnsResult(self._read_json(self._query(query, JSON_COLUMNS_FORMAT, settings, report), report))
+        notify(report)
+        return result
+
+    def _columns_of(self, query: str, settings: Optional[Dict[str, Any]]) -> List[Tuple[str, str]]:
+        settings = {k: v for k, v in (settings or {}).items() if k != 'query_id'}
+        key = (query, settings_key(settings))
+        columns = self._result_columns.get(key)
+        if columns is None:
+            columns, _ = self.select_rows(_columns_query(query), settings, cache_ttl=0)
+            if len(self._result_columns) >= 256:
+                self._result_columns.clear()
+            self._result_columns[key] = columns
+        return columns
+
+    def _select_stream(self, query: str, model_class: Optional[Type['Model']], settings: Optional[Dict[str, Any]],
+                       report: QueryReport) -> Generator['Model', None, None]:
+        r = self._query(query, 'JSONCompactEachRowWithNamesAndTypes', settings, report)
+        try:
+            lines = self._iter_lines(r)
+            names = json.loads(next(lines, b'[]'))
+            types = json.loads(next(lines, b'[]'))
+
+            if not model_class:
+                model_class = _ad_hoc_model(tuple(zip(names, types)))
+
+            yield from self._stream_rows(r, lines, lambda values: model_class(**dict(zip(names, values))), report)
+        finally:
+            r.close()
+
+    def _query(self, query: str, fmt: str, settings: Optional[Dict[str, Any]] = None,
+               report: Optional[QueryReport] = None) -> Response:
+        """ Sends ``query`` with the connection's settings, overridden by ``settings``, as URL parameters.
+
+        The body is left to read by the caller, so its download is timed apart from the request
+        in ``report``.
+        """
+        # A trailing semicolon would end the statement before its FORMAT clause
+        query = f"{query.rstrip().rstrip(';')} FORMAT {fmt}"
+        if isinstance(query, str):
             query = query.encode('utf-8')
-        
-        req_params = { 'q': query }
-        req_headers = { 'Authorization': f'Bearer {self.token}' }
+        req_params = transport.settings_params(dict(self.settings, **settings) if settings else self.settings)
+
+        req_headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Accept-Encoding': transport.accept_encoding(),
+        }
 
         session = self.request_session
-        r = session.get(self.db_url, params=req_params, headers=req_headers, stream=False, timeout=self.timeout)
-        if r.status_code != 200:
-            raise Exception(r.text)
-        
-        result = json.loads(r.text)
-        
-        if not model_class:
-            fields = tuple((f['name'], f['type']) for f in result['meta'])
-            model_class = ModelBase.create_ad_hoc_model(fields)
-
-        return (model_class(**values) for values in result['data'])
-        
+        timings = report.timings if report is not None else None
+        if self.query_method == 'post':
+            body, encoding = transport.encode_body(query, self.compression, self.compress_threshold)
+            req_headers['Content-Type'] = 'text/plain; charset=utf-8'
+            if encoding:
+                req_headers['Content-Encoding'] = encoding
+            r = transport.send(session, 'POST', self.db_url, self.rate_limiter, self.max_retries, timings=timings,
+                               params=req_params, data=body, headers=req_headers, stream=True, timeout=self.timeout)
+        else:
+            req_params['q'] = query
+            r = transport.send(session, 'GET', self.db_url, self.rate_limiter, self.max_retries, timings=timings,
+                               params=req_params, headers=req_headers, stream=True, timeout=self.timeout)
+        if report is not None:
+            report.update_from_headers(r.headers)
+        return r
+
+    def _iter_lines(self, r: Response) -> Iterator[bytes]:
+        """ Yields the non-empty lines of a streamed response, reading ``stream_chunk_size`` bytes at a time. """
+        return transport.iter_lines(r, self.stream_chunk_size)
+
+    def ingestor(self, datasource: str, **options) -> EventsIngestor:
+        """ Returns the :class:`ingest.EventsIngestor` of ``datasource``, created with ``options``
+        (on top of the connection's batch limits) the first time it is requested.
+        """
+        with self._ingestors_lock:
+            ingestor = self._ingestors.get(datasource)
+            if ingestor is None:
+                options = dict(self.ingest_options, **options)
+                ingestor = EventsIngestor(
+                    self.request_session, self.api_url, self.token, datasource, compression=self.compression,
+                    compress_threshold=self.compress_threshold, timeout=self.timeout, rate_limiter=self.rate_limiter,
+                    max_retries=self.max_retries, **options)
+                self._ingestors[datasource] = ingestor
+            return ingestor
+
+    def ingest(self, datasource: str, rows: Iterable[Dict[str, Any]]) -> int:
+        """ Appends rows, given as dicts keyed by column name, to ``datasource`` through the Events API.
+
+        Rows are buffered and sent in batches by a background thread; :meth:`flush` waits until
+        every buffered row has been sent. Returns how many rows were buffered.
+        """
+        return self.ingestor(datasource).extend(rows)
+
+    def flush(self):
+        """ Sends the rows buffered by :meth:`ingest` and waits until they are acknowledged """
+        for ingestor in list(self._ingestors.values()):
+            ingestor.flush()
+
+    def upload(self, datasource: str, data: Union[str, os.PathLike, BinaryIO, Iterable[Any]], format: Optional[str] = None,
+               mode: str = 'append', compression: Optional[str] = None, part_size: Optional[int] = upload.DEFAULT_PART_SIZE,
+               chunk_size: int = upload.DEFAULT_CHUNK_SIZE,
+               progress: Optional[Callable[[UploadProgress], None]] = None,
+               header: Optional[bool] = None) -> UploadProgress:
+        """ Streams a file or rows to ``datasource`` through the Data Sources API.
+
+        The payload is read ``chunk_size`` bytes at a time and sent with chunked transfer
+        encoding, so it is never held in memory.
+
+            - `data`: a file path, a binary or text file object, or an iterable of rows (dicts for
+              NDJSON, sequences for CSV).
+            - `format`: ``'csv'``, ``'ndjson'`` or ``'parquet'``. Guessed from the extension of a
+              path, ``'ndjson'`` otherwise.
+            - `mode`: ``'append'`` or ``'replace'``.
+            - `compression`: ``'gzip'`` to compress the payload while it is sent. ``.gz`` files are
+              sent as they are.
+            - `part_size`: CSV and NDJSON payloads are split at the end of a record into uploads of
+              about this many bytes, or not split if ``None``. Line breaks in quoted CSV fields
+              don't end records.
+            - `progress`: called with the :class:`upload.UploadProgress` after every chunk.
+            - `header`: whether CSV data starts with a header row, which is then repeated at the
+              start of every part. Guessed from the first chunk of files if ``None``; rows never
+              have one.
+        """
+        return upload.upload(self.request_session, self.api_url, self.token, datasource, data, format=format,
+                             mode=mode, compression=compression, chunk_size=chunk_size, part_size=part_size,
+                             progress=progress, timeout=self.timeout, rate_limiter=self.rate_limiter, header=header)
 
     def close(self):
-        pass
+        with self._ingestors_lock:
+            ingestors = list(self._ingestors.values())
+            self._ingestors.clear()
+        for ingestor in ingestors:
+            ingestor.close()
 
     def commit(self):
         pass
 
-    def cursor(self, model_class: Optional[Type[Model]] = None) -> 'Cursor':
+    def cursor(self, model_class: Optional[Type['Model']] = None, stream: bool = False, columnar: bool = False) -> 'Cursor':
         from cursor import Cursor
-        return Cursor(self, model_class=model_class)
+        return Cursor(self, model_class=model_class, stream=stream, columnar=columnar)
 
     def rollback(self):
         raise NotSupportedError("Transactions are not supported")  # pragma: no cover
 
-    def _is_existing_database(self) -> bool:
-        return True
 
-    def _is_connection_readonly(self) -> bool:
-        return True
 
-    def _get_server_version(self, as_tuple=True):
-        ver = '1.0.0'
-        return tuple(int(n) for n in ver.split('.') if n.isdigit()) if as_tuple else ver
+# Trailing clauses of a query that cannot go inside a subquery
+_RE_FORMAT = re.compile(r'\s+FORMAT\s+\w+\s*$', re.IGNORECASE)
+_RE_SETTINGS = re.compile(r"\s+SETTINGS(\s*,?\s*\w+\s*=\s*('[^']*'|[\w.+-]+))+\s*$", re.IGNORECASE)
+
+
+def _columns_query(query: str) -> str:
+    """ Returns the query of the result columns of ``query``: ``query`` as a subquery limited to
+    no rows, its ``SETTINGS`` clause moved outside.
+    """
+    query = _RE_FORMAT.sub('', query.strip().rstrip(';').rstrip())
+    match = _RE_SETTINGS.search(query)
+    clause = ''
+    if match is not None:
+        query, clause = query[:match.start()], match.group(0)
+    return 'SELECT * FROM ({}) LIMIT 0{}'.format(query, clause)
+
 
-    def _send(*args, **kwargs) -> Any:
-        raise Exception("You're not supposed to see this")
+def _ad_hoc_model(fields: Tuple[Tuple[str, str], ...]) -> Type['Model']:
+    try:
+        from model import ad_hoc_model
+    except ImportError:
+        raise NotSupportedError("infi.clickhouse_orm is required for model results, "
+                                "install sqlalchemy_tinybird[models] or use select_rows")
+    return ad_hoc_model(fields)
 
 
 def connect(*args, **kwargs) -> Connection:
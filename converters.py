@@ -0,0 +1,158 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import datetime
+import decimal
+from functools import lru_cache
+from operator import itemgetter
+import re
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+
+# Conversion of JSON result values to Python values, driven by the ClickHouse types of the
+# result's meta. Types not listed here are already decoded by json (numbers, strings, bools).
+
+_RE_WRAPPER = re.compile(r'^(Nullable|LowCardinality)\((.*)\)$')
+
+Converter = Callable[[Any], Any]
+ColumnConverter = Callable[[Sequence[Any]], List[Any]]
+
+
+def _decimal(value: Any) -> decimal.Decimal:
+    # Decimals arrive as strings (output_format_json_quote_decimals). JSON numbers, sent when the
+    # setting is turned off, have already been rounded through float by json.loads.
+    return decimal.Decimal(value if isinstance(value, str) else repr(value))
+
+
+def _decimal_column(values: Sequence[Any]) -> List[decimal.Decimal]:
+    if float in set(map(type, values)):
+        return list(map(_decimal, values))
+    return list(map(decimal.Decimal, values))
+
+
+def _datetime64(value: str) -> datetime.datetime:
+    # fromisoformat takes 3 or 6 fractional digits on every supported Python, so pad or cut to 6
+    if len(value) > 19 and len(value) != 26:
+        value = value[:26].ljust(26, '0')
+    return datetime.datetime.fromisoformat(value)
+
+
+_converters = {
+    # 64-bit and wider integers are quoted by output_format_json_quote_64bit_integers
+    'Int64': int,
+    'UInt64': int,
+    'Int128': int,
+    'UInt128': int,
+    'Int256': int,
+    'UInt256': int,
+    'Date': datetime.date.fromisoformat,
+    'Date32': datetime.date.fromisoformat,
+    'DateTime': datetime.datetime.fromisoformat,
+    'DateTime64': _datetime64,
+    'Decimal': _decimal,
+    'Decimal32': _decimal,
+    'Decimal64': _decimal,
+    'Decimal128': _decimal,
+    'Decimal256': _decimal,
+}
+
+_column_converters = {
+    'Decimal': _decimal_column,
+    'Decimal32': _decimal_column,
+    'Decimal64': _decimal_column,
+    'Decimal128': _decimal_column,
+    'Decimal256': _decimal_column,
+}
+
+
+@lru_cache(maxsize=256)
+def value_converter(db_type: str) -> Optional[Converter]:
+    """ Returns the function converting a JSON value of a ClickHouse type, or ``None`` if the
+    value is used as decoded.
+    """
+    m = _RE_WRAPPER.match(db_type)
+    if m:
+        inner = value_converter(m.group(2))
+        if inner is None or m.group(1) == 'LowCardinality':
+            return inner
+        return lambda value: None if value is None else inner(value)
+    if db_type.startswith('Array('):
+        inner = value_converter(db_type[6:-1])
+        if inner is None:
+            return None
+        return lambda value: [inner(v) for v in value]
+    return _converters.get(db_type.split('(', 1)[0])
+
+
+@lru_cache(maxsize=256)
+def column_converter(db_type: str) -> Optional[ColumnConverter]:
+    """ Returns the function converting every JSON value of a column at once, or ``None`` """
+    m = _RE_WRAPPER.match(db_type)
+    if m and m.group(1) == 'Nullable':
+        inner = value_converter(m.group(2))
+        inner_column = column_converter(m.group(2))
+        if inner is None:
+            return None
+
+        def convert_nullable(values: Sequence[Any]) -> List[Any]:
+            # Columns without nulls take the unwrapped path
+            if None in values:
+                return [None if v is None else inner(v) for v in values]
+            return inner_column(values)
+        return convert_nullable
+
+    if m:
+        return column_converter(m.group(2))
+    convert_column = _column_converters.get(db_type.split('(', 1)[0])
+    if convert_column is not None:
+        return convert_column
+    convert = value_converter(db_type)
+    if convert is None:
+        return None
+    return lambda values: list(map(convert, values))
+
+
+def convert_rows(columns: Sequence[Tuple[str, str]], rows: Sequence[Sequence[Any]]) -> Sequence[Sequence[Any]]:
+    """ Converts decoded JSON rows column by column.
+
+    Rows are converted in place when they are lists, as decoded by json, which saves building
+    a new object per row.
+    """
+    converters = [(i, column_converter(db_type)) for i, (_, db_type) in enumerate(columns)]
+    converters = [(i, convert) for i, convert in converters if convert is not None]
+    if not rows or not converters:
+        return rows
+    if not isinstance(rows[0], list):
+        rows = [list(row) for row in rows]
+    for i, convert in converters:
+        for row, value in zip(rows, convert(list(map(itemgetter(i), rows)))):
+            row[i] = value
+    return rows
+
+
+def row_converter(columns: Sequence[Tuple[str, str]]) -> Optional[Callable[[Sequence[Any]], Tuple[Any, ...]]]:
+    """ Returns the function converting one decoded JSON row at a time, for streamed results, or
+    ``None`` when no column needs converting.
+    """
+    converters = [(i, value_converter(db_type)) for i, (_, db_type) in enumerate(columns)]
+    converters = [(i, convert) for i, convert in converters if convert is not None]
+    if not converters:
+        return None
+
+    def convert_row(row: Sequence[Any]) -> Tuple[Any, ...]:
+        row = list(row)
+        for i, convert in converters:
+            row[i] = convert(row[i])
+        return tuple(row)
+    return convert_row
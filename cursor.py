@@ -16,17 +16,32 @@
 #   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
 #             https://github.com/cloudflare/sqlalchemy-clickhouse
 
+import itertools
 import re
-from typing import Optional, Type
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple, Type, Union
 import uuid
 from param_escaper import ParamEscaper
-from connection import Connection
+from budget import ReadBudget, estimate_rows
+from columnar import ColumnarResult
+from connection import DEFAULT_MAX_CONCURRENCY, Connection
+from error import DatabaseError, NotSupportedError, ProgrammingError
+from instrument import QueryReport, QueryTimings
+from result import ResultBuffer, RowBuffer, StreamBuffer
+from transport import InFlight
 
-from infi.clickhouse_orm.models import Model
+if TYPE_CHECKING:
+    from infi.clickhouse_orm.models import Model
 
 
 _escaper = ParamEscaper()
 
+# INSERT statements sent to the Events API, e.g. INSERT INTO t (a, b) VALUES (%(a)s, %(b)s)
+RE_INSERT_VALUES = re.compile(
+    r"\s*INSERT\s+INTO\s+(?P<table>[^\s(]+)\s*(?:\((?P<columns>[^)]*)\))?\s*VALUES?\s*" +
+    r"\((?P<values>\s*(?:%s|%\(\w+\)s)\s*(?:,\s*(?:%s|%\(\w+\)s)\s*)*)\)\s*;?\s*\Z",
+    re.IGNORECASE | re.DOTALL)
+RE_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s")
+
 
 class Cursor(object):
     """These objects represent a database cursor, which is used to manage the context of a fetch
@@ -39,27 +54,69 @@ class Cursor(object):
     _STATE_RUNNING: int = 1
     _STATE_FINISHED: int = 2
 
-    def __init__(self, database: Connection, model_class: Optional[Type[Model]] = None):
+    def __init__(self, database: Connection, model_class: Optional[Type['Model']] = None, stream: bool = False,
+                 columnar: bool = False):
         self._db: Connection = database
         self._reset_state()
         self._arraysize: int = 1
         self._model_class = model_class
+        self._stream = stream
+        # Read results in a columnar wire format, see fetch_arrow_table()
+        self.columnar = columnar
+        # Seconds to keep results in the connection's result cache, or None for its default
+        self.cache_ttl: Optional[float] = None
+        # ClickHouse settings of the queries run by this cursor, on top of the connection's
+        self.settings: Optional[Dict[str, Any]] = None
+        # Pipe whose endpoint answers the next execute, instead of the SQL API
+        self.pipe: Optional[str] = None
+        # Read budget of the queries run by this cursor, on top of the connection's
+        self.read_budget: Optional[ReadBudget] = None
+        # ClickHouse types of the result columns of the next columnar query, by name, if known
+        self.column_types: Optional[Dict[str, str]] = None
 
     def _reset_state(self):
         """Reset state about the previous query in preparation for running another query"""
         self._uuid: Optional[uuid.uuid1] = None
+        # SQL of the last statement sent
+        self.query: Optional[str] = None
+        # Statistics and timings of the last statement
+        self.report: Optional[QueryReport] = None
         self._columns = None
         self._rownumber = 0
 
         # Internal helper state
         self._state = self._STATE_NONE
-        self._data = None
+        self._buffer: Optional[ResultBuffer] = None
         self._columns = None
+        self._result: Optional[ColumnarResult] = None
+        # Requests of the statement being executed, for cancel() to abort
+        self._inflight: Optional[InFlight] = None
 
     @property
     def rowcount(self):
-        """By default, return -1 to indicate that this is not supported."""
-        return -1
+        """Number of rows the last statement returned or inserted, or -1 while it is not known,
+        e.g. before a streamed result is exhausted.
+        """
+        if self.report is None or self.report.rows is None:
+            return -1
+        return self.report.rows
+
+    @property
+    def statistics(self) -> Dict[str, Any]:
+        """Statistics of the last query reported by the server, e.g. ``elapsed``, ``rows_read``
+        and ``bytes_read``. Empty for cached results.
+        """
+        return self.report.statistics if self.report is not None else {}
+
+    @property
+    def timings(self) -> Optional[QueryTimings]:
+        """Client-side time spent in each phase of the last query, see :class:`instrument.QueryTimings`"""
+        return self.report.timings if self.report is not None else None
+
+    @property
+    def query_id(self) -> Optional[str]:
+        """The ``query_id`` the last query was sent with"""
+        return str(self._uuid) if self._uuid is not None else None
 
     @property
     def description(self):
@@ -87,26 +144,117 @@ class Cursor(object):
         ]
 
     def close(self):
-        pass
+        self._close_result()
+
+    def _close_result(self):
+        """Release the rows of the previous result and its response, if still open"""
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+        if self._result is not None:
+            self._result.close()
+            self._result = None
 
     def execute(self, operation, parameters=None, is_response=True):
         """Prepare and execute a database operation (query or command). """
-        if parameters:
+        if self.pipe is not None:
+            pipe, self.pipe = self.pipe, None
+            return self.execute_pipe(pipe)
+        # SQLAlchemy passes parameters (maybe empty) whenever it doubled the % of the statement
+        if parameters is not None:
+            m = RE_INSERT_VALUES.match(operation)
+            if m:
+                return self._insert(m, (parameters,))
             sql = operation % _escaper.escape_args(parameters)
         else:
             sql = operation
 
+        self._close_result()
         self._reset_state()
 
-        self._state = self._STATE_RUNNING
         self._uuid = uuid.uuid1()
+        self._state = self._STATE_RUNNING
+        self.query = sql
+        settings = dict(self.settings or (), query_id=str(self._uuid))
+        self.report = QueryReport(str(self._uuid), sql)
+        budget = self._budget() if is_response else None
+        if budget is not None:
+            if budget.preflight:
+                budget.check_estimate(estimate_rows(self._db, sql, self.settings), self.query_id)
+            settings.update(budget.settings())
+
+        try:
+            self._abortable(self._run, sql, settings, is_response)
+        except DatabaseError as e:
+            # Only the limits the budget set are reported as such
+            exceeded = budget.exceeded_error(e) if budget is not None else None
+            if exceeded is None:
+                raise
+            raise exceeded from e
+        if budget is not None and not self._cancelled:
+            # Streamed results only have statistics when the response headers carry them
+            budget.check_statistics(self.report.statistics, self.query_id)
+
+    @property
+    def _cancelled(self) -> bool:
+        """ Whether cancel() stopped the statement being executed """
+        return self._state == self._STATE_FINISHED and self._uuid is None
 
-        if is_response:
-            response = self._db.select(sql, model_class=self._model_class, settings={'query_id': self._uuid})
-            self._process_response(response)
+    def _abortable(self, fn, *args):
+        """ Calls ``fn`` with its requests kept in ``_inflight``, so cancel() can abort them from
+        another thread. The errors of aborted requests are not raised.
+        """
+        self._inflight = InFlight()
+        try:
+            with self._inflight:
+                fn(*args)
+        except Exception:
+            if not self._cancelled:
+                raise
+        finally:
+            self._inflight = None
+
+    def _run(self, sql: str, settings: Dict[str, Any], is_response: bool):
+        if is_response and self.columnar:
+            self._process_columnar(self._db.select_columnar(sql, settings=settings, report=self.report,
+                                                               types=self.column_types))
+        elif is_response and self._model_class is None:
+            columns, rows = self._db.select_rows(sql, settings=settings, stream=self._stream,
+                                                 cache_ttl=self.cache_ttl, report=self.report)
+            self._process_rows(columns, rows)
+        elif is_response:
+            response = self._db.select(sql, model_class=self._model_class, settings=settings,
+                                       stream=self._stream, report=self.report)
+            if self._stream:
+                self._process_stream(response)
+            else:
+                self._process_response(response)
         else:
             self._db.raw(sql)
 
+    def _budget(self) -> Optional[ReadBudget]:
+        """ The read budget of the next query: the cursor's on top of the connection's """
+        budget = self._db.read_budget
+        if budget is None:
+            return self.read_budget
+        return budget.merge(self.read_budget)
+
+    def execute_pipe(self, name: str, params: Optional[Dict[str, Any]] = None):
+        """Read the endpoint of the published Pipe ``name``, with ``params`` on top of the cursor's
+        settings. Its rows are fetched like those of a query.
+        """
+        self._close_result()
+        self._reset_state()
+        self._uuid = uuid.uuid1()
+        self._state = self._STATE_RUNNING
+        params = dict(self.settings or (), **(params or {}))
+        self.report = QueryReport(query='pipe {}'.format(name))
+        self._abortable(self._run_pipe, name, params)
+
+    def _run_pipe(self, name: str, params: Dict[str, Any]):
+        columns, rows = self._db.select_pipe(name, params, cache_ttl=self.cache_ttl, report=self.report)
+        self._process_rows(columns, rows)
+
     def executemany(self, operation, seq_of_parameters):
         """Prepare a database operation (query or command) and then execute it against all parameter
         sequences or mappings found in the sequence ``seq_of_parameters``.
@@ -115,35 +263,76 @@ class Cursor(object):
 
         Return values are not defined.
         """
-        values_list = []
-        RE_INSERT_VALUES = re.compile(
-            r"\s*((?:INSERT|REPLACE)\s.+\sVALUES?\s*)" +
-            r"(\(\s*(?:%s|%\(.+\)s)\s*(?:,\s*(?:%s|%\(.+\)s)\s*)*\))" +
-            r"(\s*(?:ON DUPLICATE.*)?);?\s*\Z",
-            re.IGNORECASE | re.DOTALL)
-
         m = RE_INSERT_VALUES.match(operation)
         if m:
-            q_prefix = m.group(1) % ()
-            q_values = m.group(2).rstrip()
+            return self._insert(m, seq_of_parameters)
+        # Parsed once, and parameters escaped column by column
+        for sql in _escaper.template(operation).render_many(seq_of_parameters):
+            self.execute(sql)
+
+    def execute_concurrent(self, operations: Iterable[Union[str, Tuple[str, Any]]],
+                           max_concurrency: int = DEFAULT_MAX_CONCURRENCY, timeout: Optional[float] = None,
+                           return_exceptions: bool = True) -> List[Union['Cursor', Exception]]:
+        """Execute independent operations at the same time, each on a new cursor like this one.
+
+        Operations are SQL strings or ``(operation, parameters)`` pairs. Returns the executed
+        cursors in input order, ready to be fetched from. With ``return_exceptions`` a failed
+        operation is returned as the exception it raised, otherwise the first error is raised.
+
+        ``timeout`` applies to the whole batch, see :meth:`connection.Connection.select_many`.
+        """
+        def run(operation):
+            parameters = None
+            if not isinstance(operation, str):
+                operation, parameters = operation
+            cursor = Cursor(self._db, model_class=self._model_class, columnar=self.columnar)
+            cursor.arraysize = self._arraysize
+            cursor.cache_ttl = self.cache_ttl
+            cursor.settings = self.settings
+            cursor.read_budget = self.read_budget
+            cursor.execute(operation, parameters)
+            return cursor
+
+        return self._db._run_concurrent(run, operations, max_concurrency, timeout, return_exceptions,
+                                        close=Cursor.close)
+
+    def _insert(self, match, seq_of_parameters):
+        """ Sends the rows of an ``INSERT ... VALUES`` statement through the Events API and waits
+        until they are acknowledged.
+        """
+        self._close_result()
+        self._reset_state()
+
+        datasource = match.group('table').split('.')[-1].strip('`"')
+        columns = [c.strip().strip('`"') for c in (match.group('columns') or '').split(',') if c.strip()]
+        placeholders = RE_PLACEHOLDER.findall(match.group('values'))
+        if len(columns) != len(placeholders):
+            raise NotSupportedError("INSERT statements need a column list for each value")
+        if all(placeholders):
+            rows = ({c: parameters[p] for c, p in zip(columns, placeholders)} for parameters in seq_of_parameters)
+        elif not any(placeholders):
+            rows = (dict(zip(columns, parameters)) for parameters in seq_of_parameters)
+        else:
+            raise NotSupportedError("INSERT statements can't mix named and positional parameters")
 
-            for parameters in seq_of_parameters[:-1]:
-                values_list.append(q_values % _escaper.escape_args(parameters))
-            query = '{} {};'.format(q_prefix, ','.join(values_list))
-            return self._db.raw(query)
-        for parameters in seq_of_parameters[:-1]:
-            self.execute(operation, parameters, is_response=False)
+        ingestor = self._db.ingestor(datasource)
+        n = ingestor.extend(rows)
+        ingestor.flush()
+        self.report = QueryReport()
+        self.report.rows = n
+        self._state = self._STATE_FINISHED
 
     def fetchone(self):
         """Fetch the next row of a query result set, returning a single sequence, or ``None`` when
         no more data is available. """
         if self._state == self._STATE_NONE:
             raise Exception("No query yet")
-        if not self._data:
+        if self._buffer is None:
             return None
-        else:
+        row = self._buffer.fetchone()
+        if row is not None:
             self._rownumber += 1
-            return self._data.pop(0)
+        return row
 
     def fetchmany(self, size=None):
         """Fetch the next set of rows of a query result, returning a sequence of sequences (e.g. a
@@ -158,17 +347,13 @@ class Cursor(object):
             raise Exception("No query yet")
 
         if size is None:
-            size = 1
+            size = self._arraysize
 
-        if not self._data:
+        if self._buffer is None:
             return []
-        else:
-            if len(self._data) > size:
-                result, self._data = self._data[:size], self._data[size:]
-            else:
-                result, self._data = self._data, []
-            self._rownumber += len(result)
-            return result
+        result = self._buffer.fetchmany(size)
+        self._rownumber += len(result)
+        return result
 
     def fetchall(self):
         """Fetch all (remaining) rows of a query result, returning them as a sequence of sequences
@@ -177,17 +362,51 @@ class Cursor(object):
         if self._state == self._STATE_NONE:
             raise Exception("No query yet")
 
-        if not self._data:
+        if self._buffer is None:
             return []
-        else:
-            result, self._data = self._data, []
-            self._rownumber += len(result)
-            return result
+        result = self._buffer.fetchall()
+        self._rownumber += len(result)
+        return result
+
+    def fetch_arrow_table(self):
+        """Fetch all (remaining) rows of a columnar query result as a ``pyarrow.Table``."""
+        return self._columnar_result().read_all()
+
+    def fetch_record_batches(self):
+        """Return an iterator of ``pyarrow.RecordBatch`` objects over the (remaining) rows of a
+        columnar query result. Batches are read from the response as they arrive.
+        """
+        return self._columnar_result().record_batches()
+
+    def fetch_numpy(self):
+        """Fetch all (remaining) rows of a columnar query result as a dict of NumPy arrays keyed
+        by column name.
+        """
+        return self._columnar_result().to_numpy()
+
+    def _columnar_result(self) -> ColumnarResult:
+        if self._state == self._STATE_NONE:
+            raise Exception("No query yet")
+        if not self.columnar:
+            raise NotSupportedError("Columnar fetches need a cursor created with columnar=True")
+        if self._result is None:
+            raise NotSupportedError("The last statement wasn't read in a columnar format")
+        return self._result
+
+    @property
+    def columnar_result(self) -> Optional[ColumnarResult]:
+        """The columnar result being read, or ``None`` when the last statement wasn't read in a
+        columnar format, e.g. the endpoint of a Pipe.
+        """
+        return self._result
 
     @property
     def arraysize(self):
         """This read/write attribute specifies the number of rows to fetch at a time with
         :py:meth:`fetchmany`. It defaults to 1 meaning to fetch a single row at a time.
+
+        Through SQLAlchemy it can be set with ``execution_options(tinybird_arraysize=...)``, which
+        also makes streamed results pull rows in batches of that size.
         """
         return self._arraysize
 
@@ -221,23 +440,74 @@ class Cursor(object):
         return self
 
     def cancel(self):
+        """Cancel the current query.
+
+        The response still being read, if any, is closed, also while :py:meth:`execute` waits
+        for it in another thread, which then returns with no rows. Queries are sent with
+        ``cancel_http_readonly_queries_on_client_close``, so closing their connection stops them
+        on the server. Rows not fetched yet are discarded.
+        """
         if self._state == self._STATE_NONE:
             raise ProgrammingError("No query yet")
         if self._uuid is None:
-            assert self._state == self._STATE_FINISHED, "Query should be finished"
             return
-        # Replace current running query to cancel it
-        self._db.select("SELECT 1", settings={"query_id":self._uuid})
+        inflight = self._inflight
         self._state = self._STATE_FINISHED
         self._uuid = None
-        self._data = None
+        if inflight is not None:
+            inflight.cancel()
+        self._close_result()
 
     def poll(self):
         pass
 
+    def _process_rows(self, columns, rows: ResultBuffer):
+        """ Update the internal state with the plain tuples of a result """
+        if self._state != self._STATE_RUNNING:
+            # Cancelled while the result was read
+            rows.close()
+            return
+        self._columns = columns
+        self._buffer = rows
+        self._state = self._STATE_FINISHED
+
+    def _process_stream(self, response):
+        """ Update the internal state to read rows from a streamed response as they are fetched """
+        if self._state != self._STATE_RUNNING:
+            response.close()
+            return
+
+        # Peek the first row so the description is available right after execute
+        first = next(response, None)
+        if first is None:
+            self._buffer = RowBuffer(())
+        else:
+            self._columns = [(f, first._fields[f].db_type) for f in first._fields]
+            self._buffer = StreamBuffer(self._iter_models(first, response), response.close)
+        self._state = self._STATE_FINISHED
+
+    @staticmethod
+    def _iter_models(first, response):
+        try:
+            for r in itertools.chain((first,), response):
+                yield tuple(getattr(r, f) for f in r._fields)
+        finally:
+            response.close()
+
+    def _process_columnar(self, result: ColumnarResult):
+        """ Update the internal state to read from a columnar result """
+        if self._state != self._STATE_RUNNING:
+            result.close()
+            return
+        self._result = result
+        self._columns = result.columns
+        self._buffer = StreamBuffer(result.rows())
+        self._state = self._STATE_FINISHED
+
     def _process_response(self, response):
         """ Update the internal state with the data from the response """
-        assert self._state == self._STATE_RUNNING, "Should be running if processing response"
+        if self._state != self._STATE_RUNNING:
+            return
         cols = None
         data = []
 
@@ -245,6 +515,6 @@ class Cursor(object):
             if not cols:
                 cols = [(f, r._fields[f].db_type) for f in r._fields]
             data.append([getattr(r, f) for f in r._fields])
-        self._data = data
+        self._buffer = RowBuffer(data)
         self._columns = cols
         self._state = self._STATE_FINISHED
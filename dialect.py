@@ -19,18 +19,54 @@
 import re
 
 import sqlalchemy.types as sqltypes
+from sqlalchemy import pool, util
 from sqlalchemy.engine import default, reflection
 
+from cache import cache_key, get_cache
 from common import ischema_names, colspecs
-from compiler import TinybirdCompiler
+from compiler import DEFAULT_IN_LIST_THRESHOLD, TinybirdCompiler
 from execution_context import TinybirdExecutionContext
 
 from identifier_preparer import TinybirdIdentifierPreparer
+from param_escaper import ParamEscaper
 from type_compiler import TinybirdTypeCompiler
 
 
+_escaper = ParamEscaper()
+
+
+# Converters for the connection arguments accepted as URL query arguments
+_connect_args = {
+    'timeout': float,
+    'pool_connections': int,
+    'pool_maxsize': int,
+    'pool_block': util.asbool,
+    'keep_alive': util.asbool,
+    'idle_timeout': float,
+    'compress_threshold': int,
+    'cache_ttl': float,
+    'cache_max_bytes': int,
+    'ingest_max_rows': int,
+    'ingest_max_bytes': int,
+    'ingest_flush_interval': float,
+    'max_retries': int,
+    'rate_limit': float,
+    'max_rows_read': int,
+    'max_bytes_read': int,
+    'max_execution_time': float,
+    'budget_preflight': util.asbool,
+}
+
+# Converters for the dialect options accepted as URL query arguments
+_dialect_args = {
+    'in_list_threshold': int,
+    'server_params': util.asbool,
+}
+
+
 class TinybirdDialect(default.DefaultDialect):
     name = 'tinybird'
+    driver = 'rest'
     supports_cast = True
     supports_unicode_statements = True
     supports_unicode_binds = True
@@ -41,6 +77,8 @@ class TinybirdDialect(default.DefaultDialect):
     supports_alter = False
     supports_sequences = False
     supports_native_enum = True
+    supports_server_side_cursors = True
+    supports_statement_cache = True
 
     max_identifier_length = 127
     default_paramstyle = 'pyformat'
@@ -67,13 +105,40 @@ class TinybirdDialect(default.DefaultDialect):
             import connection
         return connection
 
+    # IN lists this long or longer are sent as one array; None expands them value by value
+    in_list_threshold = DEFAULT_IN_LIST_THRESHOLD
+    # Send bound values as typed query parameters ({name:Type} and param_<name>) instead of in the SQL
+    server_params = False
+
+    # Persistent cache of reflected schemas, set up from the URL by create_connect_args
+    schema_cache = None
+    schema_cache_ttl = 24 * 3600
+    schema_version = None
+    _schema_cache_key = ()
+
     def create_connect_args(self, url):
-        kwargs = {
-            'db_url': 'https://%s:%d/v0/sql' % (url.host, url.port or 443),
+        kwargs = dict(url.query)
+        schema_cache = kwargs.pop('schema_cache', None)
+        schema_cache_dir = kwargs.pop('schema_cache_dir', None)
+        if schema_cache or schema_cache_dir:
+            self.schema_cache = get_cache(schema_cache or 'disk', directory=schema_cache_dir)
+            self.schema_cache_ttl = float(kwargs.pop('schema_cache_ttl', self.schema_cache_ttl))
+            self.schema_version = kwargs.pop('schema_version', None)
+            self._schema_cache_key = (url.host, url.username)
+        for name, convert in _dialect_args.items():
+            if name in kwargs:
+                value = kwargs.pop(name)
+                setattr(self, name, None if value.lower() == 'none' else convert(value))
+        for name, convert in _connect_args.items():
+            if name in kwargs:
+                kwargs[name] = convert(kwargs[name])
+        protocol = kwargs.pop('protocol', 'https')
+        port = url.port or (443 if protocol == 'https' else 80)
+        kwargs.update({
+            'db_url': '%s://%s:%d' % (protocol, url.host, port),
             'token': url.username
-        }
-        kwargs.update(url.query)
-        return ([url.database or 'default'], kwargs)
+        })
+        return ([], kwargs)
 
     def _get_default_schema_name(self, connection):
         return connection.scalar("select currentDatabase()")
@@ -91,7 +156,9 @@ class TinybirdDialect(default.DefaultDialect):
         # This needs the table name to be unescaped (no backticks).
         return connection.execute('DESCRIBE TABLE {}'.format(full_table)).fetchall()
 
-    def has_table(self, connection, table_name, schema=None):
+    def has_table(self, connection, table_name, schema=None, **kw):
+        if self.schema_cache is not None:
+            return table_name in self._get_schema_tables(connection, schema, **kw)
         full_table = table_name
         if schema:
             full_table = schema + '.' + table_name
@@ -100,38 +167,91 @@ class TinybirdDialect(default.DefaultDialect):
                 return True
         return False
 
+    def _load_schema_tables(self, connection, schema):
+        """ Returns ``{table: [(name, type, is_in_sorting_key, is_in_partition_key), ...]}`` for every
+        table of ``schema``, read from the persistent schema cache or with a single query.
+        """
+        key = None
+        if self.schema_cache is not None:
+            key = cache_key('system.columns', *self._schema_cache_key, schema, self.schema_version)
+            tables = self.schema_cache.get(key)
+            if tables is not None:
+                return tables
+
+        database = _escaper.escape_string(schema) if schema else 'currentDatabase()'
+        rows = connection.execute(
+            'SELECT table, name, type, is_in_sorting_key, is_in_partition_key FROM system.columns '
+            'WHERE database = {} ORDER BY table, position'.format(database))
+        tables = {}
+        for r in rows:
+            tables.setdefault(r.table, []).append(
+                (r.name, r.type, bool(int(r.is_in_sorting_key)), bool(int(r.is_in_partition_key))))
+
+        if key is not None:
+            self.schema_cache.set(key, tables, self.schema_cache_ttl)
+        return tables
+
+    @reflection.cache
+    def _get_schema_tables(self, connection, schema=None, **kw):
+        return self._load_schema_tables(connection, schema)
+
+    def _column_info(self, name, type_):
+        if type_.startswith("AggregateFunction"):
+            # Extract type information from a column
+            # using AggregateFunction
+            # the type from clickhouse will be 
+            # AggregateFunction(sum, Int64) for an Int64 type
+            # remove first 24 chars and remove the last one to get Int64
+            col_type = type_[23:-1]
+        elif type_.startswith("Nullable"):
+            col_type = re.search(r'^\w+', type_[9:-1]).group(0)
+        else:    
+            # Take out the more detailed type information
+            # e.g. 'map<int,int>' -> 'map'
+            #      'decimal(10,1)' -> decimal                
+            col_type = re.search(r'^\w+', type_).group(0)
+        try:
+            coltype = ischema_names[col_type]
+        except KeyError:
+            coltype = sqltypes.NullType
+        return {
+            'name': name,
+            'type': coltype,
+            'nullable': True,
+            'default': None,
+        }
+
+    def _index_info(self, columns):
+        indexes = []
+        partition = [c[0] for c in columns if c[3]]
+        if partition:
+            indexes.append({'name': 'partition', 'column_names': partition, 'unique': False})
+        sorting = [c[0] for c in columns if c[2]]
+        if sorting:
+            indexes.append({'name': 'sorting_key', 'column_names': sorting, 'unique': False})
+        return indexes
+
     @reflection.cache
     def get_columns(self, connection, table_name, schema=None, **kw):
+        tables = self._get_schema_tables(connection, schema, **kw)
+        if table_name in tables:
+            return [self._column_info(c[0], c[1]) for c in tables[table_name]]
         rows = self._get_table_columns(connection, table_name, schema)
-        result = []
-        for r in rows:
-            col_name = r.name
-            col_type = ""
-            if r.type.startswith("AggregateFunction"):
-                # Extract type information from a column
-                # using AggregateFunction
-                # the type from clickhouse will be 
-                # AggregateFunction(sum, Int64) for an Int64 type
-                # remove first 24 chars and remove the last one to get Int64
-                col_type = r.type[23:-1]
-            elif r.type.startswith("Nullable"):
-                col_type = re.search(r'^\w+', r.type[9:-1]).group(0)
-            else:    
-                # Take out the more detailed type information
-                # e.g. 'map<int,int>' -> 'map'
-                #      'decimal(10,1)' -> decimal                
-                col_type = re.search(r'^\w+', r.type).group(0)
-            try:
-                coltype = ischema_names[col_type]
-            except KeyError:
-                coltype = sqltypes.NullType
-            result.append({
-                'name': col_name,
-                'type': coltype,
-                'nullable': True,
-                'default': None,
-            })
-        return result
+        return [self._column_info(r.name, r.type) for r in rows]
+
+    def get_multi_columns(self, connection, schema=None, filter_names=None, scope=None, kind=None, **kw):
+        # SQLAlchemy 2.0 bulk reflection hook
+        tables = self._get_schema_tables(connection, schema, **kw)
+        for table_name, columns in tables.items():
+            if filter_names is None or table_name in filter_names:
+                yield (schema, table_name), [self._column_info(c[0], c[1]) for c in columns]
+
+    def get_multi_indexes(self, connection, schema=None, filter_names=None, scope=None, kind=None, **kw):
+        # SQLAlchemy 2.0 bulk reflection hook
+        tables = self._get_schema_tables(connection, schema, **kw)
+        for table_name, columns in tables.items():
+            if filter_names is None or table_name in filter_names:
+                yield (schema, table_name), self._index_info(columns)
 
     @reflection.cache
     def get_foreign_keys(self, connection, table_name, schema=None, **kw):
@@ -145,6 +265,9 @@ class TinybirdDialect(default.DefaultDialect):
 
     @reflection.cache
     def get_indexes(self, connection, table_name, schema=None, **kw):
+        tables = self._get_schema_tables(connection, schema, **kw)
+        if table_name in tables:
+            return self._index_info(tables[table_name])
         full_table = table_name
         if schema:
             full_table = schema + '.' + table_name
@@ -167,10 +290,7 @@ class TinybirdDialect(default.DefaultDialect):
 
     @reflection.cache
     def get_table_names(self, connection, schema=None, **kw):
-        query = 'SHOW TABLES'
-        if schema:
-            query += ' FROM ' + schema
-        return [row.name for row in connection.execute(query)]
+        return list(self._get_schema_tables(connection, schema, **kw))
 
     def do_rollback(self, dbapi_connection):
         # No transactions
@@ -184,4 +304,29 @@ class TinybirdDialect(default.DefaultDialect):
         # We decode everything as UTF-8
         return True
 
+
+class TinybirdAsyncDialect(TinybirdDialect):
+    """ asyncio variant, used through ``create_async_engine('tinybird+async://...')`` """
+    driver = 'async'
+    is_async = True
+    supports_statement_cache = True
+
+    @classmethod
+    def dbapi(cls):
+        try:
+            import sqlalchemy_tinybird.aio as aio
+        except:
+            import aio
+        return aio.AsyncAdapt_tinybird_dbapi()
+
+    @classmethod
+    def get_pool_class(cls, url):
+        if util.asbool(url.query.get('async_fallback', False)):
+            return pool.FallbackAsyncAdaptedQueuePool
+        return pool.AsyncAdaptedQueuePool
+
+    def get_driver_connection(self, connection):
+        return connection._connection
+
+
 dialect = TinybirdDialect
@@ -16,6 +16,9 @@
 #   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
 #             https://github.com/cloudflare/sqlalchemy-clickhouse
 
+from typing import Optional
+
+
 class Error(Exception):
     """Exception that is the base class of all other error exceptions.
     You can use this to catch all errors with one single except statement.
@@ -24,4 +27,58 @@ class Error(Exception):
 
 
 class NotSupportedError(Error):
-    pass
\ No newline at end of file
+    pass
+
+
+class DatabaseError(Error):
+    """Exception raised for errors that are related to the database.
+
+    ``status`` is the HTTP status of the response that failed, if any.
+    """
+    def __init__(self, message: str = '', status: Optional[int] = None):
+        super(DatabaseError, self).__init__(message)
+        self.status = status
+
+
+class OperationalError(DatabaseError):
+    """Exception raised for errors that are related to the database's operation and not
+    necessarily under the control of the programmer, e.g. a timeout.
+    """
+    pass
+
+
+class ReadBudgetExceeded(OperationalError):
+    """Exception raised for queries reading more than their read budget allows: ``limit`` is the
+    budget limit exceeded (``max_rows_read``, ``max_bytes_read`` or ``max_execution_time``),
+    ``value`` what the query read or would read, when known, and ``budget`` the limit set.
+    """
+    def __init__(self, message: str = '', status: Optional[int] = None, limit: Optional[str] = None,
+                 value: Optional[float] = None, budget: Optional[float] = None):
+        super(ReadBudgetExceeded, self).__init__(message, status)
+        self.limit = limit
+        self.value = value
+        self.budget = budget
+
+
+class ProgrammingError(DatabaseError):
+    """Exception raised for programming errors, e.g. a wrong query or a missing table."""
+    pass
+
+
+class RetryableError(OperationalError):
+    """Exception raised for responses that may succeed if sent again after ``retry_after``
+    seconds (``None`` when the server did not say).
+    """
+    def __init__(self, message: str = '', status: Optional[int] = None, retry_after: Optional[float] = None):
+        super(RetryableError, self).__init__(message, status)
+        self.retry_after = retry_after
+
+
+class RateLimitError(RetryableError):
+    """Exception raised when the workspace's rate limit is exceeded (HTTP 429)."""
+    pass
+
+
+class ServerError(RetryableError):
+    """Exception raised for server errors (HTTP 5xx)."""
+    pass
@@ -16,11 +16,75 @@
 #   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
 #             https://github.com/cloudflare/sqlalchemy-clickhouse
 
+from typing import Dict, Optional
+
 from sqlalchemy import util
+from sqlalchemy import types as sqltypes
+from sqlalchemy.engine import cursor as _cursor
 from sqlalchemy.engine import default
 
+from budget import ReadBudget
+from param_escaper import format_server_param, server_param_type
+
+
+def declared_types(compiled) -> Optional[Dict[str, str]]:
+    """ Returns the ClickHouse types of the ``Date``, ``DateTime`` and integer result columns of
+    a compiled statement, which tell them apart in ArrowStream responses.
+    """
+    types = {}
+    for entry in getattr(compiled, '_result_columns', None) or ():
+        type_ = entry[3]
+        if isinstance(type_, sqltypes.DateTime):
+            types[entry[1]] = 'DateTime'
+        elif isinstance(type_, sqltypes.Date):
+            types[entry[1]] = 'Date'
+        elif isinstance(type_, sqltypes.Integer):
+            types[entry[1]] = 'Int64'
+    return types or None
+
 
 class TinybirdExecutionContext(default.DefaultExecutionContext):
     @util.memoized_property
     def should_autocommit(self) -> bool:
         return False # No DML supported, never autocommit
+
+    def create_server_side_cursor(self):
+        # Streamed cursors read rows from the response as they are fetched
+        return self._dbapi_connection.cursor(stream=True)
+
+    def pre_exec(self):
+        arraysize = self.execution_options.get('tinybird_arraysize')
+        if arraysize:
+            self.cursor.arraysize = arraysize
+        self.cursor.cache_ttl = self.execution_options.get('tinybird_cache_ttl')
+        if self.execution_options.get('tinybird_columnar'):
+            self.cursor.columnar = True
+        self.cursor.column_types = declared_types(self.compiled) if getattr(self.cursor, 'columnar', False) else None
+        self.cursor.read_budget = ReadBudget.of(self.execution_options.get('tinybird_read_budget'))
+        settings = self.execution_options.get('tinybird_settings')
+        # Pipe parameters are URL parameters too
+        pipe_params = getattr(self.compiled, 'tinybird_pipe_params', None)
+        if pipe_params:
+            settings = dict(pipe_params, **(settings or {}))
+        # Values of {name:Type} placeholders are URL parameters, not part of the SQL
+        server_params = getattr(self.compiled, 'tinybird_server_params', None)
+        if server_params and not self.executemany:
+            parameters = self.parameters[0]
+            values = {name: parameters.pop(name) for name in server_params}
+            for name, type_ in server_params.items():
+                # NULLs need Nullable placeholders, and big integers wider ones than compiled
+                value_type = server_param_type(values[name], type_)
+                if value_type != type_:
+                    self.statement = self.statement.replace('{%s:%s}' % (name, type_), '{%s:%s}' % (name, value_type))
+            settings = dict(settings or (), **{
+                'param_' + name: format_server_param(value) for name, value in values.items()})
+        self.cursor.settings = settings
+        self.cursor.pipe = getattr(self.compiled, 'tinybird_pipe', None)
+
+    def post_exec(self):
+        # Pull streamed rows in batches of arraysize instead of SQLAlchemy's growing buffer
+        if self._is_server_side and 'tinybird_arraysize' in self.execution_options:
+            options = dict(self.execution_options)
+            options.setdefault('max_row_buffer', self.cursor.arraysize)
+            self.cursor_fetch_strategy = _cursor.BufferedRowCursorFetchStrategy(
+                self.cursor, options, growth_factor=0)
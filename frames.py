@@ -0,0 +1,176 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import sqlalchemy as sa
+
+from columnar import ArrowResult, import_pyarrow
+from connection import Connection
+from cursor import Cursor
+from error import NotSupportedError
+
+
+# Builds DataFrames from the column buffers of a columnar result, without a Python object per row.
+
+BACKENDS = ('pandas', 'polars')
+
+def import_pandas():
+    try:
+        import pandas
+    except ImportError:
+        raise NotSupportedError("pandas is required for pandas DataFrames")
+    return pandas
+
+
+def import_polars():
+    try:
+        import polars
+    except ImportError:
+        raise NotSupportedError("polars is required for Polars DataFrames")
+    return polars
+
+
+def read_frame(bind: Union[sa.engine.Engine, sa.engine.Connection, Connection], sql: Union[str, Any],
+               params: Optional[Union[Dict[str, Any], Tuple[Any, ...]]] = None, backend: str = 'pandas',
+               chunksize: Optional[int] = None, settings: Optional[Dict[str, Any]] = None) -> Any:
+    """ Runs ``sql`` and returns its result as a pandas or Polars DataFrame.
+
+    ``bind`` is an engine or connection of the tinybird dialect, or a DB-API connection. ``sql``
+    is a SQL string with ``%(name)s`` placeholders, or a SQLAlchemy statement. The result is
+    fetched in ``ArrowStream`` format and frames are built from its column buffers, with ``Date``
+    and ``DateTime`` columns typed as :meth:`connection.Connection.select_columnar` tells them
+    apart; without pyarrow it is decoded from
+    ``JSONColumnsWithMetadata`` into NumPy arrays.
+
+    With ``chunksize``, returns an iterator of frames of up to ``chunksize`` rows, read as the
+    response arrives.
+    """
+    if backend not in BACKENDS:
+        raise NotSupportedError("Unknown DataFrame backend {}, use one of {}".format(backend, ', '.join(BACKENDS)))
+    if chunksize is not None and chunksize < 1:
+        raise ValueError("chunksize must be positive")
+    # Fail before running the query
+    import_pandas() if backend == 'pandas' else import_polars()
+
+    if isinstance(bind, sa.engine.Engine):
+        if chunksize is not None:
+            return _iter_engine_frames(bind, sql, params, backend, chunksize, settings)
+        with bind.connect() as conn:
+            return _frame(_execute(conn, sql, params, settings), backend)
+    if isinstance(bind, sa.engine.Connection):
+        cursor = _execute(bind, sql, params, settings)
+    elif isinstance(bind, Connection) or hasattr(bind, 'cursor'):
+        # DB-API connections, also as proxied by the pool (engine.raw_connection())
+        if not isinstance(sql, str):
+            raise NotSupportedError("DB-API connections only run SQL strings")
+        cursor = bind.cursor(columnar=True)
+        cursor.settings = settings
+        cursor.execute(sql, params)
+    else:
+        raise NotSupportedError("Can't read DataFrames from {}".format(type(bind).__name__))
+    if chunksize is not None:
+        return _iter_frames(cursor, backend, chunksize)
+    return _frame(cursor, backend)
+
+
+def _execute(conn: sa.engine.Connection, sql: Union[str, Any], params: Any,
+             settings: Optional[Dict[str, Any]]) -> Cursor:
+    """ Executes ``sql`` for a columnar result and returns the DB-API cursor reading it """
+    current = conn.get_execution_options().get('tinybird_settings')
+    conn = conn.execution_options(
+        tinybird_columnar=True,
+        tinybird_settings=dict(current or (), **(settings or {})))
+    if isinstance(sql, str):
+        if params is None:
+            # Without parameters the SQL is sent as is, without % formatting
+            result = conn.execution_options(no_parameters=True).exec_driver_sql(sql)
+        else:
+            result = conn.exec_driver_sql(sql, params)
+    else:
+        result = conn.execute(sql, params or {})
+    return result.cursor
+
+
+def _iter_engine_frames(engine: sa.engine.Engine, sql: Union[str, Any], params: Any, backend: str,
+                        chunksize: int, settings: Optional[Dict[str, Any]]) -> Iterator[Any]:
+    # The connection is kept until the last chunk is read
+    with engine.connect() as conn:
+        yield from _iter_frames(_execute(conn, sql, params, settings), backend, chunksize)
+
+
+def _frame(cursor: Cursor, backend: str) -> Any:
+    result = cursor.columnar_result
+    if result is None:
+        return _rows_frame(cursor, cursor.fetchall(), backend)
+    if isinstance(result, ArrowResult):
+        return _arrow_frame(result.read_all(), backend)
+    return _numpy_frame(result.to_numpy(), backend)
+
+
+def _iter_frames(cursor: Cursor, backend: str, chunksize: int) -> Iterator[Any]:
+    result = cursor.columnar_result
+    if result is None:
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                return
+            yield _rows_frame(cursor, rows, backend)
+    elif isinstance(result, ArrowResult):
+        for table in _arrow_chunks(result.record_batches(), chunksize):
+            yield _arrow_frame(table, backend)
+    else:
+        arrays = result.to_numpy()
+        rows = len(next(iter(arrays.values()))) if arrays else 0
+        for start in range(0, rows, chunksize):
+            yield _numpy_frame({name: a[start:start + chunksize] for name, a in arrays.items()}, backend)
+
+
+def _arrow_chunks(batches: Iterator[Any], chunksize: int) -> Iterator[Any]:
+    """ Regroups record batches into tables of ``chunksize`` rows; the last one may be shorter """
+    pa = import_pyarrow()
+    pending: List[Any] = []
+    rows = 0
+    for batch in batches:
+        pending.append(batch)
+        rows += batch.num_rows
+        while rows >= chunksize:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, chunksize)
+            rest = table.slice(chunksize)
+            pending, rows = rest.to_batches(), rest.num_rows
+    if rows:
+        yield pa.Table.from_batches(pending)
+
+
+def _arrow_frame(table: Any, backend: str) -> Any:
+    if backend == 'polars':
+        return import_polars().from_arrow(table)
+    # One block per column, freeing Arrow buffers as they are converted
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def _numpy_frame(arrays: Dict[str, Any], backend: str) -> Any:
+    if backend == 'polars':
+        # Polars has no second resolution
+        arrays = {name: a.astype('datetime64[ms]') if a.dtype.str == '<M8[s]' else a for name, a in arrays.items()}
+        return import_polars().DataFrame(arrays)
+    return import_pandas().DataFrame(arrays, copy=False)
+
+
+def _rows_frame(cursor: Cursor, rows: List[Tuple[Any, ...]], backend: str) -> Any:
+    columns = [d[0] for d in cursor.description]
+    if backend == 'polars':
+        return import_polars().DataFrame(rows, schema=columns, orient='row')
+    return import_pandas().DataFrame.from_records(rows, columns=columns)
@@ -0,0 +1,240 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
+#             https://github.com/cloudflare/sqlalchemy-clickhouse
+
+from collections import deque
+import datetime
+import decimal
+import json
+import threading
+import time
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+import uuid
+
+from requests import Session
+
+from error import Error
+import transport
+
+
+# Defaults for the Events API batches
+DEFAULT_MAX_ROWS = 10000
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_MAX_PENDING_BYTES = 64 * 1024 * 1024
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f' if value.microsecond else '%Y-%m-%d %H:%M:%S')
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError("Object of type {} can't be sent to the Events API".format(type(value).__name__))
+
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+
+def encode_row(row: Dict[str, Any]) -> bytes:
+    """ Returns the NDJSON line of an event, without its trailing newline """
+    return _encoder.encode(row).encode('utf-8')
+
+
+class IngestStats(object):
+    """ Counters of the events sent by an :class:`EventsIngestor` """
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.batches = 0
+        self.errors = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {'rows': self.rows, 'bytes': self.bytes, 'batches': self.batches, 'errors': self.errors}
+
+
+class EventsIngestor(object):
+    """ Buffers events of a data source and posts them to the Events API in NDJSON batches.
+
+    A batch is sealed when it holds ``max_rows`` events or ``max_bytes`` bytes, or
+    ``flush_interval`` seconds after its first event, and sent by a background thread. While
+    more than ``max_pending_bytes`` are waiting to be sent, adding events blocks.
+
+    Errors of the background thread are raised by the next call to :meth:`extend`,
+    :meth:`flush` or :meth:`close`; the events of a failed batch are not sent again.
+    """
+
+    def __init__(self, session: Session, api_url: str, token: str, datasource: str,
+                 max_rows: int = DEFAULT_MAX_ROWS, max_bytes: int = DEFAULT_MAX_BYTES,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, max_pending_bytes: int = DEFAULT_MAX_PENDING_BYTES,
+                 compression: Optional[str] = None, compress_threshold: int = transport.DEFAULT_COMPRESS_THRESHOLD,
+                 timeout: Optional[float] = None, wait: bool = False, rate_limiter: Optional[transport.TokenBucket] = None,
+                 max_retries: int = transport.DEFAULT_MAX_RETRIES):
+        """
+            - `api_url`: base URL of the API, e.g. ``https://api.tinybird.co``.
+            - `compression`: ``'gzip'`` or ``'zstd'`` to compress batches of ``compress_threshold`` bytes or more.
+            - `wait`: ask the Events API to answer once events are written instead of once they are accepted.
+            - `rate_limiter`, `max_retries`: see :func:`transport.send`. Batches are only retried
+              when they were rate limited, so events are never sent twice.
+        """
+        self.session = session
+        self.url = f"{api_url.rstrip('/')}/v0/events"
+        self.token = token
+        self.datasource = datasource
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_pending_bytes = max_pending_bytes
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.timeout = timeout
+        self.wait = wait
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.stats = IngestStats()
+
+        self._cond = threading.Condition()
+        # Batch being filled
+        self._lines: List[bytes] = []
+        self._size = 0
+        self._started: Optional[float] = None
+        # Sealed batches, and bytes sealed but not yet sent
+        self._queue: Deque[Tuple[List[bytes], int]] = deque()
+        self._pending = 0
+        self._sending = 0
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, row: Dict[str, Any]):
+        """ Buffers a single event """
+        self.extend((row,))
+
+    def extend(self, rows: Iterable[Dict[str, Any]]) -> int:
+        """ Buffers events, given as dicts keyed by column name. Returns how many were added. """
+        n = 0
+        cond = self._cond
+        for row in rows:
+            line = encode_row(row)
+            with cond:
+                self._check()
+                # Backpressure: wait for the background thread to catch up
+                while self._pending + self._size >= self.max_pending_bytes and self._error is None:
+                    cond.wait()
+                self._lines.append(line)
+                self._size += len(line) + 1
+                if self._started is None:
+                    self._started = time.monotonic()
+                    self._start()
+                if len(self._lines) >= self.max_rows or self._size >= self.max_bytes:
+                    self._seal()
+            n += 1
+        return n
+
+    def flush(self):
+        """ Sends every buffered event and waits until they are acknowledged """
+        with self._cond:
+            if self._lines:
+                self._seal()
+            while (self._queue or self._sending) and self._error is None:
+                self._cond.wait()
+            self._check()
+
+    def close(self):
+        """ Flushes the buffered events and stops the background thread """
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+
+    def _check(self):
+        if self._closed:
+            raise Error("The ingestor is closed")
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f'tinybird-ingest-{self.datasource}', daemon=True)
+            self._thread.start()
+
+    def _seal(self):
+        self._queue.append((self._lines, self._size))
+        self._pending += self._size
+        self._lines = []
+        self._size = 0
+        self._started = None
+        self._cond.notify_all()
+
+    def _run(self):
+        cond = self._cond
+        while True:
+            with cond:
+                while not self._queue:
+                    if self._closed:
+                        return
+                    timeout = None
+                    if self._started is not None:
+                        timeout = self._started + self.flush_interval - time.monotonic()
+                        if timeout <= 0:
+                            self._seal()
+                            break
+                    cond.wait(timeout)
+                lines, size = self._queue.popleft()
+                self._sending += 1
+            try:
+                self._post(lines, size)
+            except BaseException as e:
+                with cond:
+                    self.stats.errors += 1
+                    self._error = e
+            finally:
+                with cond:
+                    self._pending -= size
+                    self._sending -= 1
+                    cond.notify_all()
+
+    def _post(self, lines: List[bytes], size: int):
+        lines.append(b'')
+        body, encoding = transport.encode_body(b'\n'.join(lines), self.compression, self.compress_threshold)
+        req_headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/x-ndjson',
+        }
+        if encoding:
+            req_headers['Content-Encoding'] = encoding
+        req_params = {'name': self.datasource}
+        if self.wait:
+            req_params['wait'] = 'true'
+        transport.send(self.session, 'POST', self.url, self.rate_limiter, self.max_retries, idempotent=False,
+                       params=req_params, data=body, headers=req_headers, timeout=self.timeout)
+        self.stats.rows += len(lines) - 1
+        self.stats.bytes += size
+        self.stats.batches += 1
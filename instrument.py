@@ -0,0 +1,153 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from contextlib import contextmanager
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional
+
+
+# Client-side phases of a query, in the order they happen
+PHASES = ('connect', 'ttfb', 'download', 'decode', 'materialize')
+
+
+class QueryTimings(object):
+    """ Seconds spent by the client in each phase of a query:
+
+        - `connect`: opening the connection (TCP and TLS), 0 when a pooled one is reused.
+        - `ttfb`: from sending the request until the response headers arrive, including
+          retries and waits for the rate limiter.
+        - `download`: reading the body.
+        - `decode`: parsing the body.
+        - `materialize`: converting values and building the rows or objects returned.
+
+    Phases of streamed results are read along with their rows: their download time includes
+    decoding and converting, and is only known once the result is exhausted.
+    """
+    __slots__ = PHASES
+
+    def __init__(self):
+        for phase in PHASES:
+            setattr(self, phase, 0.0)
+
+    @property
+    def total(self) -> float:
+        return sum(getattr(self, phase) for phase in PHASES)
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        """ Adds the time spent in the ``with`` block to ``phase`` """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            setattr(self, phase, getattr(self, phase) + time.perf_counter() - start)
+
+    def as_dict(self) -> Dict[str, float]:
+        return dict({phase: getattr(self, phase) for phase in PHASES}, total=self.total)
+
+    def __repr__(self) -> str:
+        return 'QueryTimings(%s)' % ', '.join('%s=%.6f' % (phase, getattr(self, phase)) for phase in PHASES)
+
+
+class QueryReport(object):
+    """ What is known about a query once its response is read: the server's statistics of the
+    response (``elapsed``, ``rows_read``, ``bytes_read``), the number of rows returned, and the
+    client-side timings.
+    """
+
+    def __init__(self, query_id: Optional[str] = None, query: Optional[str] = None):
+        self.query_id = query_id
+        self.query = query
+        self.statistics: Dict[str, Any] = {}
+        # Rows of the result, None until known
+        self.rows: Optional[int] = None
+        # Whether the result came from the result cache, without a request
+        self.cached = False
+        self.timings = QueryTimings()
+
+    def update(self, result: Mapping[str, Any]):
+        """ Takes the ``statistics`` and ``rows`` of a decoded ``JSON*`` response """
+        statistics = result.get('statistics')
+        if statistics:
+            self.statistics = dict(statistics)
+        if 'rows' in result:
+            self.rows = result['rows']
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        """ Takes the statistics of the ``X-ClickHouse-Summary`` header, sent with every format """
+        summary = headers.get('X-ClickHouse-Summary')
+        if not summary or self.statistics:
+            return
+        try:
+            summary = json.loads(summary)
+        except ValueError:
+            return
+        if 'read_rows' in summary:
+            self.statistics['rows_read'] = int(summary['read_rows'])
+        if 'read_bytes' in summary:
+            self.statistics['bytes_read'] = int(summary['read_bytes'])
+        if 'elapsed_ns' in summary:
+            self.statistics['elapsed'] = int(summary['elapsed_ns']) / 1e9
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'query_id': self.query_id, 'query': self.query, 'statistics': self.statistics, 'rows': self.rows,
+                'cached': self.cached, 'timings': self.timings.as_dict()}
+
+    def __repr__(self) -> str:
+        return 'QueryReport(query_id=%r, rows=%r, statistics=%r, timings=%r)' % (
+            self.query_id, self.rows, self.statistics, self.timings)
+
+
+_listeners: List[Callable[[QueryReport], None]] = []
+_listeners_lock = threading.Lock()
+
+
+def add_listener(listener: Callable[[QueryReport], None]):
+    """ Calls ``listener`` with the :class:`QueryReport` of every query, once its response is read.
+
+    Listeners run in the thread that read the response. Streamed results are reported when
+    exhausted or closed.
+    """
+    global _listeners
+    with _listeners_lock:
+        _listeners = _listeners + [listener]
+
+
+def remove_listener(listener: Callable[[QueryReport], None]):
+    global _listeners
+    with _listeners_lock:
+        _listeners = [l for l in _listeners if l is not listener]
+
+
+def notify(report: Optional[QueryReport]):
+    if report is None:
+        return
+    for listener in _listeners:
+        listener(report)
+
+
+# Seconds spent opening connections in the current thread, see transport.TransportAdapter
+_connect = threading.local()
+
+
+def add_connect_time(seconds: float):
+    _connect.seconds = getattr(_connect, 'seconds', 0.0) + seconds
+
+
+def take_connect_time() -> float:
+    seconds = getattr(_connect, 'seconds', 0.0)
+    _connect.seconds = 0.0
+    return seconds
@@ -16,7 +16,26 @@
 #   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
 #             https://github.com/cloudflare/sqlalchemy-clickhouse
 
-from infi.clickhouse_orm.models import Model
+from functools import lru_cache
+from typing import Tuple, Type
+
+from infi.clickhouse_orm.models import Model, ModelBase
+
+
+# Number of ad-hoc model classes kept around, keyed by column signature
+AD_HOC_MODEL_CACHE_SIZE = 256
+
 
 class TinybirdModel(Model):
-    pass
\ No newline at end of file
+    pass
+
+
+@lru_cache(maxsize=AD_HOC_MODEL_CACHE_SIZE)
+def ad_hoc_model(fields: Tuple[Tuple[str, str], ...]) -> Type[Model]:
+    """ Returns a model class for a result with the given ``(name, type)`` columns.
+
+    Unlike ``ModelBase.create_ad_hoc_model``, whose cache grows with every distinct result
+    shape, classes are kept in a bounded LRU cache.
+    """
+    attrs = {name: ModelBase.create_ad_hoc_field(db_type) for name, db_type in fields}
+    return ModelBase.__new__(ModelBase, 'AdHocModel', (Model,), attrs)
@@ -17,7 +17,12 @@
 #             https://github.com/cloudflare/sqlalchemy-clickhouse
 
 import datetime
-from typing import Any, Dict, List, Optional, Tuple, Union
+import decimal
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import uuid
+
+from error import ProgrammingError
 
 
 # Python 2/3 compatibility
@@ -27,17 +32,171 @@ except NameError:
     basestring = str
 
 
+RE_FORMAT_PLACEHOLDER = re.compile(r"%\(([^)]*)\)s|%s|%%")
+
+# Types escaped once per distinct value, as equal values of them are escaped the same. Not so
+# for Decimal, whose scale isn't part of equality, nor for aware datetimes, equal in any time zone.
+_memoized_types = {str, datetime.date, uuid.UUID}
+
+
+class RowTemplate(object):
+    """ A statement with ``%(name)s`` or ``%s`` placeholders, parsed once and rendered with
+    many parameter sets.
+    """
+
+    def __init__(self, operation: str, escaper: 'ParamEscaper'):
+        self.operation = operation
+        self._escaper = escaper
+        # Parameter names (or positions) in order of appearance, and the statement as a str.format template
+        self.keys: List[Union[str, int]] = []
+        parts = []
+        stray = False
+        end = 0
+        for m in RE_FORMAT_PLACEHOLDER.finditer(operation):
+            text = operation[end:m.start()]
+            stray = stray or '%' in text
+            parts.append(text.replace('{', '{{').replace('}', '}}'))
+            end = m.end()
+            if m.group(0) == '%%':
+                parts.append('%')
+            else:
+                parts.append('{}')
+                self.keys.append(m.group(1) if m.group(1) is not None else len(self.keys))
+        text = operation[end:]
+        stray = stray or '%' in text
+        parts.append(text.replace('{', '{{').replace('}', '}}'))
+        # Other % conversions are left to the % operator
+        self._format: Optional[str] = None if stray else ''.join(parts)
+
+    def render(self, parameters: Union[Sequence[Any], Dict[str, Any]]) -> str:
+        if self._format is None:
+            return self.operation % self._escaper.escape_args(parameters)
+        escape = self._escaper.escape_item
+        return self._format.format(*[escape(parameters[k]) for k in self.keys])
+
+    def render_many(self, seq_of_parameters: Iterable[Union[Sequence[Any], Dict[str, Any]]]) -> List[str]:
+        """ Renders the statement for every parameter set, escaping each parameter as a column """
+        seq = list(seq_of_parameters)
+        if self._format is None:
+            return [self.render(parameters) for parameters in seq]
+        if not self.keys:
+            return [self._format.format() for _ in seq]
+        columns = {k: self._escaper.escape_column([parameters[k] for parameters in seq]) for k in set(self.keys)}
+        fmt = self._format.format
+        return [fmt(*row) for row in zip(*[columns[k] for k in self.keys])]
+
+
 class ParamEscaper(object):
+    """ Renders Python values as ClickHouse literals.
+
+    The escaper of a value is looked up by its exact type in a table, filled on first use
+    from the escapers of the type's bases.
+    """
+
+    def __init__(self):
+        self._base_escapers: Dict[type, Callable[[Any], str]] = {
+            type(None): self.escape_null,
+            bool: self.escape_bool,
+            int: self.escape_number,
+            float: self.escape_float,
+            decimal.Decimal: self.escape_decimal,
+            str: self.escape_string,
+            bytes: self.escape_bytes,
+            bytearray: self.escape_bytes,
+            memoryview: self.escape_bytes,
+            datetime.datetime: self.escape_datetime,
+            datetime.date: self.escape_date,
+            uuid.UUID: self.escape_uuid,
+            list: self.escape_array,
+            tuple: self.escape_array,
+            set: self.escape_array,
+            frozenset: self.escape_array,
+        }
+        self._escapers: Dict[type, Callable[[Any], str]] = dict(self._base_escapers)
+        # C implementations of escape_number and escape_float for whole columns, unless overridden
+        self._column_escapers: Dict[type, Callable[[Any], str]] = {}
+        if type(self).escape_number is ParamEscaper.escape_number:
+            self._column_escapers[int] = int.__repr__
+        if type(self).escape_float is ParamEscaper.escape_float:
+            self._column_escapers[float] = float.__repr__
+
+    def escaper_for(self, cls: type) -> Callable[[Any], str]:
+        escaper = self._escapers.get(cls)
+        if escaper is None:
+            for base in cls.__mro__:
+                escaper = self._base_escapers.get(base)
+                if escaper is not None:
+                    break
+            else:
+                raise ProgrammingError("Unsupported object type {}".format(cls.__name__))
+            self._escapers[cls] = escaper
+        return escaper
+
     def escape_args(self, parameters: Union[List[Any], Tuple[Any,...], Dict[Any, Any]]):
+        get = self._escapers.get
         if isinstance(parameters, dict):
-            return {k: self.escape_item(v) for k, v in parameters.items()}
+            return {k: (get(type(v)) or self.escaper_for(type(v)))(v) for k, v in parameters.items()}
         elif isinstance(parameters, (list, tuple)):
-            return tuple(self.escape_item(x) for x in parameters)
+            return tuple((get(type(v)) or self.escaper_for(type(v)))(v) for v in parameters)
         else:
-            raise Exception("Unsupported param format: {}".format(parameters))
+            raise ProgrammingError("Unsupported param format: {}".format(parameters))
+
+    def escape_column(self, values: Sequence[Any]) -> List[str]:
+        """ Escapes many values, looking up the escaper once per type. Strings, dates, datetimes
+        and UUIDs are escaped once per distinct value.
+        """
+        types = set(map(type, values))
+        if len(types) == 1:
+            cls = types.pop()
+            escaper = self.escaper_for(cls)
+            if cls in self._column_escapers:
+                return list(map(self._column_escapers[cls], values))
+            if cls in _memoized_types:
+                memo = {v: escaper(v) for v in set(values)}
+                return [memo[v] for v in values]
+            if cls is datetime.datetime:
+                # Equal datetimes of the same time zone have the same fields
+                keys = [(v, v.tzinfo) for v in values]
+                memo = {key: escaper(key[0]) for key in set(keys)}
+                return [memo[key] for key in keys]
+            return list(map(escaper, values))
+        escapers = {cls: self.escaper_for(cls) for cls in types}
+        return [escapers[type(v)](v) for v in values]
+
+    def escape_rows(self, seq_of_parameters: Iterable[Union[Sequence[Any], Dict[str, Any]]]) -> List[Any]:
+        """ Escapes parameter sets (all dicts or all sequences) column by column """
+        rows = list(seq_of_parameters)
+        if not rows:
+            return []
+        if isinstance(rows[0], dict):
+            columns = {k: self.escape_column([row[k] for row in rows]) for k in rows[0]}
+            return [{k: column[i] for k, column in columns.items()} for i in range(len(rows))]
+        columns = [self.escape_column(column) for column in zip(*rows)]
+        return list(zip(*columns)) if columns else [() for _ in rows]
+
+    def template(self, operation: str) -> RowTemplate:
+        return RowTemplate(operation, self)
+
+    def escape_null(self, item: None) -> str:
+        return 'NULL'
+
+    def escape_bool(self, item: bool) -> str:
+        return 'true' if item else 'false'
 
-    def escape_number(self, item: int) -> int:
-        return item
+    def escape_number(self, item: int) -> str:
+        return '%d' % item
+
+    def escape_float(self, item: float) -> str:
+        # nan, inf and -inf are ClickHouse literals too
+        return repr(float(item))
+
+    def escape_decimal(self, item: decimal.Decimal) -> str:
+        if not item.is_finite():
+            return self.escape_float(float(item))
+        _, digits, exponent = item.as_tuple()
+        scale = max(0, -exponent)
+        function = 'toDecimal128' if max(len(digits), scale) <= 38 else 'toDecimal256'
+        return "{}('{}', {})".format(function, format(item, 'f'), scale)
 
     def escape_string(self, item: str) -> str:
         # Need to decode UTF-8 because of old sqlalchemy.
@@ -46,16 +205,86 @@ class ParamEscaper(object):
         # string formatting here.
         if isinstance(item, bytes):
             item = item.decode('utf-8')
-        return "'{}'".format(item.replace("\\", "\\\\").replace("'", "\\'").replace("$", "$$"))
+        return "'" + item.replace("\\", "\\\\").replace("'", "\\'").replace("$", "$$") + "'"
+
+    def escape_bytes(self, item: Union[bytes, bytearray, memoryview]) -> str:
+        item = bytes(item)
+        try:
+            return self.escape_string(item.decode('utf-8'))
+        except UnicodeDecodeError:
+            return "unhex('{}')".format(item.hex())
+
+    def escape_datetime(self, item: datetime.datetime) -> str:
+        # Same as strftime('%Y-%m-%d %H:%M:%S'), several times faster
+        return "'" + item.isoformat(' ', 'seconds')[:19] + "'"
+
+    def escape_date(self, item: datetime.date) -> str:
+        return "'{}'".format(item.isoformat())
+
+    def escape_uuid(self, item: uuid.UUID) -> str:
+        return "'{}'".format(item)
+
+    def escape_array(self, item: Iterable[Any]) -> str:
+        return '[{}]'.format(','.join(self.escape_item(v) for v in item))
 
     def escape_item(self, item: Optional[Any]) -> str:
-        if item is None:
-            return 'NULL'
-        elif isinstance(item, (int, float)):
-            return self.escape_number(item)
-        elif isinstance(item, basestring):
-            return self.escape_string(item)
-        elif isinstance(item, datetime.datetime):
-            return self.escape_string(item.strftime("%Y-%m-%d %H:%M:%S"))
-        else:
-            raise Exception("Unsupported object {}".format(item))
+        cls = type(item)
+        return (self._escapers.get(cls) or self.escaper_for(cls))(item)
+
+
+# Ranges of the integer types of {name:Type} placeholders, the narrowest first
+_int_ranges = {
+    'Int8': (-2 ** 7, 2 ** 7 - 1), 'Int16': (-2 ** 15, 2 ** 15 - 1), 'Int32': (-2 ** 31, 2 ** 31 - 1),
+    'Int64': (-2 ** 63, 2 ** 63 - 1), 'UInt64': (0, 2 ** 64 - 1), 'Int128': (-2 ** 127, 2 ** 127 - 1),
+    'UInt128': (0, 2 ** 128 - 1), 'Int256': (-2 ** 255, 2 ** 255 - 1), 'UInt256': (0, 2 ** 256 - 1),
+}
+
+
+def server_param_type(value: Any, type_: str) -> str:
+    """ Returns the type of the ``{name:Type}`` placeholder of ``value``, given the type inferred
+    for it when compiling: ``Nullable`` for ``None``, and integer types widened to hold the value.
+    """
+    if value is None:
+        return type_ if type_.startswith(('Nullable(', 'Array(')) else 'Nullable(%s)' % type_
+    item_type = type_[6:-1] if type_.startswith('Array(') else type_
+    if item_type not in _int_ranges:
+        return type_
+    ints = [v for v in (value if isinstance(value, (list, tuple, set, frozenset)) else (value,))
+            if isinstance(v, int) and not isinstance(v, bool)]
+    if not ints:
+        return type_
+    low, high = min(ints), max(ints)
+    lowest, highest = _int_ranges[item_type]
+    if lowest <= low and high <= highest:
+        return type_
+    wide = next((name for name, (lowest, highest) in _int_ranges.items() if lowest <= low and high <= highest),
+                item_type)
+    return 'Array(%s)' % wide if type_.startswith('Array(') else wide
+
+
+_server_escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', "'": "\\'"})
+
+
+def format_server_param(value: Any, top_level: bool = True) -> str:
+    """ Returns a value as sent in the ``param_<name>`` URL parameter of a ``{name:Type}`` placeholder.
+
+    Top-level values are in ClickHouse's escaped text format, values inside arrays are literals.
+    """
+    if value is None:
+        return '\\N' if top_level else 'NULL'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return str(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return '[' + ','.join(format_server_param(v, False) for v in value) + ']'
+    if isinstance(value, datetime.datetime):
+        value = value.strftime("%Y-%m-%d %H:%M:%S")
+    elif isinstance(value, (datetime.date, uuid.UUID)):
+        value = str(value)
+    elif isinstance(value, bytes):
+        value = value.decode('utf-8')
+    elif not isinstance(value, basestring):
+        raise ProgrammingError("Unsupported object {}".format(value))
+    value = value.translate(_server_escapes)
+    return value if top_level else "'{}'".format(value)
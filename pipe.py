@@ -0,0 +1,84 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
+#             https://github.com/cloudflare/sqlalchemy-clickhouse
+
+import datetime
+import decimal
+from typing import Any, Dict
+import uuid
+
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.expression import ColumnClause, TableClause
+from sqlalchemy.sql.traversals import InternalTraversal
+
+from error import ProgrammingError
+
+
+def encode_param(value: Any) -> str:
+    """ Returns the value of a Pipe parameter as sent in the URL of a request.
+
+    Arrays are sent as comma-separated values.
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, (datetime.date, decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return ','.join(encode_param(v) for v in value)
+    return str(value)
+
+
+def encode_params(params: Dict[str, Any]) -> Dict[str, str]:
+    return {name: encode_param(value) for name, value in params.items() if value is not None}
+
+
+class tinybird_pipe(Executable, TableClause):
+    """ A published Pipe, usable as a table in a FROM clause.
+
+    Its parameters are sent with the query::
+
+        top = tinybird_pipe('top_browsers', sa.column('browser'), sa.column('hits'), date_from=date(2022, 1, 1))
+        conn.execute(sa.select(top.c.browser).where(top.c.hits > 10))
+
+    Executed on its own, ``conn.execute(top)`` reads the Pipe's endpoint, which serves its
+    precomputed result.
+    """
+    __visit_name__ = 'tinybird_pipe'
+
+    _traverse_internals = TableClause._traverse_internals + [
+        ('pipe_params', InternalTraversal.dp_plain_dict),
+    ]
+
+    def __init__(self, name: str, *columns: ColumnClause, **params: Any):
+        super(tinybird_pipe, self).__init__(name, *columns)
+        # Encoded once, so they can be part of the statement cache key
+        self.pipe_params = encode_params(params)
+
+    def with_params(self, **params: Any) -> 'tinybird_pipe':
+        """ Returns a copy of this Pipe with more (or different) parameters """
+        pipe = tinybird_pipe(self.name, *[ColumnClause(c.name, c.type) for c in self.columns])
+        pipe.pipe_params = dict(self.pipe_params, **encode_params(params))
+        return pipe
+
+
+def merge_params(into: Dict[str, str], pipe: tinybird_pipe):
+    """ Adds the parameters of ``pipe`` to those of a statement, which are shared by every Pipe in it """
+    for name, value in pipe.pipe_params.items():
+        if into.get(name, value) != value:
+            raise ProgrammingError("Pipe parameter '{}' has different values in the same statement".format(name))
+        into[name] = value
@@ -0,0 +1,101 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
+#             https://github.com/cloudflare/sqlalchemy-clickhouse
+
+import itertools
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+
+
+class ResultBuffer(object):
+    """ Rows of a query result, consumed by the cursor fetch methods """
+
+    def fetchone(self) -> Optional[Tuple[Any, ...]]:
+        raise NotImplementedError()
+
+    def fetchmany(self, size: int) -> List[Tuple[Any, ...]]:
+        raise NotImplementedError()
+
+    def fetchall(self) -> List[Tuple[Any, ...]]:
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class RowBuffer(ResultBuffer):
+    """ Fully fetched rows, read by position.
+
+    Rows are kept as they were decoded and turned into tuples only when fetched. Every fetch is
+    O(1) per returned row, regardless of how many rows remain.
+    """
+
+    def __init__(self, rows: Sequence[Sequence[Any]]):
+        self._rows = rows
+        self._pos = 0
+
+    def fetchone(self) -> Optional[Tuple[Any, ...]]:
+        pos = self._pos
+        if pos >= len(self._rows):
+            return None
+        row = self._rows[pos]
+        self._pos = pos + 1
+        return tuple(row)
+
+    def fetchmany(self, size: int) -> List[Tuple[Any, ...]]:
+        pos = self._pos
+        result = list(map(tuple, self._rows[pos:pos + size]))
+        self._pos = pos + len(result)
+        return result
+
+    def fetchall(self) -> List[Tuple[Any, ...]]:
+        result = list(map(tuple, self._rows[self._pos:]))
+        self.close()
+        return result
+
+    def close(self):
+        self._rows = ()
+        self._pos = 0
+
+
+class StreamBuffer(ResultBuffer):
+    """ Rows read from an iterator as they are fetched, e.g. from a streamed response.
+
+    ``on_close`` releases what the iterator reads from, e.g. the response, even if no row was
+    fetched yet.
+    """
+
+    def __init__(self, rows: Iterator[Tuple[Any, ...]], on_close: Optional[Callable[[], None]] = None):
+        self._rows = rows
+        self._on_close = on_close
+
+    def fetchone(self) -> Optional[Tuple[Any, ...]]:
+        return next(self._rows, None)
+
+    def fetchmany(self, size: int) -> List[Tuple[Any, ...]]:
+        return list(itertools.islice(self._rows, size))
+
+    def fetchall(self) -> List[Tuple[Any, ...]]:
+        return list(self._rows)
+
+    def close(self):
+        # Generators release their response when closed
+        close = getattr(self._rows, 'close', None)
+        if close is not None:
+            close()
+        self._rows = iter(())
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close()
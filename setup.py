@@ -36,8 +36,17 @@ setup(
     keywords = "db database cloud tinybird analytics clickhouse",
     install_requires = [
         'sqlalchemy',
-        'infi.clickhouse_orm'
+        'requests',
     ],
+    extras_require = {
+        'models': ['infi.clickhouse_orm'],
+        'arrow': ['pyarrow'],
+        'numpy': ['numpy'],
+        'async': ['aiohttp'],
+        'zstd': ['zstandard'],
+        'pandas': ['pandas', 'pyarrow'],
+        'polars': ['polars', 'pyarrow'],
+    },
     packages=[
         'sqlalchemy_tinybird',
     ],
@@ -50,6 +59,7 @@ setup(
     entry_points={
         'sqlalchemy.dialects': [
             'tinybird=sqlalchemy_tinybird.__init__',
+            'tinybird.async=sqlalchemy_tinybird.dialect:TinybirdAsyncDialect',
         ]
     },
     classifiers = [
@@ -0,0 +1,81 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# Modules import each other by their top-level names, as the benchmarks do
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import registry
+
+from connection import Connection
+from standin import StandIn
+
+registry.register('tinybird', 'dialect', 'TinybirdDialect')
+registry.register('tinybird.async', 'dialect', 'TinybirdAsyncDialect')
+
+
+@pytest.fixture
+def standin():
+    with StandIn(rows=10, tables=3) as standin:
+        yield standin
+
+
+@pytest.fixture
+def connection(standin):
+    connection = Connection(standin.url, token='token', max_retries=0)
+    yield connection
+    connection.close()
+
+
+@pytest.fixture
+def engine(standin):
+    host = standin.url.split('//', 1)[1]
+    engine = sa.create_engine('tinybird://token@%s/?protocol=http&max_retries=0' % host)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def run_async(standin):
+    """ Returns the function running a statement on an async engine of the stand-in, with extra
+    URL arguments and execution options, and returning its rows. A function given instead of a
+    statement is called with the sync facade of the connection, and its result returned.
+    """
+    pytest.importorskip('aiohttp')
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    def run(statement, options='', **execution_options):
+        async def main():
+            host = standin.url.split('//', 1)[1]
+            engine = create_async_engine('tinybird+async://token@%s/?protocol=http&max_retries=0%s' % (host, options))
+            try:
+                async with engine.connect() as conn:
+                    conn = await conn.execution_options(**execution_options)
+                    if callable(statement):
+                        return await conn.run_sync(statement)
+                    if execution_options.get('stream_results'):
+                        return await (await conn.stream(statement)).all()
+                    result = await conn.execute(statement)
+                    return result.fetchall()
+            finally:
+                await engine.dispose()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,77 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import datetime
+
+import pytest
+import sqlalchemy as sa
+
+from error import ProgrammingError
+import instrument
+from pipe import tinybird_pipe
+
+
+def test_execute(run_async):
+    rows = run_async(sa.text('SELECT * FROM events LIMIT 3'))
+    assert len(rows) == 3
+    assert rows[0][4] == datetime.datetime(2022, 1, 1)
+
+
+def test_closed_cursors_raise(run_async):
+    def fetch_after_close(conn):
+        cursor = conn.connection.cursor()
+        with pytest.raises(ProgrammingError):
+            cursor.fetchone()
+        cursor.execute('SELECT * FROM events LIMIT 2')
+        assert len(cursor.fetchall()) == 2
+        cursor.close()
+        for fetch in (cursor.fetchone, cursor.fetchmany, cursor.fetchall):
+            with pytest.raises(ProgrammingError):
+                fetch()
+        return True
+    assert run_async(fetch_after_close)
+
+
+def test_pipes_read_their_endpoint(run_async, standin):
+    events_pipe = tinybird_pipe('events_pipe', sa.column('id'), sa.column('browser'), limit=3)
+    rows = run_async(sa.select(events_pipe))
+    assert standin.log[-1].path == '/v0/sql'
+    assert standin.log[-1].params['limit'] == '3'
+    assert len(rows) == 10
+
+    for options in ({}, {'stream_results': True}):
+        rows = run_async(events_pipe, **options)
+        assert standin.log[-1].path == '/v0/pipes/events_pipe.json'
+        assert standin.log[-1].params['limit'] == '3'
+        assert rows[0][:3] == (0, 0, 'Chrome')
+
+
+def test_queries_are_timed(run_async):
+    reports = []
+    instrument.add_listener(reports.append)
+    try:
+        run_async(sa.text('SELECT * FROM events LIMIT 3'))
+        run_async(sa.text('SELECT * FROM events LIMIT 4'), stream_results=True)
+    finally:
+        instrument.remove_listener(reports.append)
+    reports = [r for r in reports if 'events' in r.query]
+    assert [r.rows for r in reports] == [3, 4]
+    assert all(r.query_id and r.timings.ttfb > 0 and r.timings.download > 0 for r in reports)
+    assert reports[0].timings.decode > 0 and reports[0].timings.materialize > 0
+    assert reports[0].statistics['rows_read'] == 3
+
+
+def test_columnar_results_are_rejected(run_async):
+    with pytest.raises(sa.exc.NotSupportedError):
+        run_async(sa.text('SELECT * FROM events LIMIT 3'), tinybird_columnar=True)
@@ -0,0 +1,85 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+
+import pytest
+import sqlalchemy as sa
+
+from connection import Connection
+from error import ProgrammingError, ReadBudgetExceeded, ServerError
+
+TOO_MANY_ROWS = 'Code: 158. DB::Exception: Limit for rows (controlled by max_rows_to_read) exceeded. (TOO_MANY_ROWS)'
+TIMEOUT_EXCEEDED = 'Code: 159. DB::Exception: Timeout exceeded: elapsed 2.1 seconds. (TIMEOUT_EXCEEDED)'
+
+
+@pytest.fixture
+def budgeted(standin):
+    connection = Connection(standin.url, token='token', max_retries=0, max_rows_read=10)
+    yield connection
+    connection.close()
+
+
+def test_limits_are_sent(budgeted, standin):
+    budgeted.cursor().execute('SELECT * FROM events LIMIT 3')
+    assert standin.log[-1].params['max_rows_to_read'] == '10'
+    assert standin.log[-1].params['read_overflow_mode'] == 'throw'
+
+
+def test_budget_errors(budgeted, standin):
+    standin.fail(400, TOO_MANY_ROWS)
+    with pytest.raises(ReadBudgetExceeded) as e:
+        budgeted.cursor().execute('SELECT * FROM events')
+    assert (e.value.limit, e.value.budget, e.value.status) == ('max_rows_read', 10, 400)
+
+
+def test_limits_set_elsewhere_are_not_budget_errors(connection, budgeted, standin):
+    cursor = connection.cursor()
+    cursor.settings = {'max_execution_time': 2}
+    standin.fail(400, TIMEOUT_EXCEEDED)
+    with pytest.raises(ProgrammingError) as e:
+        cursor.execute('SELECT * FROM events')
+    assert not isinstance(e.value, ReadBudgetExceeded)
+
+    # A budget on rows says nothing about timeouts
+    standin.fail(400, TIMEOUT_EXCEEDED)
+    with pytest.raises(ProgrammingError) as e:
+        budgeted.cursor().execute('SELECT * FROM events')
+    assert not isinstance(e.value, ReadBudgetExceeded)
+
+    # Neither about unavailable servers
+    standin.fail(503, TOO_MANY_ROWS)
+    with pytest.raises(ServerError):
+        budgeted.cursor().execute('SELECT * FROM events')
+
+
+def test_soft_budget_warns(standin, caplog):
+    connection = Connection(standin.url, token='token', max_rows_read=5, budget_mode='soft')
+    with caplog.at_level(logging.WARNING, logger='sqlalchemy_tinybird'):
+        connection.cursor().execute('SELECT * FROM events LIMIT 7')
+    assert 'max_rows_to_read' not in standin.log[-1].params
+    assert 'read 7 rows, over its budget of 5' in caplog.text
+
+
+def test_async_budgets(standin, run_async):
+    assert len(run_async(sa.text('SELECT * FROM events LIMIT 3'), '&max_rows_read=10')) == 3
+    assert standin.log[-1].params['max_rows_to_read'] == '10'
+
+    run_async(sa.text('SELECT * FROM events LIMIT 3'), tinybird_read_budget={'max_bytes_read': 100})
+    assert standin.log[-1].params['max_bytes_to_read'] == '100'
+
+    standin.fail(400, TOO_MANY_ROWS, match='FROM events')
+    with pytest.raises(sa.exc.OperationalError) as e:
+        run_async(sa.text('SELECT * FROM events'), '&max_rows_read=10')
+    assert isinstance(e.value.orig, ReadBudgetExceeded)
@@ -0,0 +1,87 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import pickle
+import threading
+
+import pytest
+
+import cache
+from cache import DiskCache, MemoryCache
+
+VALUE = ([('id', 'UInt64')], [[str(i)] for i in range(100)])
+
+
+def directory_size(directory):
+    return sum(e.stat().st_size for e in os.scandir(directory) if e.name.endswith('.tbcache'))
+
+
+def test_disk_cache_is_not_scanned_on_every_write(tmp_path, monkeypatch):
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(cache.os, 'scandir', lambda path: scans.append(path) or scandir(path))
+    disk = DiskCache(str(tmp_path), max_bytes=100000)
+    for i in range(300):
+        disk.set('key%d' % i, VALUE, 60)
+    # Once full, each scan makes room for a tenth of max_bytes
+    entry = len(pickle.dumps(VALUE, protocol=pickle.HIGHEST_PROTOCOL))
+    assert len(scans) < 300 * entry / (disk.max_bytes / 10)
+    assert directory_size(tmp_path) <= disk.max_bytes
+    assert disk.size == directory_size(tmp_path)
+    assert disk.stats.evictions > 0
+    assert disk.get('key299') == VALUE
+    assert disk.get('key0') is None
+
+
+def test_disk_cache_only_reads_trusted_files(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    disk.set('key', VALUE, 60)
+    assert disk.get('key') == VALUE
+    os.chmod(disk._path('key'), 0o666)
+    assert disk.get('key') is None
+    if hasattr(os, 'getuid') and os.getuid() == 0:
+        os.chmod(disk._path('key'), 0o600)
+        os.chown(disk._path('key'), 12345, -1)
+        assert disk.get('key') is None
+
+
+@pytest.mark.parametrize('backend', ['memory', 'disk'])
+def test_stats_add_up_across_threads(backend, tmp_path):
+    shared = MemoryCache() if backend == 'memory' else DiskCache(str(tmp_path))
+    shared.set('hit', VALUE, 60)
+
+    def read():
+        for _ in range(200):
+            shared.get('hit')
+            shared.get('miss')
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (shared.stats.hits, shared.stats.misses) == (1600, 1600)
+
+
+def test_connection_settings_are_part_of_the_key(standin):
+    from connection import Connection
+    shared = MemoryCache()
+    first = Connection(standin.url, token='token', cache=shared, cache_ttl=60)
+    other = Connection(standin.url, token='token', cache=shared, cache_ttl=60, settings={'max_threads': 1})
+    for connection in (first, other, first):
+        connection.select_rows('SELECT * FROM events LIMIT 3')
+        connection.select_pipe('events_pipe')
+    assert len(standin.queries()) == 2
+    assert len(standin.log) == 4
+    assert (shared.stats.hits, shared.stats.misses) == (2, 4)
@@ -0,0 +1,118 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import datetime
+
+import pytest
+import sqlalchemy as sa
+
+import connection as connection_module
+from connection import _columns_query
+from standin import COLUMNS
+
+pytest.importorskip('pyarrow')
+
+QUERY = 'SELECT * FROM events LIMIT 7'
+
+events = sa.table(
+    'events', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer), sa.column('browser', sa.String),
+    sa.column('country', sa.String), sa.column('ts', sa.DateTime), sa.column('day', sa.Date),
+    sa.column('duration', sa.Float), sa.column('amount', sa.Numeric(18, 2)))
+
+
+@pytest.fixture
+def no_pyarrow(monkeypatch):
+    monkeypatch.setattr(connection_module, 'import_pyarrow', lambda: None)
+
+
+def test_rows_match_the_row_path(connection):
+    cursor = connection.cursor()
+    cursor.execute(QUERY)
+    rows = cursor.fetchall()
+
+    columnar = connection.cursor(columnar=True)
+    columnar.execute(QUERY)
+    assert columnar.fetchone() == rows[0]
+    assert columnar.fetchall() == rows[1:]
+    assert rows[0][2:6] == ('Chrome', 'ES', datetime.datetime(2022, 1, 1), datetime.date(2022, 1, 1))
+
+
+def test_columns_have_clickhouse_types(connection, standin):
+    cursor = connection.cursor(columnar=True)
+    cursor.execute(QUERY)
+    assert [(c[0], c[1]) for c in cursor.description] == COLUMNS
+    assert standin.log[0].params['output_format_arrow_string_as_string'] == '1'
+
+
+def test_types_are_asked_once_per_query(connection, standin):
+    cursor = connection.cursor(columnar=True)
+    for _ in range(2):
+        cursor.execute(QUERY)
+        cursor.fetchall()
+    queries = [q.rsplit(' FORMAT ', 1)[0] for q in standin.queries()]
+    assert queries == [QUERY, _columns_query(QUERY), QUERY]
+
+
+def test_declared_types_need_no_probe(engine, standin):
+    with engine.connect() as conn:
+        result = conn.execution_options(tinybird_columnar=True).execute(sa.select(events).limit(3))
+        rows = result.fetchall()
+    assert rows[0][1:6] == (0, 'Chrome', 'ES', datetime.datetime(2022, 1, 1), datetime.date(2022, 1, 1))
+    assert not any('LIMIT 0' in q for q in standin.queries())
+
+
+def test_numpy_arrays_do_not_depend_on_pyarrow(connection, monkeypatch):
+    cursor = connection.cursor(columnar=True)
+    cursor.execute(QUERY)
+    arrow = cursor.fetch_numpy()
+
+    monkeypatch.setattr(connection_module, 'import_pyarrow', lambda: None)
+    cursor.execute(QUERY)
+    fallback = cursor.fetch_numpy()
+    for name in ('id', 'user_id', 'ts', 'day', 'duration'):
+        assert arrow[name].dtype == fallback[name].dtype, name
+        assert arrow[name].tolist() == fallback[name].tolist(), name
+    assert str(arrow['ts'].dtype) == 'datetime64[s]'
+    assert str(arrow['day'].dtype) == 'datetime64[D]'
+
+
+def test_fallback_columns(connection, no_pyarrow):
+    cursor = connection.cursor(columnar=True)
+    cursor.execute(QUERY)
+    assert [(c[0], c[1]) for c in cursor.description] == COLUMNS
+    assert cursor.fetchone()[2:6] == ('Chrome', 'ES', datetime.datetime(2022, 1, 1), datetime.date(2022, 1, 1))
+
+
+@pytest.mark.parametrize('query, probe', [
+    ('SELECT 1;', 'SELECT * FROM (SELECT 1) LIMIT 0'),
+    ('SELECT 1 FORMAT JSON', 'SELECT * FROM (SELECT 1) LIMIT 0'),
+    ("SELECT a FROM t SETTINGS max_threads = 2, x = 'y'",
+     "SELECT * FROM (SELECT a FROM t) LIMIT 0 SETTINGS max_threads = 2, x = 'y'"),
+])
+def test_columns_query(query, probe):
+    assert _columns_query(query) == probe
+
+
+def test_frames_need_no_probe_for_statements(engine, standin):
+    pytest.importorskip('pandas')
+    from frames import read_frame
+
+    frame = read_frame(engine, sa.select(events).limit(3))
+    assert str(frame['ts'].dtype).startswith('datetime64')
+    assert str(frame['user_id'].dtype) == 'uint32'
+    assert not any('LIMIT 0' in q for q in standin.queries())
+
+    chunks = list(read_frame(engine, 'SELECT * FROM events LIMIT 5;', chunksize=2))
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    assert chunks[0]['day'][0] == datetime.date(2022, 1, 1)
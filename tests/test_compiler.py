@@ -0,0 +1,111 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import pytest
+import sqlalchemy as sa
+
+from compiler import render_in_array
+
+events = sa.table('events', sa.column('id', sa.Integer), sa.column('browser', sa.String))
+
+
+@pytest.fixture
+def server_params_engine(standin):
+    host = standin.url.split('//', 1)[1]
+    engine = sa.create_engine('tinybird://token@%s/?protocol=http&max_retries=0&server_params=true' % host)
+    yield engine
+    engine.dispose()
+
+
+@pytest.mark.parametrize('value, placeholder, param', [
+    (None, '{browser_1:Nullable(String)}', '\\N'),
+    ('Chrome', '{browser_1:String}', 'Chrome'),
+])
+def test_server_param_nulls(server_params_engine, standin, value, placeholder, param):
+    with server_params_engine.connect() as conn:
+        conn.execute(sa.select(events).where(events.c.browser == sa.bindparam('browser_1', value, sa.String)))
+    assert placeholder in standin.queries()[-1]
+    assert standin.log[-1].params['param_browser_1'] == param
+
+
+@pytest.mark.parametrize('value, placeholder', [
+    (7, '{id_1:Int64}'),
+    (2 ** 63 + 1, '{id_1:UInt64}'),
+    (-2 ** 63 - 1, '{id_1:Int128}'),
+    (2 ** 200, '{id_1:Int256}'),
+])
+def test_server_param_ints(server_params_engine, standin, value, placeholder):
+    with server_params_engine.connect() as conn:
+        conn.execute(sa.select(events).where(events.c.id == value))
+        # The compiled statement is cached with its first placeholder types
+        conn.execute(sa.select(events).where(events.c.id == 1))
+    assert placeholder in standin.queries()[-2]
+    assert standin.log[-2].params['param_id_1'] == str(value)
+    assert '{id_1:Int64}' in standin.queries()[-1]
+
+
+def test_server_param_int_arrays(server_params_engine, standin):
+    with server_params_engine.connect() as conn:
+        conn.execute(sa.select(events).where(events.c.id.in_([1, 2 ** 64 - 1])))
+    assert '{id_1:Array(UInt64)}' in standin.queries()[-1]
+
+
+@pytest.mark.parametrize('ids, array', [
+    (list(range(-20, 20)), 'range(-20, 20)'),
+    ([-100] + list(range(-40, -10)) + [5], 'arrayConcat([-100,5], range(-40, -10))'),
+    ([3, -1, 3], '[-1,3]'),
+])
+def test_render_in_array(ids, array):
+    assert render_in_array(ids) == 'SELECT arrayJoin(%s)' % array
+
+
+def test_in_lists_as_arrays(standin):
+    host = standin.url.split('//', 1)[1]
+    engine = sa.create_engine('tinybird://token@%s/?protocol=http&in_list_threshold=10' % host)
+    with engine.connect() as conn:
+        conn.execute(sa.select(events).where(events.c.id.in_(list(range(-30, 0)))))
+    engine.dispose()
+    assert 'IN (SELECT arrayJoin(range(-30, 0)))' in standin.queries()[-1]
+
+
+def test_cached_statements_expand_in_lists(engine, standin):
+    cache = {}
+    with engine.execution_options(compiled_cache=cache).connect() as conn:
+        for ids in ([1, 2], [3, 4, 5], []):
+            assert len(conn.execute(sa.select(events).where(events.c.id.in_(ids))).fetchall()) == 10
+        assert len(cache) == 1
+        for browsers, limit, offset in ((["a'b", 'c'], 3, 2), (['x'], 4, 1)):
+            conn.execute(sa.select(events).where(events.c.browser.notin_(browsers)).limit(limit).offset(offset))
+        assert len(cache) == 2
+    queries = [q.split('WHERE ', 1)[1] for q in standin.queries()[-5:]]
+    assert queries == [
+        'id IN (1, 2) FORMAT JSONCompact',
+        'id IN (3, 4, 5) FORMAT JSONCompact',
+        'id IN (NULL) AND (1 != 1) FORMAT JSONCompact',
+        "(browser NOT IN ('a\\'b', 'c'))\n LIMIT 3\n OFFSET 2 FORMAT JSONCompact",
+        "(browser NOT IN ('x'))\n LIMIT 4\n OFFSET 1 FORMAT JSONCompact",
+    ]
+
+
+def test_cached_statements_switch_to_arrays(standin):
+    host = standin.url.split('//', 1)[1]
+    engine = sa.create_engine('tinybird://token@%s/?protocol=http&in_list_threshold=3' % host)
+    cache = {}
+    with engine.execution_options(compiled_cache=cache).connect() as conn:
+        conn.execute(sa.select(events).where(events.c.id.in_([1, 2])))
+        conn.execute(sa.select(events).where(events.c.id.in_([5, 4, 3])))
+    engine.dispose()
+    assert len(cache) == 1
+    assert 'id IN (1, 2)' in standin.queries()[-2]
+    assert 'id IN (SELECT arrayJoin([3,4,5]))' in standin.queries()[-1]
@@ -0,0 +1,65 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import threading
+import time
+
+import pytest
+
+from error import OperationalError, ProgrammingError
+
+SLOW = 'SELECT * FROM events WHERE sleep(3) = 0 LIMIT 2'
+
+
+def test_results_keep_input_order(connection):
+    results = connection.select_many(['SELECT * FROM events LIMIT %d' % n for n in (3, 1, 2)])
+    assert [len(rows.fetchall()) for _, rows in results] == [3, 1, 2]
+
+
+def test_a_failed_query_does_not_sink_the_others(connection):
+    results = connection.select_many([
+        'SELECT * FROM events LIMIT 2',
+        'SELECT throwIf(1) FROM events LIMIT 1',
+        ('SELECT * FROM events WHERE browser = %(b)s LIMIT 3', {'b': 'Chrome'}),
+    ])
+    assert isinstance(results[1], ProgrammingError)
+    assert len(results[0][1].fetchall()) == 2
+    assert len(results[2][1].fetchall()) == 3
+
+    with pytest.raises(ProgrammingError):
+        connection.select_many(['SELECT * FROM events LIMIT 2', 'SELECT throwIf(1)'], return_exceptions=False)
+
+
+def test_deadline_aborts_queries_still_running(connection):
+    start = time.monotonic()
+    results = connection.select_many([SLOW, 'SELECT * FROM events LIMIT 2'], timeout=0.5)
+    assert time.monotonic() - start < 1.5
+    assert isinstance(results[0], OperationalError)
+    assert len(results[1][1].fetchall()) == 2
+
+    # The slow request was aborted instead of keeping its thread until the answer comes
+    deadline = time.monotonic() + 1
+    while any(t.name.startswith('tinybird-query') for t in threading.enumerate()):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_cursors_run_concurrently(connection):
+    cursor = connection.cursor()
+    start = time.monotonic()
+    cursors = cursor.execute_concurrent([SLOW, 'SELECT * FROM events LIMIT 4', 'SELECT throwIf(1)'], timeout=0.5)
+    assert time.monotonic() - start < 1.5
+    assert isinstance(cursors[0], OperationalError)
+    assert len(cursors[1].fetchall()) == 4
+    assert isinstance(cursors[2], ProgrammingError)
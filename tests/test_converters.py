@@ -0,0 +1,67 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from decimal import Decimal
+
+import pytest
+
+from converters import convert_rows, row_converter
+
+
+PRICES = [('price', 'Decimal(18, 2)'), ('rate', 'Nullable(Decimal(38, 10))'), ('history', 'Array(Decimal(18, 2))')]
+PRICE_ROWS = [
+    (Decimal('1234567890123456.78'), Decimal('123456789012345678.1234567890'), [Decimal('1.00'), Decimal('-0.10')]),
+    (Decimal('1.00'), None, []),
+    (Decimal('-0.01'), Decimal('0.0000000001'), [Decimal('99999999999999.99')]),
+]
+
+
+@pytest.fixture
+def prices(standin):
+    standin.add_table('prices', PRICES, PRICE_ROWS)
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_decimals_keep_precision_and_scale(connection, prices, stream):
+    cursor = connection.cursor(stream=stream)
+    cursor.execute('SELECT * FROM prices')
+    rows = cursor.fetchall()
+    assert rows == PRICE_ROWS
+    # Equal values of another scale would compare equal too
+    assert [str(row[0]) for row in rows] == ['1234567890123456.78', '1.00', '-0.01']
+    assert str(rows[0][1]) == '123456789012345678.1234567890'
+
+
+def test_decimals_are_requested_quoted(standin, connection, prices):
+    connection.cursor().execute('SELECT * FROM prices')
+    assert standin.log[-1].params['output_format_json_quote_decimals'] == '1'
+
+
+def test_decimal_numbers_are_still_read(connection, prices):
+    # With the setting turned off, decimals are JSON numbers, within float precision
+    cursor = connection.cursor()
+    cursor.settings = {'output_format_json_quote_decimals': 0}
+    cursor.execute('SELECT * FROM prices')
+    assert cursor.fetchall()[2][0] == Decimal('-0.01')
+
+
+def test_convert_rows_and_row_converter_agree():
+    columns = [('d', 'Decimal(9, 3)'), ('ts', 'DateTime'), ('n', 'UInt64')]
+    rows = [['1.500', '2022-01-01 00:00:00', '18446744073709551615'], ['0.000', '2022-01-02 12:00:00', '0']]
+    convert = row_converter(columns)
+    expected = [convert(row) for row in rows]
+    # convert_rows converts the rows it is given in place
+    assert [tuple(row) for row in convert_rows(columns, [list(row) for row in rows])] == expected
+    assert str(convert(rows[0])[0]) == '1.500'
+    assert convert(rows[0])[2] == 2 ** 64 - 1
@@ -0,0 +1,123 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import datetime
+
+import pytest
+import sqlalchemy as sa
+
+from error import ProgrammingError, ServerError
+
+
+def test_fetch_paths_return_the_same_rows(connection):
+    cursor = connection.cursor()
+    cursor.execute('SELECT * FROM events LIMIT 7')
+    rows = cursor.fetchall()
+    assert len(rows) == 7
+    assert cursor.rowcount == 7
+    assert rows[0][4] == datetime.datetime(2022, 1, 1)
+    assert rows[0][5] == datetime.date(2022, 1, 1)
+
+    cursor.execute('SELECT * FROM events LIMIT 7')
+    assert [cursor.fetchone() for _ in range(7)] == rows
+    assert cursor.fetchone() is None
+
+    cursor.execute('SELECT * FROM events LIMIT 7')
+    assert cursor.fetchmany(4) + cursor.fetchmany(4) == rows
+
+    stream = connection.cursor(stream=True)
+    stream.execute('SELECT * FROM events LIMIT 7')
+    assert stream.fetchall() == rows
+
+
+def test_query_id_and_settings_are_sent(standin, connection):
+    cursor = connection.cursor()
+    cursor.settings = {'max_threads': 2}
+    cursor.execute('SELECT * FROM events LIMIT 1')
+    request = standin.log[-1]
+    assert request.params['query_id'] == cursor.query_id
+    assert request.params['max_threads'] == '2'
+    assert request.headers['Authorization'] == 'Bearer token'
+    assert cursor.statistics['rows_read'] == 1
+
+
+def test_errors_are_typed(standin, connection):
+    standin.fail(400, 'Code: 62. DB::Exception: Syntax error. (SYNTAX_ERROR)')
+    with pytest.raises(ProgrammingError):
+        connection.cursor().execute('SELEC 1')
+    standin.fail(500, 'Code: 1001. DB::Exception: boom')
+    with pytest.raises(ServerError):
+        connection.cursor().execute('SELECT 1')
+
+
+def test_failed_reads_are_retried(standin):
+    from connection import Connection
+    connection = Connection(standin.url, token='token', max_retries=2)
+    standin.fail(503, 'unavailable', headers={'Retry-After': '0'})
+    cursor = connection.cursor()
+    cursor.execute('SELECT * FROM events LIMIT 3')
+    assert len(cursor.fetchall()) == 3
+    assert len(standin.queries()) == 2
+
+
+def test_engine_executes_and_reflects(engine):
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql('SELECT * FROM events LIMIT 5').fetchall()
+    assert len(rows) == 5
+    inspector = sa.inspect(engine)
+    assert 'events' in inspector.get_table_names()
+    assert [c['name'] for c in inspector.get_columns('events')][:2] == ['id', 'user_id']
+
+
+def test_pipe_phases_are_timed_once(connection, monkeypatch):
+    from instrument import QueryTimings
+    phases = []
+    measure = QueryTimings.measure
+    monkeypatch.setattr(QueryTimings, 'measure', lambda self, phase: phases.append(phase) or measure(self, phase))
+
+    cursor = connection.cursor()
+    cursor.execute_pipe('events_pipe', {'limit': 3})
+    assert len(cursor.fetchall()) == 10
+    assert sorted(phases) == ['decode', 'download', 'materialize']
+
+
+def test_cancel_from_another_thread_stops_execute(standin, connection):
+    import threading
+    import time
+    standin.latency = 5
+    cursor = connection.cursor()
+    errors = []
+
+    def execute():
+        try:
+            cursor.execute('SELECT * FROM events LIMIT 3')
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=execute)
+    start = time.monotonic()
+    thread.start()
+    # Cancelled while the stand-in holds the answer back
+    while not standin.requests:
+        time.sleep(0.01)
+    cursor.cancel()
+    thread.join(2)
+    assert not thread.is_alive()
+    assert time.monotonic() - start < 2
+    assert errors == []
+    assert cursor.fetchall() == []
+    assert len(standin.queries()) == 1
+
+    standin.latency = 0
+    cursor.execute('SELECT * FROM events LIMIT 3')
+    assert len(cursor.fetchall()) == 3
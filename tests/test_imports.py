@@ -0,0 +1,52 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Each case runs in a fresh interpreter, as bench_import.py does, and fails there on a broken assert
+from bench_import import CASES, run_case
+
+PACKAGE = CASES['package'][0]
+FORBIDDEN = ('sqlalchemy', 'requests', 'infi.clickhouse_orm')
+
+
+def test_package_import_loads_nothing():
+    code = PACKAGE + """
+assert sorted(set(dir(module)) & {'dialect', 'connection', 'tinybird_pipe'}) == ['connection', 'dialect', 'tinybird_pipe']
+assert not hasattr(module, 'nothing')
+"""
+    assert run_case(code, FORBIDDEN)['modules'] == []
+
+
+def test_exports_load_their_own_modules():
+    code = PACKAGE + """
+assert module.tinybird_pipe.__name__ == 'tinybird_pipe'
+assert 'sqlalchemy_tinybird.pipe' in sys.modules and 'sqlalchemy_tinybird.dialect' not in sys.modules
+assert module.__version__.count('.') == 2
+"""
+    assert run_case(code, FORBIDDEN)['modules'] == ['sqlalchemy']
+
+
+def test_dbapi_path_loads_neither_sqlalchemy_nor_infi(standin):
+    code = """
+import connection
+cursor = connection.connect(%r, token='token', max_retries=0).cursor()
+cursor.execute('SELECT * FROM events LIMIT 3')
+assert len(cursor.fetchall()) == 3
+""" % standin.url
+    assert run_case(code, FORBIDDEN)['modules'] == ['requests']
+    assert len(standin.queries()) == 1
+
+
+def test_engine_does_not_load_infi():
+    code, _, forbidden = CASES['engine']
+    assert run_case(code, forbidden)['modules'] == []
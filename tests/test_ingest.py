@@ -0,0 +1,78 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import datetime
+import decimal
+import time
+
+import pytest
+import sqlalchemy as sa
+
+from connection import Connection
+from error import NotSupportedError, ProgrammingError
+
+ROWS = [{'id': i, 'ts': datetime.datetime(2022, 1, 1, 0, 0, i), 'amount': decimal.Decimal('%d.50' % i)}
+        for i in range(7)]
+SENT = [{'id': i, 'ts': '2022-01-01 00:00:%02d' % i, 'amount': '%d.50' % i} for i in range(7)]
+
+
+def posts(standin):
+    return [request for request in standin.log if request.path == '/v0/events']
+
+
+def test_rows_are_batched(standin):
+    connection = Connection(standin.url, token='token', ingest_max_rows=3, ingest_flush_interval=60)
+    assert connection.ingest('events', ROWS) == 7
+    connection.flush()
+    assert standin.events['events'] == SENT
+    assert [len(r.body.splitlines()) for r in posts(standin)] == [3, 3, 1]
+    assert posts(standin)[0].params == {'name': 'events'}
+    assert connection.ingestor('events').stats.as_dict() == {
+        'rows': 7, 'bytes': sum(len(r.body) for r in posts(standin)), 'batches': 3, 'errors': 0}
+    connection.close()
+
+
+def test_batches_are_flushed_on_time(standin):
+    connection = Connection(standin.url, token='token', ingest_flush_interval=0.05)
+    connection.ingest('events', ROWS[:2])
+    deadline = time.monotonic() + 5
+    while not standin.events and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert standin.events['events'] == SENT[:2]
+    connection.close()
+
+
+def test_errors_are_raised_by_the_next_call(standin):
+    connection = Connection(standin.url, token='token', max_retries=0)
+    standin.fail(400, '{"error": "Invalid data source name"}')
+    connection.ingest('events', ROWS[:1])
+    with pytest.raises(ProgrammingError):
+        connection.flush()
+    assert connection.ingestor('events').stats.errors == 1
+    connection.close()
+
+
+def test_insert_rowcount(engine, standin):
+    events = sa.table('events', sa.column('id'), sa.column('ts'), sa.column('amount'))
+    with engine.connect() as conn:
+        result = conn.execute(events.insert(), ROWS)
+        assert result.rowcount == 7
+        assert conn.execute(events.insert(), ROWS[0]).rowcount == 1
+    assert standin.events['events'] == SENT + SENT[:1]
+
+
+def test_async_engine_rejects_ingest_args(run_async):
+    with pytest.raises(sa.exc.DBAPIError) as e:
+        run_async(sa.text('SELECT 1'), '&ingest_max_rows=100')
+    assert isinstance(e.value.orig, NotSupportedError)
@@ -0,0 +1,45 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import datetime
+
+import pytest
+
+pytest.importorskip('infi.clickhouse_orm')
+
+from infi.clickhouse_orm.models import ModelBase
+
+from model import AD_HOC_MODEL_CACHE_SIZE, ad_hoc_model
+
+
+def test_model_classes_are_shared_by_result_shape(connection):
+    ad_hoc_model.cache_clear()
+    first = list(connection.select('SELECT * FROM events LIMIT 2'))
+    second = list(connection.select('SELECT * FROM events LIMIT 3'))
+    assert type(first[0]) is type(second[0])
+    assert ad_hoc_model.cache_info().currsize == 1
+    assert second[2].browser == 'Safari'
+    assert second[2].ts == datetime.datetime(2022, 1, 1, 0, 0, 14, tzinfo=datetime.timezone.utc)
+
+
+def test_model_classes_are_evicted():
+    ad_hoc_model.cache_clear()
+    shared = len(ModelBase.ad_hoc_model_cache)
+    first = ad_hoc_model((('c0', 'UInt8'),))
+    for i in range(1, AD_HOC_MODEL_CACHE_SIZE + 10):
+        ad_hoc_model((('c%d' % i, 'UInt8'),))
+    assert ad_hoc_model.cache_info().currsize == AD_HOC_MODEL_CACHE_SIZE
+    assert ad_hoc_model((('c0', 'UInt8'),)) is not first
+    # Classes aren't kept in infi's own, unbounded, cache either
+    assert len(ModelBase.ad_hoc_model_cache) == shared
@@ -0,0 +1,37 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import datetime
+import decimal
+
+import pytest
+
+from param_escaper import ParamEscaper
+
+UTC = datetime.timezone.utc
+CET = datetime.timezone(datetime.timedelta(hours=1))
+
+
+@pytest.mark.parametrize('values', [
+    [decimal.Decimal('1.0'), decimal.Decimal('1.00'), decimal.Decimal('1.0'), decimal.Decimal('-0.0'),
+     decimal.Decimal('0.0')],
+    [datetime.datetime(2022, 1, 1, 12, tzinfo=UTC), datetime.datetime(2022, 1, 1, 13, tzinfo=CET),
+     datetime.datetime(2022, 1, 1, 12, tzinfo=UTC)],
+    ['a', 'b', 'a'],
+    [datetime.date(2022, 1, 1)] * 3,
+])
+def test_escape_column_matches_escape_item(values):
+    escaper = ParamEscaper()
+    assert escaper.escape_column(values) == [escaper.escape_item(v) for v in values]
+    assert len(set(escaper.escape_column(values))) == len(set(map(repr, values)))
@@ -0,0 +1,94 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import datetime
+import decimal
+
+import pytest
+import sqlalchemy as sa
+
+from dialect import TinybirdDialect
+from error import ProgrammingError
+from pipe import encode_param, tinybird_pipe
+
+events_pipe = tinybird_pipe('events_pipe', sa.column('id', sa.Integer), sa.column('browser', sa.String),
+                            date_from=datetime.date(2022, 1, 1), browsers=['Chrome', 'Firefox'], limit=None)
+
+
+def compile_statement(statement):
+    return statement.compile(dialect=TinybirdDialect())
+
+
+@pytest.mark.parametrize('value, encoded', [
+    (True, 'true'),
+    (datetime.datetime(2022, 1, 2, 3, 4, 5), '2022-01-02 03:04:05'),
+    (datetime.date(2022, 1, 2), '2022-01-02'),
+    (decimal.Decimal('1.50'), '1.50'),
+    ([1, 2, 3], '1,2,3'),
+    (7, '7'),
+])
+def test_params_are_encoded(value, encoded):
+    assert encode_param(value) == encoded
+
+
+def test_pipes_compile_as_tables():
+    compiled = compile_statement(sa.select(events_pipe.c.browser).where(events_pipe.c.id > 1))
+    assert 'FROM events_pipe' in str(compiled)
+    assert compiled.tinybird_pipe is None
+    assert compiled.tinybird_pipe_params == {'date_from': '2022-01-01', 'browsers': 'Chrome,Firefox'}
+
+    compiled = compile_statement(events_pipe)
+    assert str(compiled) == 'SELECT * FROM events_pipe'
+    assert compiled.tinybird_pipe == 'events_pipe'
+
+
+def test_conflicting_params_are_rejected():
+    other = tinybird_pipe('other', sa.column('id', sa.Integer), date_from=datetime.date(2022, 2, 1))
+    joined = sa.select(events_pipe.c.browser).join_from(events_pipe, other, events_pipe.c.id == other.c.id)
+    with pytest.raises(ProgrammingError):
+        compile_statement(joined)
+    compile_statement(sa.select(events_pipe.c.browser).join_from(
+        events_pipe, other.with_params(date_from=datetime.date(2022, 1, 1)), events_pipe.c.id == other.c.id))
+
+
+def test_with_params_copies_the_pipe():
+    pipe = events_pipe.with_params(date_from=datetime.date(2022, 3, 1), limit=3)
+    assert pipe.pipe_params == {'date_from': '2022-03-01', 'browsers': 'Chrome,Firefox', 'limit': '3'}
+    assert events_pipe.pipe_params['date_from'] == '2022-01-01'
+    assert list(pipe.c.keys()) == ['id', 'browser']
+    assert isinstance(pipe.c.id.type, sa.Integer)
+
+
+def test_params_are_sent_with_the_query(engine, standin):
+    with engine.connect() as conn:
+        rows = conn.execute(sa.select(events_pipe.c.browser)).fetchall()
+        # Cached statements keep the parameters of each Pipe
+        conn.execute(sa.select(events_pipe.with_params(date_from=datetime.date(2022, 3, 1)).c.browser))
+    assert len(rows) == 10
+    first, second = standin.log[-2:]
+    assert first.path == second.path == '/v0/sql'
+    assert first.params['date_from'] == '2022-01-01'
+    assert first.params['browsers'] == 'Chrome,Firefox'
+    assert second.params['date_from'] == '2022-03-01'
+    assert 'FROM events_pipe' in first.query
+
+
+def test_pipes_on_their_own_read_the_endpoint(engine, standin):
+    with engine.connect() as conn:
+        rows = conn.execute(events_pipe.with_params(limit=3)).fetchall()
+    request = standin.log[-1]
+    assert request.path == '/v0/pipes/events_pipe.json'
+    assert request.params['limit'] == '3'
+    assert request.params['date_from'] == '2022-01-01'
+    assert rows[0][:3] == (0, 0, 'Chrome')
@@ -0,0 +1,81 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import time
+from email.utils import formatdate
+
+import pytest
+
+from connection import Connection
+from error import RateLimitError
+import transport
+from transport import TokenBucket, retry_after
+
+QUERY = 'SELECT * FROM events LIMIT 3'
+
+
+def test_token_bucket_paces_requests():
+    bucket = TokenBucket(rate=10, capacity=2)
+    delays = [bucket.reserve() for _ in range(4)]
+    assert delays[:2] == [0.0, 0.0]
+    assert delays[2:] == [pytest.approx(0.1, abs=0.01), pytest.approx(0.2, abs=0.01)]
+
+    unlimited = TokenBucket()
+    assert [unlimited.reserve() for _ in range(100)] == [0.0] * 100
+
+
+def test_token_bucket_follows_the_rate_limit_headers():
+    bucket = TokenBucket()
+    transport.update_bucket(bucket, {'X-RateLimit-Limit': '10', 'X-RateLimit-Remaining': '4',
+                                     'X-RateLimit-Reset': '2'})
+    assert bucket.capacity == 10
+    assert bucket.rate == 2.0
+    # An epoch timestamp is read as the seconds left until it
+    transport.update_bucket(bucket, {'X-RateLimit-Remaining': '10', 'X-RateLimit-Reset': str(time.time() + 5)})
+    assert bucket.rate == pytest.approx(2.0, rel=0.01)
+
+    bucket.block(0.5)
+    assert bucket.reserve() == pytest.approx(0.5, abs=0.01)
+
+
+def test_retry_after_is_parsed():
+    assert retry_after({}) is None
+    assert retry_after({'Retry-After': '3'}) == 3.0
+    assert retry_after({'Retry-After': '-1'}) == 0.0
+    assert retry_after({'Retry-After': formatdate(time.time() + 10, usegmt=True)}) == pytest.approx(10, abs=1)
+    assert retry_after({'Retry-After': 'soon'}) is None
+
+
+def test_rate_limited_reads_are_retried(standin):
+    connection = Connection(standin.url, token='token', max_retries=2)
+    standin.fail(429, 'Too many requests', headers={
+        'Retry-After': '0.2', 'X-RateLimit-Limit': '10', 'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '0.1'})
+    start = time.monotonic()
+    _, rows = connection.select_rows(QUERY)
+    assert len(rows.fetchall()) == 3
+    assert time.monotonic() - start >= 0.2
+    assert len(standin.queries()) == 2
+    stats = transport.pool_stats()[standin.url]
+    assert (stats['retries'], stats['rate_limited']) == (1, 1)
+    assert connection.rate_limiter.capacity == 10
+    assert connection.rate_limiter.rate == 10.0
+
+
+def test_rate_limit_errors_carry_retry_after(standin, connection):
+    standin.fail(429, 'Too many requests', headers={'Retry-After': '7'})
+    with pytest.raises(RateLimitError) as e:
+        connection.select_rows(QUERY)
+    assert e.value.status == 429
+    assert e.value.retry_after == 7.0
+    assert len(standin.queries()) == 1
@@ -0,0 +1,68 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import time
+
+import sqlalchemy as sa
+
+
+def reflect(standin, cache_dir, options='', token='token'):
+    """ Reflects the stand-in's schema with a new engine and returns its tables, the columns
+    and indexes of ``events`` and the number of ``system.columns`` queries it sent
+    """
+    host = standin.url.split('//', 1)[1]
+    engine = sa.create_engine('tinybird://%s@%s/?protocol=http&max_retries=0&schema_cache_dir=%s%s'
+                              % (token, host, cache_dir, options))
+    sent = len(standin.queries())
+    try:
+        inspector = sa.inspect(engine)
+        tables = inspector.get_table_names()
+        columns = [c['name'] for c in inspector.get_columns('events')]
+        indexes = inspector.get_indexes('events')
+        assert inspector.has_table('t1') and not inspector.has_table('missing')
+    finally:
+        engine.dispose()
+    queries = [q for q in standin.queries()[sent:] if 'system.columns' in q]
+    return tables, columns, indexes, len(queries)
+
+
+def test_schemas_are_reflected_with_one_query(standin, tmp_path):
+    tables, columns, indexes, queries = reflect(standin, tmp_path)
+    assert tables == ['events', 't1', 't2']
+    assert columns[:2] == ['id', 'user_id']
+    assert {i['name']: i['column_names'] for i in indexes} == {'partition': ['day'], 'sorting_key': ['id']}
+    assert queries == 1
+    assert not any(q.startswith(('DESCRIBE', 'EXISTS', 'SHOW')) for q in standin.queries())
+
+
+def test_schemas_persist_across_engines(standin, tmp_path):
+    first = reflect(standin, tmp_path)
+    second = reflect(standin, tmp_path)
+    assert second[:3] == first[:3]
+    assert second[3] == 0
+    assert list(tmp_path.glob('*.tbcache'))
+
+
+def test_schema_version_and_token_invalidate_the_cache(standin, tmp_path):
+    reflect(standin, tmp_path, '&schema_version=1')
+    assert reflect(standin, tmp_path, '&schema_version=1')[3] == 0
+    assert reflect(standin, tmp_path, '&schema_version=2')[3] == 1
+    assert reflect(standin, tmp_path, '&schema_version=2', token='other')[3] == 1
+
+
+def test_expired_schemas_are_reflected_again(standin, tmp_path):
+    reflect(standin, tmp_path, '&schema_cache_ttl=0.1')
+    assert reflect(standin, tmp_path, '&schema_cache_ttl=0.1')[3] == 0
+    time.sleep(0.2)
+    assert reflect(standin, tmp_path, '&schema_cache_ttl=0.1')[3] == 1
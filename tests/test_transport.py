@@ -0,0 +1,111 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import time
+
+import pytest
+
+from connection import Connection
+import transport
+
+QUERY = 'SELECT * FROM events LIMIT 5'
+CODECS = ['gzip', 'zstd']
+
+
+@pytest.fixture
+def codec(request):
+    if request.param == 'zstd':
+        pytest.importorskip('zstandard')
+    return request.param
+
+
+def select_all(connection):
+    """ The rows of QUERY read by every path: whole, streamed, from a pipe and columnar """
+    _, rows = connection.select_rows(QUERY)
+    _, stream = connection.select_rows(QUERY, stream=True)
+    _, pipe = connection.select_pipe('events_pipe')
+    cursor = connection.cursor(columnar=True)
+    cursor.execute(QUERY)
+    return rows.fetchall(), stream.fetchall(), pipe.fetchall()[:5], cursor.fetchall()
+
+
+@pytest.mark.parametrize('codec', CODECS, indirect=True)
+def test_post_bodies_are_compressed(standin, codec):
+    connection = Connection(standin.url, token='token', max_retries=0, query_method='post', compression=codec,
+                            compress_threshold=100)
+    _, rows = connection.select_rows(QUERY)
+    padded = "SELECT * FROM events WHERE browser != '%s' LIMIT 5" % ('x' * 100)
+    _, padded_rows = connection.select_rows(padded)
+    assert padded_rows.fetchall() == rows.fetchall()
+
+    small, large = standin.log
+    assert small.method == large.method == 'POST'
+    assert 'q' not in small.params and 'q' not in large.params
+    assert 'Content-Encoding' not in small.headers
+    assert small.query == QUERY + ' FORMAT JSONCompact'
+    assert large.headers['Content-Encoding'] == codec
+    assert large.query == padded + ' FORMAT JSONCompact'
+
+
+@pytest.mark.parametrize('codec', CODECS, indirect=True)
+def test_compressed_responses_are_decoded(standin, connection, codec):
+    pytest.importorskip('pyarrow')
+    plain = select_all(connection)
+    assert len(plain[0]) == 5
+
+    standin.compression = codec
+    assert select_all(connection) == plain
+    assert all(codec in request.headers['Accept-Encoding'] for request in standin.log)
+
+
+def stats(standin):
+    return transport.pool_stats()[standin.url]
+
+
+def test_connections_share_pooled_connections(standin):
+    first = Connection(standin.url, token='token')
+    other = Connection(standin.url, token='other')
+    assert first.request_session is other.request_session
+    for connection in (first, other, first):
+        connection.select_rows('SELECT * FROM events LIMIT 1')
+    assert stats(standin) == {'requests': 3, 'handshakes': 1, 'reused': 2, 'retries': 0, 'rate_limited': 0}
+
+
+def test_pool_options(standin):
+    closing = Connection(standin.url, token='token', keep_alive=False)
+    for _ in range(2):
+        closing.select_rows('SELECT * FROM events LIMIT 1')
+    assert stats(standin)['handshakes'] == 2
+    assert standin.log[-1].headers['Connection'] == 'close'
+
+    idle = Connection(standin.url, token='token', idle_timeout=0.1)
+    assert idle.request_session is not closing.request_session
+    idle.select_rows('SELECT * FROM events LIMIT 1')
+    idle.select_rows('SELECT * FROM events LIMIT 1')
+    time.sleep(0.2)
+    idle.select_rows('SELECT * FROM events LIMIT 1')
+    assert stats(standin)['handshakes'] == 4
+    assert stats(standin)['reused'] == 1
+
+
+def test_pool_options_from_the_url(standin):
+    import sqlalchemy as sa
+    host = standin.url.split('//', 1)[1]
+    engine = sa.create_engine('tinybird://token@%s/?protocol=http&pool_maxsize=2&pool_block=true' % host)
+    with engine.connect() as conn:
+        conn.exec_driver_sql('SELECT * FROM events LIMIT 1').fetchall()
+        adapter = conn.connection.dbapi_connection.request_session.get_adapter(standin.url)
+    engine.dispose()
+    assert adapter._pool_maxsize == 2
+    assert adapter._pool_block is True
@@ -0,0 +1,81 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+HEADER = ['id', 'name', 'note']
+# Notes with line breaks and quotes inside quoted fields
+ROWS = [[str(i), 'name %d' % i, 'line one\nline "two"\n' * (i % 3)] for i in range(200)]
+
+
+def to_csv(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def parts(standin, name='events'):
+    return [list(csv.reader(io.StringIO(data.decode()))) for _, data in standin.uploads[name]]
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_csv_parts_end_with_records_and_repeat_the_header(connection, standin, tmp_path, compression):
+    path = tmp_path / 'events.csv'
+    path.write_bytes(to_csv([HEADER] + ROWS))
+    progress = connection.upload('events', str(path), part_size=2048, chunk_size=1000, compression=compression,
+                                 mode='replace')
+    received = parts(standin)
+    assert progress.parts == len(received) > 2
+    assert all(records[0] == HEADER for records in received)
+    assert [row for records in received for row in records[1:]] == ROWS
+    assert progress.rows == len(ROWS)
+    assert [params['mode'] for params, _ in standin.uploads['events']] == ['replace'] + ['append'] * (len(received) - 1)
+
+
+def test_csv_without_header(connection, standin, tmp_path):
+    path = tmp_path / 'events.csv'
+    path.write_bytes(to_csv(ROWS))
+    progress = connection.upload('events', str(path), part_size=2048, chunk_size=1000, header=False)
+    assert [row for records in parts(standin) for row in records] == ROWS
+    assert progress.rows == len(ROWS)
+
+
+def test_csv_rows(connection, standin):
+    progress = connection.upload('events', iter(ROWS), format='csv', part_size=2048, chunk_size=1000)
+    received = parts(standin)
+    assert len(received) > 2
+    assert [row for records in received for row in records] == ROWS
+    assert progress.rows == len(ROWS)
+
+
+def test_ndjson_rows(connection, standin):
+    rows = [{'id': i, 'note': 'a\nb'} for i in range(100)]
+    progress = connection.upload('events', rows, part_size=512, chunk_size=300)
+    received = [json.loads(line) for _, data in standin.uploads['events'] for line in data.splitlines()]
+    assert received == rows
+    assert progress.rows == 100 and progress.parts > 2
+    assert all(data.endswith(b'\n') for _, data in standin.uploads['events'])
+
+
+def test_compressed_files_are_sent_whole(connection, standin, tmp_path):
+    path = tmp_path / 'events.csv.gz'
+    path.write_bytes(gzip.compress(to_csv([HEADER] + ROWS)))
+    progress = connection.upload('events', str(path), part_size=1024)
+    assert progress.parts == 1
+    assert parts(standin) == [[HEADER] + ROWS]
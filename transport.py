@@ -0,0 +1,600 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
+#             https://github.com/cloudflare/sqlalchemy-clickhouse
+
+from email.utils import parsedate_to_datetime
+import gzip
+import io
+from functools import lru_cache
+import random
+import socket
+import threading
+import time
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+from requests import RequestException, Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from error import DatabaseError, NotSupportedError, OperationalError, ProgrammingError, RateLimitError, ServerError
+from instrument import QueryTimings, add_connect_time, take_connect_time
+
+
+# Defaults for the shared transports
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 32
+
+# Request bodies smaller than this are sent uncompressed
+DEFAULT_COMPRESS_THRESHOLD = 4096
+
+# Settings sent with every query. Closing a response, e.g. on cancel, stops its query on the server.
+# Decimals are sent as JSON strings, which keep their digits and scale, instead of numbers that
+# json.loads would round through float.
+DEFAULT_SETTINGS = {'cancel_http_readonly_queries_on_client_close': 1, 'output_format_json_quote_decimals': 1}
+
+# Retries of failed requests, with exponential backoff of BACKOFF * 2^n seconds (at most MAX_BACKOFF)
+DEFAULT_MAX_RETRIES = 3
+BACKOFF = 0.1
+MAX_BACKOFF = 10.0
+
+
+class TransportStats(object):
+    """ Request and connection counters of a host """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.handshakes = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+    @property
+    def reused(self) -> int:
+        """ Number of requests sent over an already established connection """
+        return self.requests - self.handshakes
+
+    def _count(self, handshake: bool):
+        with self._lock:
+            self.requests += 1
+            if handshake:
+                self.handshakes += 1
+
+    def _count_retry(self, rate_limited: bool):
+        with self._lock:
+            self.retries += 1
+            if rate_limited:
+                self.rate_limited += 1
+
+    def as_dict(self) -> Dict[str, int]:
+        return {'requests': self.requests, 'handshakes': self.handshakes, 'reused': self.reused,
+                'retries': self.retries, 'rate_limited': self.rate_limited}
+
+
+# The InFlight of the requests sent by the current thread, if any
+_local = threading.local()
+
+
+class InFlight(object):
+    """ The requests a thread sends while it is entered, so another thread can abort them.
+
+    :meth:`cancel` shuts down the connection of the request waiting for its response, or of
+    the response being read, and closes the response. Requests sent after it fail with
+    :class:`error.OperationalError` instead of being retried. Entered one inside another,
+    cancelling the outer one also cancels the requests of the inner one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._outer: Optional['InFlight'] = None
+        self._conn = None
+        self.response: Optional[Response] = None
+
+    def __enter__(self) -> 'InFlight':
+        self._outer = getattr(_local, 'inflight', None)
+        _local.inflight = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.inflight = self._outer
+        with self._lock:
+            self._conn = self.response = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled or (self._outer is not None and self._outer.cancelled)
+
+    def _attach(self, conn):
+        with self._lock:
+            self._conn = conn
+        if self._outer is not None:
+            self._outer._attach(conn)
+
+    def _detach(self, conn):
+        # The connection went back to the pool, where it may be taken by another thread
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+        if self._outer is not None:
+            self._outer._detach(conn)
+
+    def _set_response(self, r: Response):
+        with self._lock:
+            self.response = r
+        if self._outer is not None:
+            self._outer._set_response(r)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            conn, r = self._conn, self.response
+        sock = getattr(conn, 'sock', None)
+        if sock is not None:
+            # Unlike closing it, shutting the socket down wakes up the thread blocked reading it
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if r is not None:
+            r.close()
+
+
+def current_inflight() -> Optional[InFlight]:
+    """ The :class:`InFlight` entered by the current thread, if any """
+    return getattr(_local, 'inflight', None)
+
+
+class _CountingPoolMixin(object):
+    """ Counts handshakes per host and closes pooled connections left idle for too long """
+    stats: TransportStats = None
+    idle_timeout: Optional[float] = None
+
+    def _get_conn(self, timeout=None):
+        conn = super(_CountingPoolMixin, self)._get_conn(timeout)
+        if (self.idle_timeout is not None and conn.sock is not None and
+                time.monotonic() - getattr(conn, '_tb_last_used', 0) > self.idle_timeout):
+            conn.close()
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn._tb_last_used = time.monotonic()
+            inflight = current_inflight()
+            if inflight is not None:
+                inflight._detach(conn)
+        super(_CountingPoolMixin, self)._put_conn(conn)
+
+    def _new_conn(self):
+        conn = super(_CountingPoolMixin, self)._new_conn()
+        connect = conn.connect
+
+        def timed_connect():
+            # Reported in the connect phase of the query opening the connection
+            start = time.perf_counter()
+            try:
+                connect()
+            finally:
+                add_connect_time(time.perf_counter() - start)
+            # Cancelled before there was a socket to shut down
+            inflight = current_inflight()
+            if inflight is not None and inflight.cancelled:
+                conn.close()
+                raise OSError("Request cancelled")
+        conn.connect = timed_connect
+        return conn
+
+    def _make_request(self, conn, *args, **kwargs):
+        # Connections are opened lazily, on their first request
+        self.stats._count(handshake=getattr(conn, 'sock', None) is None)
+        inflight = current_inflight()
+        if inflight is not None:
+            inflight._attach(conn)
+        return super(_CountingPoolMixin, self)._make_request(conn, *args, **kwargs)
+
+
+class _CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class TransportAdapter(HTTPAdapter):
+    """ ``HTTPAdapter`` whose connection pools report to a :class:`TransportStats` """
+
+    def __init__(self, stats: TransportStats, idle_timeout: Optional[float] = None, **kwargs):
+        attrs = {'stats': stats, 'idle_timeout': idle_timeout}
+        self._pool_classes = {
+            'http': type('HTTPConnectionPool', (_CountingHTTPConnectionPool,), attrs),
+            'https': type('HTTPSConnectionPool', (_CountingHTTPSConnectionPool,), attrs),
+        }
+        super(TransportAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(TransportAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self._pool_classes
+
+
+class TokenBucket(object):
+    """ Client-side rate limiter shared by the requests of a token.
+
+    Without a ``rate`` requests are not limited until the rate limit headers of a response,
+    or a 429 answer, say otherwise. Requests over the budget are spread evenly instead of
+    being sent, and rejected, all at once.
+    """
+
+    def __init__(self, rate: Optional[float] = None, capacity: Optional[float] = None):
+        """
+            - `rate`: requests per second.
+            - `capacity`: requests that can be sent at once, ``rate`` by default.
+        """
+        self.rate = rate
+        self.capacity = capacity or rate or 1.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if self.rate is not None:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """ Takes a token and returns the seconds to wait before sending the request """
+        with self._lock:
+            now = time.monotonic()
+            delay = self._blocked_until - now
+            if self.rate is not None:
+                self._refill(now)
+                self._tokens -= 1
+                if self._tokens < 0:
+                    delay = max(delay, -self._tokens / self.rate)
+            return max(delay, 0.0)
+
+    def acquire(self) -> float:
+        """ Waits until a request can be sent and returns how long it waited """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def update(self, limit: Optional[float] = None, remaining: Optional[float] = None, reset: Optional[float] = None):
+        """ Adjusts the rate to spend the ``remaining`` requests of the current window evenly over
+        the ``reset`` seconds left in it.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if limit:
+                self.capacity = limit
+            if remaining is not None and reset:
+                self.rate = max(remaining, 1.0) / reset
+                self._tokens = min(self._tokens, remaining)
+
+    def block(self, seconds: float):
+        """ Stops every request for ``seconds``, e.g. after a 429 answer """
+        with self._lock:
+            now = time.monotonic()
+            self._blocked_until = max(self._blocked_until, now + seconds)
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+
+
+def _header_float(headers, name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def retry_after(headers) -> Optional[float]:
+    """ Returns the seconds of a ``Retry-After`` header, given in seconds or as an HTTP date """
+    value = headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def update_bucket(bucket: TokenBucket, headers):
+    """ Feeds the ``X-RateLimit-*`` headers of a response to ``bucket`` """
+    remaining = _header_float(headers, 'X-RateLimit-Remaining')
+    reset = _header_float(headers, 'X-RateLimit-Reset')
+    if reset is not None and reset > 1e9:
+        # An epoch timestamp rather than a number of seconds
+        reset -= time.time()
+    if remaining is not None or reset is not None:
+        bucket.update(_header_float(headers, 'X-RateLimit-Limit'), remaining,
+                      reset if reset is not None and reset > 0 else None)
+
+
+def backoff(attempt: int) -> float:
+    """ Seconds to wait before retry number ``attempt`` (from 0), with full jitter """
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF * 2 ** attempt))
+
+
+def error_for(status: int, message: str, headers=None) -> DatabaseError:
+    """ Returns the exception matching the HTTP status of a failed response """
+    delay = retry_after(headers) if headers is not None else None
+    if status == 429:
+        return RateLimitError(message, status, delay)
+    if status >= 500:
+        return ServerError(message, status, delay)
+    if status in (400, 404):
+        return ProgrammingError(message, status)
+    if status in (401, 403):
+        return OperationalError(message, status)
+    return DatabaseError(message, status)
+
+
+def retryable(status: int, idempotent: bool) -> bool:
+    """ Whether a response with ``status`` can be retried. Rate-limited requests are never run,
+    so they can always be sent again.
+    """
+    return status == 429 or (idempotent and status in (502, 503, 504))
+
+
+def send(session: Session, method: str, url: str, bucket: Optional[TokenBucket] = None,
+         max_retries: int = DEFAULT_MAX_RETRIES, idempotent: bool = True, timings: Optional[QueryTimings] = None,
+         **kwargs) -> Response:
+    """ Sends a request through ``bucket`` and returns its successful response.
+
+    429 answers are retried, as well as gateway errors and connection failures of ``idempotent``
+    requests, up to ``max_retries`` times with exponential backoff and jitter, or after the
+    ``Retry-After`` delay when the server gives one. Failures raise the matching
+    :class:`error.DatabaseError`.
+
+    The time until the response headers arrive is added to the ``connect`` and ``ttfb`` phases
+    of ``timings``.
+
+    Within an :class:`InFlight`, the response is kept in it before it is returned.
+    """
+    stats = _stats.get(_host_key(url))
+    inflight = current_inflight()
+    attempt = 0
+    start = time.perf_counter()
+    take_connect_time()
+    while True:
+        if bucket is not None:
+            bucket.acquire()
+        if inflight is not None and inflight.cancelled:
+            raise OperationalError("Request cancelled")
+        rate_limited = False
+        try:
+            r = session.request(method, url, **kwargs)
+        except RequestException as e:
+            if not idempotent or attempt >= max_retries or (inflight is not None and inflight.cancelled):
+                raise OperationalError(str(e)) from e
+            delay = None
+        else:
+            if bucket is not None:
+                update_bucket(bucket, r.headers)
+            if inflight is not None:
+                inflight._set_response(r)
+                if inflight.cancelled:
+                    r.close()
+                    raise OperationalError("Request cancelled")
+            if r.status_code < 400:
+                if timings is not None:
+                    connect = take_connect_time()
+                    timings.connect += connect
+                    timings.ttfb += time.perf_counter() - start - connect
+                return r
+            delay = retry_after(r.headers)
+            rate_limited = r.status_code == 429
+            if rate_limited and bucket is not None:
+                bucket.block(delay if delay is not None else backoff(attempt))
+            if attempt >= max_retries or not retryable(r.status_code, idempotent):
+                raise error_for(r.status_code, read_content(r).decode('utf-8', 'replace'), r.headers)
+            r.close()
+        if stats is not None:
+            stats._count_retry(rate_limited)
+        time.sleep(max(delay or 0.0, backoff(attempt)))
+        attempt += 1
+
+
+_lock = threading.Lock()
+_sessions: Dict[Tuple[Any, ...], Session] = {}
+_stats: Dict[str, TransportStats] = {}
+_buckets: Dict[Tuple[str, Optional[str]], TokenBucket] = {}
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+def get_session(url: str, pool_connections: Optional[int] = None, pool_maxsize: Optional[int] = None,
+                pool_block: bool = False, keep_alive: bool = True, idle_timeout: Optional[float] = None,
+                verify: bool = True) -> Session:
+    """ Returns the process-wide session for the host of ``url``.
+
+    Connections sharing a host and options share the session, so TLS handshakes are only paid
+    once per pooled connection instead of once per :class:`connection.Connection`.
+
+    - `pool_connections`: number of per-host pools cached by the session.
+    - `pool_maxsize`: maximum number of connections kept open to the host.
+    - `pool_block`: block instead of opening extra connections when the pool is exhausted.
+    - `keep_alive`: reuse connections between requests.
+    - `idle_timeout`: seconds after which an idle pooled connection is closed instead of reused.
+    """
+    host = _host_key(url)
+    key = (host, pool_connections, pool_maxsize, pool_block, keep_alive, idle_timeout, verify)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            stats = _stats.setdefault(host, TransportStats())
+            adapter = TransportAdapter(
+                stats, idle_timeout=idle_timeout,
+                pool_connections=pool_connections or DEFAULT_POOL_CONNECTIONS,
+                pool_maxsize=pool_maxsize or DEFAULT_POOL_MAXSIZE,
+                pool_block=pool_block)
+            session = Session()
+            session.verify = verify
+            session.mount(host, adapter)
+            if not keep_alive:
+                session.headers['Connection'] = 'close'
+            _sessions[key] = session
+        return session
+
+
+def get_bucket(url: str, token: Optional[str], rate: Optional[float] = None) -> TokenBucket:
+    """ Returns the process-wide :class:`TokenBucket` of a token on the host of ``url`` """
+    key = (_host_key(url), token)
+    with _lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = TokenBucket(rate)
+        return bucket
+
+
+def pool_stats() -> Dict[str, Dict[str, int]]:
+    """ Returns the request, handshake and reuse counters of every host, e.g.
+    ``{'https://api.tinybird.co': {'requests': 10, 'handshakes': 2, 'reused': 8}}``
+    """
+    with _lock:
+        return {host: stats.as_dict() for host, stats in _stats.items()}
+
+
+def reset():
+    """ Closes every shared session and clears the counters """
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _stats.clear()
+        _buckets.clear()
+
+
+@lru_cache(maxsize=1)
+def import_zstd():
+    """ Returns the ``zstandard`` module or ``None`` when it is not installed """
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def accept_encoding() -> str:
+    """ Value of the ``Accept-Encoding`` header for the encodings we can decode while streaming """
+    return 'zstd, gzip, deflate' if import_zstd() is not None else 'gzip, deflate'
+
+
+def encode_body(body: bytes, compression: Optional[str] = None,
+                threshold: int = DEFAULT_COMPRESS_THRESHOLD) -> Tuple[bytes, Optional[str]]:
+    """ Compresses a request body of at least ``threshold`` bytes.
+
+    Returns the body and the value of its ``Content-Encoding`` header, or ``None`` if it was
+    left uncompressed.
+    """
+    if not compression or len(body) < threshold:
+        return body, None
+    if compression == 'gzip':
+        return gzip.compress(body, compresslevel=6), 'gzip'
+    if compression == 'zstd':
+        zstd = import_zstd()
+        if zstd is None:
+            raise NotSupportedError("zstandard is required for zstd compression")
+        return zstd.ZstdCompressor().compress(body), 'zstd'
+    raise NotSupportedError("Unsupported compression: {}".format(compression))
+
+
+def settings_params(settings: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """ Returns query settings (and the ``query_id``) as URL parameters """
+    if not settings:
+        return {}
+    return {name: ('1' if value else '0') if isinstance(value, bool) else str(value)
+            for name, value in settings.items() if value is not None}
+
+
+def _is_zstd(r: Response) -> bool:
+    return r.headers.get('Content-Encoding', '').strip().lower() == 'zstd'
+
+
+def iter_content(r: Response, chunk_size: int) -> Iterator[bytes]:
+    """ Yields the decoded body of a response as it arrives.
+
+    gzip and deflate are decoded by urllib3; zstd, which urllib3 may not know about, is read raw
+    and decoded here.
+    """
+    if not _is_zstd(r):
+        yield from r.iter_content(chunk_size)
+        return
+    decompressor = import_zstd().ZstdDecompressor().decompressobj()
+    for chunk in r.raw.stream(chunk_size, decode_content=False):
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+
+
+def iter_lines(r: Response, chunk_size: int) -> Iterator[bytes]:
+    """ Yields the non-empty lines of a response as they arrive """
+    pending = b''
+    for chunk in iter_content(r, chunk_size):
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            if line:
+                yield line
+    if pending:
+        yield pending
+
+
+def read_content(r: Response) -> bytes:
+    """ Returns the whole decoded body of a streamed response """
+    if not _is_zstd(r):
+        return r.content
+    # Read raw, as urllib3 2 decodes zstd on its own when zstandard is installed
+    return b''.join(iter_content(r, 64 * 1024))
+
+
+class _ChunkReader(io.RawIOBase):
+    """ Readable file over an iterator of byte chunks """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._pending = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            self._pending = next(self._chunks, b'')
+            if not self._pending:
+                return 0
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def raw_reader(r: Response, chunk_size: int = 64 * 1024) -> BinaryIO:
+    """ Returns a file-like object reading the decoded body of a streamed response.
+
+    Reads only return an empty result at the end of the body, unlike ``r.raw`` for
+    compressed responses.
+    """
+    return io.BufferedReader(_ChunkReader(iter_content(r, chunk_size)), chunk_size)
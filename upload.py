@@ -0,0 +1,321 @@
+# sqlalchemy-tinybird: A Tinybird connector for SQLAlchemy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#   Portions: https://github.com/snowflakedb/snowflake-sqlalchemy
+#             https://github.com/cloudflare/sqlalchemy-clickhouse
+
+import bisect
+import csv
+import io
+import json
+import os
+import re
+import time
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import uuid
+import zlib
+
+from requests import Session
+
+from error import NotSupportedError
+from ingest import encode_row
+import transport
+
+
+# Defaults for the Data Sources API uploads
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_PART_SIZE = 1024 * 1024 * 1024
+
+FORMATS = ('csv', 'ndjson', 'parquet')
+
+_extensions = {
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.json': 'ndjson',
+    '.parquet': 'parquet',
+}
+
+_RE_LINE_BREAK = re.compile(b'\n')
+_RE_CSV_SPECIAL = re.compile(b'["\n]')
+
+
+class UploadProgress(object):
+    """ Rows and bytes sent by an upload so far.
+
+    Rows are counted as records for CSV, header excluded, and as lines for NDJSON. They are not
+    counted for Parquet.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.parts = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+        # Responses of the Data Sources API, one per part
+        self.results: List[Dict[str, Any]] = []
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    def _update(self, rows: int, nbytes: int):
+        self.rows += rows
+        self.bytes += nbytes
+        self.elapsed = time.monotonic() - self.started
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'rows': self.rows, 'bytes': self.bytes, 'parts': self.parts, 'elapsed': self.elapsed,
+            'rows_per_second': self.rows_per_second, 'bytes_per_second': self.bytes_per_second,
+        }
+
+
+class _Source(object):
+    """ Blocks of ``chunk_size`` bytes of the payload, with room to push back the start of the next part.
+
+    For CSV, line breaks only end records outside quoted fields, which may span blocks.
+    """
+
+    def __init__(self, blocks: Iterator[bytes], csv_records: bool = False):
+        self._blocks = blocks
+        self._pending = b''
+        self.eof = False
+        self._csv = csv_records
+        # Whether the last block read ended inside a quoted CSV field
+        self._quoted = False
+        # Header record repeated at the start of every part but the first, if any
+        self.header = b''
+
+    def record_ends(self, block: bytes) -> List[int]:
+        """ Returns the offsets of the line breaks ending records in ``block``, the next block of
+        the payload.
+        """
+        if not self._csv or (not self._quoted and b'"' not in block):
+            return [m.start() for m in _RE_LINE_BREAK.finditer(block)]
+        # Quotes inside quoted fields are doubled, so each one toggles the state
+        ends = []
+        quoted = self._quoted
+        for m in _RE_CSV_SPECIAL.finditer(block):
+            if m.group() == b'"':
+                quoted = not quoted
+            elif not quoted:
+                ends.append(m.start())
+        self._quoted = quoted
+        return ends
+
+    def read(self) -> bytes:
+        if self._pending:
+            block, self._pending = self._pending, b''
+            return block
+        block = next(self._blocks, b'')
+        if not block:
+            self.eof = True
+        return block
+
+    def unread(self, block: bytes):
+        """ Pushes back the rest of a block cut at the end of a record """
+        self._pending = block
+        self._quoted = False
+
+
+def _file_blocks(f: BinaryIO, chunk_size: int) -> Iterator[bytes]:
+    while True:
+        block = f.read(chunk_size)
+        if not block:
+            return
+        yield block.encode('utf-8') if isinstance(block, str) else block
+
+
+def _row_blocks(rows: Iterable[Any], fmt: str, chunk_size: int) -> Iterator[bytes]:
+    """ Encodes rows (dicts for NDJSON, sequences for CSV) into blocks of about ``chunk_size`` bytes """
+    if fmt == 'ndjson':
+        lines = []
+        size = 0
+        for row in rows:
+            line = encode_row(row)
+            lines.append(line)
+            size += len(line) + 1
+            if size >= chunk_size:
+                lines.append(b'')
+                yield b'\n'.join(lines)
+                lines = []
+                size = 0
+        if lines:
+            lines.append(b'')
+            yield b'\n'.join(lines)
+    elif fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= chunk_size:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+    else:
+        raise NotSupportedError("Rows can only be uploaded as CSV or NDJSON")
+
+
+def _part_blocks(source: _Source, part_size: Optional[int], progress: UploadProgress, count_rows: bool,
+                 callback: Optional[Callable[[UploadProgress], None]], header: bool = False) -> Iterator[bytes]:
+    """ Yields the blocks of the next part, ending it at the last record end within ``part_size``
+    bytes, or at the first one after it. With ``header``, the first record of the payload is
+    repeated at the start of every later part.
+    """
+    sent = 0
+    block = source.read()
+    if block and source.header:
+        sent += len(source.header)
+        progress._update(0, len(source.header))
+        yield source.header
+    while block:
+        ends = source.record_ends(block) if count_rows else []
+        rows = len(ends)
+        # Records before this one in the part, which may not be cut off on their own
+        first = 0
+        if header and not progress.parts and not progress.bytes and ends:
+            source.header = block[:ends[0] + 1]
+            rows -= 1
+            first = 1
+        last = False
+        if part_size is not None and sent + len(block) >= part_size and len(ends) > first:
+            i = max(bisect.bisect_right(ends, part_size - sent - 1) - 1, first)
+            cut = ends[i]
+            source.unread(block[cut + 1:])
+            rows -= len(ends) - i - 1
+            block = block[:cut + 1]
+            last = True
+        sent += len(block)
+        progress._update(rows, len(block))
+        if callback is not None:
+            callback(progress)
+        yield block
+        if last:
+            return
+        block = source.read()
+
+
+def _has_header(source: _Source) -> bool:
+    """ Guesses whether CSV data starts with a header, from its first block """
+    block = source.read()
+    source.unread(block)
+    sample = block[:block.rfind(b'\n', 0, 64 * 1024) + 1] or block
+    try:
+        return csv.Sniffer().has_header(sample.decode('utf-8', 'replace'))
+    except csv.Error:
+        return False
+
+
+def _gzip_blocks(blocks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _multipart(blocks: Iterator[bytes], field: str, filename: str, boundary: str) -> Iterator[bytes]:
+    yield (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+           f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+    yield from blocks
+    yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+
+def upload(session: Session, api_url: str, token: str, datasource: str, data: Union[str, os.PathLike, BinaryIO, Iterable[Any]],
+           format: Optional[str] = None, mode: str = 'append', compression: Optional[str] = None,
+           chunk_size: int = DEFAULT_CHUNK_SIZE, part_size: Optional[int] = DEFAULT_PART_SIZE,
+           progress: Optional[Callable[[UploadProgress], None]] = None, timeout: Optional[float] = None,
+           rate_limiter: Optional[transport.TokenBucket] = None, header: Optional[bool] = None) -> UploadProgress:
+    """ Streams ``data`` to the Data Sources API and returns the final :class:`UploadProgress`.
+
+    See :meth:`connection.Connection.upload` for the arguments. Streamed bodies can't be sent
+    again, so failed parts are not retried.
+    """
+    path = None
+    compressed = False
+    if isinstance(data, (str, os.PathLike)):
+        path = os.fspath(data)
+        compressed = path.endswith('.gz')
+        if format is None:
+            format = _extensions.get(os.path.splitext(path[:-3] if compressed else path)[1].lower())
+    format = format or 'ndjson'
+    if format not in FORMATS:
+        raise NotSupportedError("Unsupported upload format: {}".format(format))
+    if compression not in (None, 'gzip'):
+        raise NotSupportedError("Uploads can only be compressed with gzip")
+
+    f = None
+    if path is not None:
+        f = data = open(path, 'rb')
+    try:
+        if hasattr(data, 'read'):
+            source = _Source(_file_blocks(data, chunk_size), format == 'csv')
+        else:
+            source = _Source(_row_blocks(data, format, chunk_size), format == 'csv')
+            # Rows are written without a header
+            header = False
+        # Parquet and already compressed files can't be split at line breaks
+        count_rows = format != 'parquet' and not compressed
+        if not count_rows:
+            part_size = None
+        if compressed:
+            compression = None
+        if format != 'csv' or not count_rows:
+            header = False
+        elif header is None:
+            header = _has_header(source)
+
+        result = UploadProgress()
+        url = f"{api_url.rstrip('/')}/v0/datasources"
+        filename = f'{datasource}.{format}' + ('.gz' if compression or compressed else '')
+        while not source.eof:
+            blocks = _part_blocks(source, part_size, result, count_rows, progress, header)
+            first = next(blocks, None)
+            if first is None:
+                break
+            blocks = _chain(first, blocks)
+            if compression:
+                blocks = _gzip_blocks(blocks)
+            boundary = uuid.uuid4().hex
+            req_headers = {
+                'Authorization': f'Bearer {token}',
+                'Content-Type': f'multipart/form-data; boundary={boundary}',
+            }
+            req_params = {'name': datasource, 'mode': mode, 'format': format}
+            # A generator body is sent with chunked transfer encoding
+            r = transport.send(session, 'POST', url, rate_limiter, max_retries=0, idempotent=False, params=req_params,
+                               data=_multipart(blocks, format, filename, boundary), headers=req_headers, timeout=timeout)
+            result.parts += 1
+            result.results.append(json.loads(r.content))
+            # Later parts of a replace must not replace the earlier ones
+            if mode == 'replace':
+                mode = 'append'
+        return result
+    finally:
+        if f is not None:
+            f.close()
+
+
+def _chain(first: bytes, blocks: Iterator[bytes]) -> Iterator[bytes]:
+    yield first
+    yield from blocks